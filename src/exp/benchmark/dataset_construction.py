@@ -0,0 +1,113 @@
+"""Benchmark the construction of `FinQADatasetCollection`.
+
+Compares the columnar collection with the previous path that created one Pydantic sample,
+`MetaData` and `Document` per row. Every case runs in a fresh process so that the peak RSS of
+one case does not leak into the next one.
+
+Usage:
+    uv run python -m exp.benchmark.dataset_construction --sizes 10000 100000
+"""
+
+import argparse
+import multiprocessing
+import resource
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+from encourage.prompts.context import Document
+from encourage.prompts.meta_data import MetaData
+
+from exp.benchmark.synthetic import META_DATA_KEYS, synthetic_finqa_frame
+from exp.data.finqa_qa import FinQADatasetCollection, FinQADatasetSample
+
+
+def legacy_construction(df: pd.DataFrame, meta_data_keys: list[str]) -> tuple:
+    """Build samples, metadata and documents the way the row-based collection did."""
+    required_columns = [
+        "id",
+        "question",
+        "answer",
+        "program_answer",
+        "program_solution",
+        "context",
+    ] + meta_data_keys
+    df = df[[col for col in required_columns if col in df.columns]].copy()
+    df.loc[:, "context"] = df["context"].apply(
+        lambda val: "\n\n".join(map(str, val.flatten())) if isinstance(val, np.ndarray) else val
+    )
+    samples = [
+        FinQADatasetSample(**{str(k): v for k, v in record.items()})
+        for record in df.to_dict(orient="records")
+    ]
+    context_dict: dict = {}
+    for sample in samples:
+        if sample.context not in context_dict:
+            context_dict[sample.context] = str(uuid.uuid4())
+        sample.context_id = context_dict[sample.context]
+    meta_datas = [
+        MetaData(
+            {
+                "reference_answer": sample.program_answer or "",
+                "id": sample.id,
+                "reference_document": Document(
+                    id=uuid.UUID(sample.context_id), content=sample.context or ""
+                ),
+            }
+        )
+        for sample in samples
+    ]
+    documents = [
+        Document(
+            id=uuid.UUID(sample.context_id),
+            content=sample.context or "",
+            meta_data=MetaData({key: getattr(sample, key, None) for key in meta_data_keys}),
+        )
+        for sample in samples
+    ]
+    return samples, meta_datas, documents
+
+
+def _run_case(args: tuple[str, int]) -> dict:
+    backend, n_rows = args
+    df = synthetic_finqa_frame(n_rows)
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    if backend == "legacy":
+        legacy_construction(df, META_DATA_KEYS)
+    else:
+        FinQADatasetCollection(df, meta_data_keys=META_DATA_KEYS)
+    elapsed = time.perf_counter() - start
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "backend": backend,
+        "rows": n_rows,
+        "seconds": elapsed,
+        "peak_rss_increase_mb": (peak_kb - baseline_kb) / 1024,
+    }
+
+
+def main() -> None:
+    """Run the benchmark and print a table with the results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for n_rows in args.sizes:
+        for backend in ("legacy", "columnar"):
+            with context.Pool(1) as pool:
+                results.append(pool.apply(_run_case, ((backend, n_rows),)))
+
+    print(f"{'backend':<10} {'rows':>8} {'seconds':>9} {'peak RSS +MB':>13}")
+    for result in results:
+        print(
+            f"{result['backend']:<10} {result['rows']:>8} {result['seconds']:>9.2f} "
+            f"{result['peak_rss_increase_mb']:>13.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""End-to-end benchmark of execution and evaluation against the mock LLM server.
+
+Every size runs `execute` on a synthetic FinQA dataset in a fresh process, against a local
+`MockServer` with deterministic latency and schema-following JSON answers. The throughput, the
+peak RSS and the stage timings from `profile.json` are printed and appended to a results file
+per git commit, so that two commits can be compared with `--compare`.
+
+Usage (from the repository root):
+    uv run python -m exp.benchmark.end_to_end --sizes 100 1000 --context-sharing 0.75
+    uv run python -m exp.benchmark.end_to_end --sizes 100 1000 --compare HEAD~1
+"""
+
+import argparse
+import json
+import multiprocessing
+import resource
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+from exp.utils.file_manager import FileManager
+
+config_path = str((Path(__file__).parents[3] / "conf").resolve())
+
+MOCK_MODEL = "mock-model"
+# Metrics that run without a GPU, the SQuAD metric and the NLTK data are downloaded on first use
+DEFAULT_METRICS = "[ExactMatch,F1,NumberMatch,GeneratedAnswerLength,ReferenceAnswerLength]"
+
+
+def git_commit(ref: str = "HEAD") -> str:
+    """Get the commit hash of a git reference, with a `-dirty` suffix for local changes."""
+    commit = subprocess.run(
+        ["git", "rev-parse", "--short", ref], capture_output=True, text=True, check=True
+    ).stdout.strip()
+    if ref == "HEAD":
+        status = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        if status.strip():
+            commit += "-dirty"
+    return commit
+
+
+def _run_case(args: tuple[int, float, int, float, list[str], str]) -> dict[str, Any]:
+    # Imported here so that the spawned process pays for the imports outside the measurement
+    from hydra import compose, initialize_config_dir
+
+    from exp.benchmark.synthetic import synthetic_finqa_frame
+    from exp.data.finqa_qa import normalize_finqa_frame
+    from exp.evaluation.execution import execute, prepare_resources
+    from exp.inference.mock_server import MockServer, MockServerConfig, mock_overrides
+    from exp.utils.profiler import PROFILE_NAME, profiling
+
+    n_rows, sharing, context_length, latency_s, overrides, work_dir = args
+    output_dir = Path(work_dir) / f"rows_{n_rows}"
+    with MockServer(MockServerConfig(model_name=MOCK_MODEL, latency_s=latency_s)) as server:
+        with initialize_config_dir(config_dir=config_path, version_base=None):
+            cfg = compose(
+                "defaults",
+                overrides=[
+                    *mock_overrides(server.base_url, MOCK_MODEL),
+                    f"mlflow.uri=file:{Path(work_dir) / 'mlruns'}",
+                    f"metrics={DEFAULT_METRICS}",
+                    *overrides,
+                ],
+            )
+        df = synthetic_finqa_frame(
+            n_rows, context_length=context_length, context_sharing_ratio=sharing
+        )
+        qa_dataset = normalize_finqa_frame(df, list(cfg.dataset.meta_data_keys))
+        del df
+
+        baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.perf_counter()
+        with profiling():
+            execute(cfg, output_dir, prepare_resources(cfg, qa_dataset))  # ty: ignore
+        elapsed = time.perf_counter() - start
+        peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    profile = FileManager(output_dir / PROFILE_NAME).load_json()
+    return {
+        "rows": n_rows,
+        "context_sharing": sharing,
+        "context_length": context_length,
+        "latency_s": latency_s,
+        "seconds": elapsed,
+        "samples_per_second": n_rows / elapsed if elapsed else 0.0,
+        "peak_rss_increase_mb": (peak_kb - baseline_kb) / 1024,
+        "stages": {name: stage["seconds"] for name, stage in profile["stages"].items()},
+        "requests": profile["requests"],
+    }
+
+
+def load_results(results_dir: Path, commit: str) -> list[dict[str, Any]]:
+    """Load the stored results of a commit."""
+    file_manager = FileManager(results_dir / f"{commit}.jsonl")
+    return list(file_manager.iter_jsonlines()) if file_manager.file_exists() else []
+
+
+def print_results(results: list[dict[str, Any]], baseline: list[dict[str, Any]] = []) -> None:
+    """Print the results, with the change against a baseline of the same sizes."""
+    baseline_by_rows = {result["rows"]: result for result in baseline}
+    print(f"{'rows':>8} {'seconds':>9} {'samples/s':>10} {'peak RSS +MB':>13} {'vs base':>8}")
+    for result in results:
+        base = baseline_by_rows.get(result["rows"])
+        change = ""
+        if base is not None and base["samples_per_second"]:
+            ratio = result["samples_per_second"] / base["samples_per_second"] - 1
+            change = f"{ratio:+.1%}"
+        print(
+            f"{result['rows']:>8} {result['seconds']:>9.2f} {result['samples_per_second']:>10.1f} "
+            f"{result['peak_rss_increase_mb']:>13.1f} {change:>8}"
+        )
+        stages = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in result["stages"].items())
+        print(f"{'':>8} {stages}")
+
+
+def main() -> None:
+    """Run the benchmark, store and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1_000])
+    parser.add_argument("--context-sharing", type=float, default=0.75)
+    parser.add_argument("--context-length", type=int, default=2_000)
+    parser.add_argument("--latency", type=float, default=0.05, help="Mock seconds per request")
+    parser.add_argument("--results-dir", type=Path, default=Path("benchmarks"))
+    parser.add_argument("--compare", default=None, help="Git reference of the baseline")
+    args, overrides = parser.parse_known_args()
+
+    commit = git_commit()
+    context = multiprocessing.get_context("spawn")
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for n_rows in args.sizes:
+            case = (
+                n_rows,
+                args.context_sharing,
+                args.context_length,
+                args.latency,
+                overrides,
+                work_dir,
+            )
+            with context.Pool(1) as pool:
+                results.append(pool.apply(_run_case, (case,)))
+
+    timestamp = datetime.now().isoformat(timespec="seconds")
+    results_file = FileManager(args.results_dir / f"{commit}.jsonl")
+    results_file.append(
+        "".join(json.dumps({"commit": commit, "timestamp": timestamp, **r}) + "\n" for r in results)
+    )
+
+    baseline = load_results(args.results_dir, git_commit(args.compare)) if args.compare else []
+    print(f"Results of {commit}, stored in {results_file.filepath}")
+    print_results(results, baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""Benchmark reading and writing inference logs with `FileManager`.
+
+Compares the previous whole-string `dump_jsonlines`/`load_jsonlines` with the streaming
+`write_jsonlines`/`iter_jsonlines`, with the json and orjson backends and with compression.
+Every case runs in a fresh process so that the peak RSS of one case does not leak into the
+next one.
+
+Usage:
+    uv run python -m exp.benchmark.file_manager --records 20000 --context-length 8000
+"""
+
+import argparse
+import json
+import multiprocessing
+import resource
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Iterator
+
+from exp.utils.file_manager import FileManager
+
+CASES = [
+    ("legacy", "json", ".jsonl"),
+    ("streaming", "json", ".jsonl"),
+    ("streaming", "orjson", ".jsonl"),
+    ("streaming", "orjson", ".jsonl.gz"),
+    ("streaming", "orjson", ".jsonl.zst"),
+]
+
+
+def synthetic_records(n_records: int, context_length: int) -> Iterator[dict[str, Any]]:
+    """Create records shaped like `Response.to_dict()` with the full context text."""
+    context = ("Revenue grew by 4.2% to $1,234 million. " * context_length)[:context_length]
+    for i in range(n_records):
+        yield {
+            "request_id": f"request-{i}",
+            "prompt_id": f"prompt-{i}",
+            "sys_prompt": "You are a financial analyst.",
+            "user_prompt": f"What was the revenue growth in year {2000 + i % 20}?",
+            "response": "1234 * 0.042",
+            "conversation_id": 0,
+            "meta_data": {"id": f"sample-{i}", "reference_answer": "51.8"},
+            "context": {"documents": [{"id": str(i % 500), "content": context}]},
+            "arrival_time": 0.0,
+            "finished_time": 1.0,
+            "processing_time": 1.0,
+        }
+
+
+def _legacy_write(filepath: Path, records: list[dict[str, Any]]) -> None:
+    lines = "\n".join(json.dumps(item, ensure_ascii=False) for item in records)
+    with open(filepath, "wt", encoding="utf-8") as file:
+        file.write(f"{lines}\n")
+
+
+def _legacy_read(filepath: Path) -> int:
+    with open(filepath, "rt", encoding="utf-8") as file:
+        lines = file.read().strip().splitlines()
+    return sum(1 for _ in (json.loads(line) for line in lines))
+
+
+def _run_case(args: tuple[str, str, str, int, int]) -> dict:
+    mode, backend, suffix, n_records, context_length = args
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filepath = Path(tmp_dir) / f"inference_log{suffix}"
+        file_manager = FileManager(filepath, json_backend=backend)
+        baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        start = time.perf_counter()
+        if mode == "legacy":
+            _legacy_write(filepath, list(synthetic_records(n_records, context_length)))
+        else:
+            file_manager.write_jsonlines(synthetic_records(n_records, context_length))
+        write_seconds = time.perf_counter() - start
+        write_peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        start = time.perf_counter()
+        if mode == "legacy":
+            _legacy_read(filepath)
+        else:
+            sum(1 for _ in file_manager.iter_jsonlines())
+        read_seconds = time.perf_counter() - start
+        read_peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        return {
+            "case": f"{mode}/{backend}/{suffix}",
+            "write_seconds": write_seconds,
+            "read_seconds": read_seconds,
+            "peak_rss_increase_mb": (max(write_peak_kb, read_peak_kb) - baseline_kb) / 1024,
+            "file_mb": filepath.stat().st_size / (1024 * 1024),
+        }
+
+
+def main() -> None:
+    """Run the benchmark and print a table with the results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=20_000)
+    parser.add_argument("--context-length", type=int, default=8_000)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for mode, backend, suffix in CASES:
+        with context.Pool(1) as pool:
+            try:
+                results.append(
+                    pool.apply(
+                        _run_case, ((mode, backend, suffix, args.records, args.context_length),)
+                    )
+                )
+            except ImportError as e:
+                print(f"Skipping {mode}/{backend}/{suffix}: {e}")
+
+    print(f"{'case':<28} {'write s':>8} {'read s':>8} {'peak RSS +MB':>13} {'file MB':>8}")
+    for result in results:
+        print(
+            f"{result['case']:<28} {result['write_seconds']:>8.2f} {result['read_seconds']:>8.2f} "
+            f"{result['peak_rss_increase_mb']:>13.1f} {result['file_mb']:>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
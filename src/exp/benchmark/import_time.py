@@ -0,0 +1,142 @@
+"""Import-time benchmark of the command line entry point and the run modules.
+
+Every target is imported in a fresh interpreter with `-X importtime`. The import time, the peak
+RSS and the slowest top-level packages are printed and appended to a results file per git
+commit. `--compare` shows the change against another commit, `--max-seconds` exits with an
+error if a target imports slower, e.g. as a regression check in CI.
+
+Usage (from the repository root):
+    uv run python -m exp.benchmark.import_time
+    uv run python -m exp.benchmark.import_time --compare HEAD~1 --max-seconds 10
+"""
+
+import argparse
+import json
+import re
+import subprocess
+import sys
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+from exp.benchmark.end_to_end import git_commit, load_results
+from exp.utils.file_manager import FileManager
+
+DEFAULT_TARGETS = ["exp.cli", "exp.evaluation.evaluation", "exp.evaluation.execution"]
+# The child prints its peak RSS after the import, in the unit of `ru_maxrss` (KiB on Linux)
+RSS_SNIPPET = "import resource; print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)"
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def parse_importtime(stderr: str) -> tuple[int, dict[str, int]]:
+    """Parse `-X importtime` output.
+
+    Returns:
+        tuple[int, dict[str, int]]: The total import microseconds, and the cumulative
+            microseconds of every package where it is imported by another package, e.g. the
+            time of `torch` inside `vllm`. Nested packages count for both, so the package times
+            do not add up to the total.
+
+    """
+    total = 0
+    packages: dict[str, int] = {}
+    # The output lists every module after its imports, so it is walked from the end with a
+    # stack of the enclosing imports
+    stack: list[tuple[int, str]] = []
+    for line in reversed(stderr.splitlines()):
+        match = IMPORTTIME_LINE.match(line)
+        if match is None:
+            continue
+        depth, package = len(match.group(3)), match.group(4).split(".")[0]
+        cumulative = int(match.group(2))
+        while stack and stack[-1][0] >= depth:
+            stack.pop()
+        if not stack:
+            total += cumulative
+        if not stack or stack[-1][1] != package:
+            packages[package] = packages.get(package, 0) + cumulative
+        stack.append((depth, package))
+    return total, packages
+
+
+def measure(target: str, repeat: int = 3) -> dict[str, Any]:
+    """Import a module in fresh interpreters and keep the fastest run.
+
+    Returns:
+        dict[str, Any]: The import time in seconds, the peak RSS in MB and the cumulative
+            seconds of the top-level packages, or the error if the import failed.
+
+    """
+    best: dict[str, Any] | None = None
+    for _ in range(repeat):
+        process = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {target}; {RSS_SNIPPET}"],
+            capture_output=True,
+            text=True,
+        )
+        if process.returncode != 0:
+            return {"target": target, "error": process.stderr.strip().splitlines()[-1]}
+        total, packages = parse_importtime(process.stderr)
+        result = {
+            "target": target,
+            "seconds": total / 1e6,
+            "peak_rss_mb": int(process.stdout.strip().splitlines()[-1]) / 1024,
+            "packages": {name: us / 1e6 for name, us in packages.items()},
+        }
+        if best is None or result["seconds"] < best["seconds"]:
+            best = result
+    return best  # ty: ignore
+
+
+def print_results(
+    results: list[dict[str, Any]], baseline: list[dict[str, Any]] = [], top: int = 5
+) -> None:
+    """Print the results, with the change against a baseline of the same targets."""
+    baseline_by_target = {result["target"]: result for result in baseline if "seconds" in result}
+    print(f"{'target':<28} {'seconds':>8} {'peak RSS MB':>12} {'vs base':>8}")
+    for result in results:
+        if "error" in result:
+            print(f"{result['target']:<28} failed: {result['error']}")
+            continue
+        base = baseline_by_target.get(result["target"])
+        change = f"{result['seconds'] / base['seconds'] - 1:+.1%}" if base else ""
+        print(
+            f"{result['target']:<28} {result['seconds']:>8.2f} "
+            f"{result['peak_rss_mb']:>12.1f} {change:>8}"
+        )
+        slowest = sorted(result["packages"].items(), key=lambda item: item[1], reverse=True)
+        print(f"{'':<28} " + ", ".join(f"{name} {s:.2f}s" for name, s in slowest[:top]))
+
+
+def main() -> None:
+    """Run the benchmark, store and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--targets", nargs="+", default=DEFAULT_TARGETS)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--results-dir", type=Path, default=Path("benchmarks/imports"))
+    parser.add_argument("--compare", default=None, help="Git reference of the baseline")
+    parser.add_argument("--max-seconds", type=float, default=None, help="Fail above this time")
+    args = parser.parse_args()
+
+    commit = git_commit()
+    results = [measure(target, args.repeat) for target in args.targets]
+
+    timestamp = datetime.now().isoformat(timespec="seconds")
+    results_file = FileManager(args.results_dir / f"{commit}.jsonl")
+    results_file.append(
+        "".join(json.dumps({"commit": commit, "timestamp": timestamp, **r}) + "\n" for r in results)
+    )
+
+    baseline = load_results(args.results_dir, git_commit(args.compare)) if args.compare else []
+    print(f"Results of {commit}, stored in {results_file.filepath}")
+    print_results(results, baseline)
+
+    if args.max_seconds is not None:
+        slow = [r["target"] for r in results if r.get("seconds", 0.0) > args.max_seconds]
+        failed = [r["target"] for r in results if "error" in r]
+        if slow or failed:
+            sys.exit(f"Over {args.max_seconds}s: {slow}, failed: {failed}")
+
+
+if __name__ == "__main__":
+    main()
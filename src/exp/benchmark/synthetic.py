@@ -0,0 +1,119 @@
+"""Synthetic FinQA-shaped datasets for benchmarks."""
+
+import random
+
+import numpy as np
+import pandas as pd
+
+META_DATA_KEYS = [
+    "report_year",
+    "page_number",
+    "company_symbol",
+    "company_name",
+    "company_sector",
+    "company_industry",
+    "company_headquarters",
+    "company_cik",
+    "company_founded",
+]
+
+_WORDS = [
+    "revenue",
+    "net",
+    "income",
+    "operating",
+    "expenses",
+    "total",
+    "assets",
+    "cash",
+    "flow",
+    "fiscal",
+    "year",
+    "million",
+    "billion",
+    "increase",
+    "decrease",
+    "compared",
+    "to",
+    "prior",
+    "period",
+    "table",
+    "shows",
+    "segment",
+    "margin",
+]
+
+
+def synthetic_finqa_frame(
+    n_rows: int,
+    questions_per_context: int = 4,
+    context_length: int = 2000,
+    seed: int = 0,
+    context_sharing_ratio: float | None = None,
+) -> pd.DataFrame:
+    """Create a DataFrame with the columns of the FinQA dataset.
+
+    Args:
+        n_rows (int): The number of samples.
+        questions_per_context (int): The number of samples that share one context.
+        context_length (int): The approximate number of characters per context.
+        seed (int): The random seed.
+        context_sharing_ratio (float | None): Share of the samples that reuse the context of
+            another sample, e.g. 0.75 for four questions per context. Overrides
+            `questions_per_context` if given.
+
+    Returns:
+        pd.DataFrame: The synthetic dataset. Contexts are NumPy arrays of paragraphs like in the
+            Hugging Face dataset.
+
+    """
+    rng = random.Random(seed)
+    if context_sharing_ratio is not None:
+        n_contexts = max(1, round(n_rows * (1 - context_sharing_ratio)))
+        context_index = [i * n_contexts // max(1, n_rows) for i in range(n_rows)]
+    else:
+        n_contexts = max(1, -(-n_rows // max(1, questions_per_context)))
+        context_index = [i // max(1, questions_per_context) for i in range(n_rows)]
+    contexts = [_context(rng, context_length) for _ in range(n_contexts)]
+
+    return pd.DataFrame(
+        {
+            "id": [f"sample-{i}" for i in range(n_rows)],
+            "question": [f"What was the change in {_sentence(rng, 6)}?" for _ in range(n_rows)],
+            "answer": [f"{rng.uniform(-100, 100):.2f}" for _ in range(n_rows)],
+            "program_answer": [f"{rng.uniform(-100, 100):.2f}" for _ in range(n_rows)],
+            "program_solution": [
+                f"subtract({rng.randint(1, 999)}, {rng.randint(1, 999)})" for _ in range(n_rows)
+            ],
+            "context": [contexts[i] for i in context_index],
+            "report_year": [2000 + i % 20 for i in context_index],
+            "page_number": [i % 300 for i in context_index],
+            "company_symbol": [f"SYM{i % 500}" for i in context_index],
+            "company_name": [f"Company {i % 500}" for i in context_index],
+            "company_sector": [f"Sector {i % 11}" for i in context_index],
+            "company_industry": [f"Industry {i % 37}" for i in context_index],
+            "company_headquarters": [f"City {i % 97}" for i in context_index],
+            "company_date_added": [f"{1990 + i % 30}-01-01" for i in context_index],
+            "company_cik": [100000 + i % 500 for i in context_index],
+            "company_founded": [str(1850 + i % 150) for i in context_index],
+            "pre_text": [None] * n_rows,
+            "post_text": [None] * n_rows,
+            "table": [None] * n_rows,
+            "question_de": [None] * n_rows,
+            "context_de": [None] * n_rows,
+        }
+    )
+
+
+def _sentence(rng: random.Random, n_words: int) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(n_words))
+
+
+def _context(rng: random.Random, context_length: int) -> np.ndarray:
+    paragraphs = []
+    remaining = context_length
+    while remaining > 0:
+        paragraph = _sentence(rng, 40)
+        paragraphs.append(paragraph)
+        remaining -= len(paragraph)
+    return np.array(paragraphs, dtype=object)
@@ -0,0 +1,63 @@
+"""Command line entry point of the experiments.
+
+Only the module of the chosen command is imported, so that `exp --help` returns at once and
+`exp evaluate` loads neither vLLM and torch nor the RAG methods. encourage itself still
+imports the OpenAI client and chromadb. The arguments after the command are passed on as
+Hydra overrides.
+
+Usage:
+    exp execute model=gemma3-27b rag=bm25
+    exp evaluate hydra.run.dir=<output_folder>
+    exp serve model=gemma3-27b serving.replicas=2
+    exp shards --shards 4 --mock
+    exp merge sharding.num_shards=4 hydra.run.dir=<output_folder>
+"""
+
+import argparse
+import importlib
+import os
+import sys
+from pathlib import Path
+
+launcher_path = Path(__file__).parents[2] / "start_vllm_server_as_process.py"
+
+# Module with a Hydra `main` per command
+HYDRA_COMMANDS = {
+    "execute": "exp.evaluation.execution",
+    "evaluate": "exp.evaluation.evaluation",
+    "merge": "exp.evaluation.sharding",
+}
+
+
+def main(argv: list[str] | None = None) -> None:
+    """Run a command with Hydra overrides."""
+    parser = argparse.ArgumentParser(prog="exp", description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "command",
+        choices=[*HYDRA_COMMANDS, "serve", "shards"],
+        help="execute: inference and evaluation, evaluate: metrics of an earlier run, "
+        "merge: evaluate the shards of a sharded run, serve: start the vLLM replicas, "
+        "shards: run the shards as local processes and merge them",
+    )
+    parser.add_argument("overrides", nargs=argparse.REMAINDER, help="Hydra overrides")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        if not launcher_path.exists():
+            sys.exit(f"vLLM launcher not found at {launcher_path}, run exp from a source checkout")
+        # The launcher replaces this process, so that signals reach it directly
+        os.execv(sys.executable, [sys.executable, str(launcher_path), *args.overrides])
+
+    if args.command == "shards":
+        from exp.evaluation.sharding import launch_local
+
+        launch_local(args.overrides)
+        return
+
+    # Hydra reads its overrides from the command line
+    sys.argv = [f"exp {args.command}", *args.overrides]
+    importlib.import_module(HYDRA_COMMANDS[args.command]).main()
+
+
+if __name__ == "__main__":
+    main()
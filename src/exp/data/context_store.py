@@ -0,0 +1,83 @@
+"""Deduplicated store of the contexts of a dataset."""
+
+import uuid
+from typing import Any, Iterable, Iterator
+
+from encourage.prompts.context import Document
+from encourage.prompts.meta_data import MetaData
+
+# Fixed namespace, so the same context text gets the same ID in every run
+CONTEXT_NAMESPACE = uuid.uuid5(
+    uuid.NAMESPACE_URL, "https://github.com/pesc101/exp-template/context"
+)
+
+
+def context_uuid(content: str) -> uuid.UUID:
+    """Get the deterministic content-hash ID of a context."""
+    return uuid.uuid5(CONTEXT_NAMESPACE, content)
+
+
+class ContextStore:
+    """Holds every unique context once as a `Document` with a deterministic ID.
+
+    Samples refer to their context by ID, and the metadata of all samples that share a context
+    points to the same `Document` instead of a copy of its text.
+    """
+
+    def __init__(self) -> None:
+        self._documents: dict[str, Document] = {}
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def __contains__(self, context_id: object) -> bool:
+        return context_id in self._documents
+
+    def __iter__(self) -> Iterator[Document]:
+        return iter(self._documents.values())
+
+    def add(
+        self,
+        content: str | None,
+        meta_data: dict[str, Any] | None = None,
+        context_id: str | None = None,
+    ) -> str:
+        """Add a context if it is not stored yet.
+
+        Args:
+            content (str | None): The context text.
+            meta_data (dict[str, Any] | None): Metadata of the document, only used when the
+                context is added for the first time.
+            context_id (str | None): The ID of the context if it was already computed with
+                `context_uuid`, e.g. in a dataset snapshot.
+
+        Returns:
+            str: The ID of the context.
+
+        """
+        content = content or ""
+        context_id = context_id or str(context_uuid(content))
+        if context_id not in self._documents:
+            self._documents[context_id] = Document(
+                id=uuid.UUID(context_id), content=content, meta_data=MetaData(meta_data or {})
+            )
+        return context_id
+
+    def get(self, context_id: str) -> Document:
+        """Get the document of a context ID."""
+        return self._documents[context_id]
+
+    def content(self, context_id: str) -> str:
+        """Get the stored text of a context ID."""
+        return self._documents[context_id].content
+
+    def documents(self) -> list[Document]:
+        """Get all unique documents in insertion order."""
+        return list(self._documents.values())
+
+    def subset(self, context_ids: Iterable[str]) -> "ContextStore":
+        """Create a store that only holds the given context IDs."""
+        store = ContextStore()
+        for context_id in context_ids:
+            store._documents[context_id] = self._documents[context_id]
+        return store
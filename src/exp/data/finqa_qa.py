@@ -1,18 +1,28 @@
 """FinQA dataset model."""
 
 import json
-import uuid
-from typing import Optional
+import logging
+from typing import Callable, Optional, Sequence, TypeVar, overload
 
-import mlflow
 import numpy as np
 import pandas as pd
-from encourage.llm import BatchInferenceRunner, ResponseWrapper
-from encourage.prompts.context import Document
+from encourage.llm import BatchInferenceRunner, Response, ResponseWrapper
+from encourage.prompts.context import Context, Document
 from encourage.prompts.meta_data import MetaData
-from encourage.rag import RAGMethodInterface
+from encourage.rag import KnownContext, RAGMethodInterface
 from pydantic import BaseModel
 
+from exp.data.context_store import ContextStore, context_uuid
+from exp.data.subset import hash_subset_mask
+from exp.inference.prefix_ordering import PrefixSchedule, length_bucket, schedule_by_prefix
+from exp.inference.structured_output import StructuredOutputStage
+from exp.utils.inference_log import InferenceLog
+from exp.utils.profiler import stage
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
 
 class FinQADatasetSample(BaseModel):
     """FinQA dataset model."""
@@ -41,8 +51,68 @@ class FinQADatasetSample(BaseModel):
     context_id: Optional[str] = None
 
 
+def _join_context(val: object) -> object:
+    if isinstance(val, np.ndarray):
+        return "\n\n".join(map(str, val.flatten()))
+    return val
+
+
+def normalize_finqa_frame(df: pd.DataFrame, meta_data_keys: list[str] = []) -> pd.DataFrame:
+    """Bring a raw FinQA DataFrame into the shape used by `FinQADatasetCollection`.
+
+    Only the required columns are kept, contexts stored as arrays of paragraphs are joined into
+    one string and a deterministic `context_id` column is added.
+    """
+    # Filter DataFrame to only keep required columns
+    required_columns = [
+        "id",
+        "question",
+        "answer",
+        "program_answer",
+        "program_solution",
+        "context",
+    ] + meta_data_keys
+    df = df[[col for col in required_columns if col in df.columns]].copy()
+    # Ensure 'context' column is a single string joined by newlines if it's a list/tuple
+    if "context" in df.columns:
+        df["context"] = [_join_context(val) for val in df["context"]]
+        df["context_id"] = [str(context_uuid(context or "")) for context in df["context"]]
+    return df
+
+
+class LazySequence(Sequence[T]):
+    """Read-only sequence that creates its items only when they are accessed."""
+
+    def __init__(self, length: int, factory: Callable[[int], T]) -> None:
+        self._length = length
+        self._factory = factory
+
+    def __len__(self) -> int:
+        return self._length
+
+    @overload
+    def __getitem__(self, index: int) -> T: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> list[T]: ...
+
+    def __getitem__(self, index: int | slice) -> T | list[T]:
+        if isinstance(index, slice):
+            return [self._factory(i) for i in range(*index.indices(self._length))]
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("LazySequence index out of range")
+        return self._factory(index)
+
+
 class FinQADatasetCollection:
-    """Collection of FinQA dataset samples."""
+    """Collection of FinQA dataset samples.
+
+    The samples are stored as NumPy columns. `FinQADatasetSample`, `MetaData` and `Document`
+    objects are only created when a sample is read, which keeps the construction of large splits
+    cheap.
+    """
 
     def __init__(
         self,
@@ -50,107 +120,169 @@ class FinQADatasetCollection:
         retrieval_query: str = "",
         meta_data_keys: list[str] = [],
         document_percentage: float | None = None,
+        normalized: bool = False,
+        sample_percentage: float | None = None,
+        subset_seed: str = "",
     ) -> None:
-        """Initialize the dataset collection."""
+        """Initialize the dataset collection.
+
+        Pass `normalized=True` for a DataFrame that already went through
+        `normalize_finqa_frame`, e.g. one loaded from a dataset snapshot.
+
+        `document_percentage` keeps the samples of a fraction of the contexts and
+        `sample_percentage` a fraction of the remaining samples. Both subsets are chosen by
+        hashing the context and sample IDs with `subset_seed`, so they are the same in every run
+        and a smaller subset is contained in a larger one.
+        """
         self.meta_data_keys = meta_data_keys
         self.retrieval_query = retrieval_query
+        self.prefix_schedule: PrefixSchedule | None = None
+        # Prompt token counts of the samples and truncated contexts, set by the preflight
+        self.prompt_tokens: np.ndarray | None = None
+        self.prompt_contexts: dict[str, Document] = {}
+        self._none_column = np.empty(0, dtype=object)
 
-        # Create samples from DataFrame records
-        # Filter DataFrame to only keep required columns
-        required_columns = [
-            "id",
-            "question",
-            "answer",
-            "program_answer",
-            "program_solution",
-            "context",
-        ] + self.meta_data_keys
-        df = df[[col for col in required_columns if col in df.columns]]
-        # Ensure 'context' column is a single string joined by newlines if it's a list/tuple
-        if "context" in df.columns:
-
-            def _join_context(val):
-                if isinstance(val, np.ndarray):
-                    return "\n\n".join(map(str, val.flatten()))
-                return val
-
-            df.loc[:, "context"] = df["context"].apply(_join_context)
-        self.samples = [
-            FinQADatasetSample(**{str(k): v for k, v in record.items()})  # ty: ignore
-            for record in df.to_dict(orient="records")
-        ]
+        if not normalized:
+            df = normalize_finqa_frame(df, meta_data_keys)
+        self.columns: dict[str, np.ndarray] = {
+            str(col): df[col].to_numpy(dtype=object) for col in df.columns
+        }
 
         # Create context IDs for each sample
-        self.create_context_ids()
-
-        if document_percentage and document_percentage < 1.0:
-            # Sample a percentage of unique context IDs in the DataFrame
-            unique_context_ids = pd.Series(
-                [sample.context_id for sample in self.samples]
-            ).drop_duplicates()
-            sampled_context_ids = unique_context_ids.sample(frac=document_percentage)
-
-            mlflow.log_params({"unique_documents": len(sampled_context_ids)})  # ty: ignore
-            self.samples = [
-                sample
-                for sample in self.samples
-                if sample.context_id in sampled_context_ids.tolist()
-            ]
+        with stage("context_prep"):
+            self.create_context_ids()
+
+        if document_percentage is not None and document_percentage < 1.0:
+            mask = hash_subset_mask(self.columns["context_id"], document_percentage, subset_seed)
+            self.columns = {col: values[mask] for col, values in self.columns.items()}
+        if sample_percentage is not None and sample_percentage < 1.0:
+            mask = hash_subset_mask(self.columns["id"], sample_percentage, subset_seed)
+            self.columns = {col: values[mask] for col, values in self.columns.items()}
 
         # Create metadata and prepare user prompts using samples
+        self.samples: Sequence[FinQADatasetSample] = LazySequence(len(self), self._sample_at)
         self.prompt_meta_data = self.create_prompt_meta_data()
-        self.user_prompts = [sample.question for sample in self.samples]
-        self.context_collection = self.prepare_contexts_for_db()
+        self.user_prompts = self._column("question").tolist()
+        with stage("context_prep"):
+            self.context_collection = self.prepare_contexts_for_db()
+
+    def __len__(self) -> int:
+        return len(self.columns["id"]) if "id" in self.columns else 0
 
-    def get_context_collection(self) -> list[Document]:
-        """Get the context collection."""
+    def _column(self, name: str) -> np.ndarray:
+        """Get a column, or a column of None values if the DataFrame did not have it."""
+        if name in self.columns:
+            return self.columns[name]
+        if len(self._none_column) != len(self):
+            self._none_column = np.full(len(self), None, dtype=object)
+        return self._none_column
+
+    def _sample_at(self, index: int) -> FinQADatasetSample:
+        return FinQADatasetSample(
+            **{str(col): values[index] for col, values in self.columns.items()}  # ty: ignore
+        )
+
+    def get_context_collection(self, per_sample: bool = False) -> list[Document] | list[Context]:
+        """Get the context collection.
+
+        Args:
+            per_sample (bool): Get the context of every sample in dataset order, as
+                `KnownContext` pairs its contexts with the prompts by position. By default the
+                unique contexts for the vector database are returned.
+
+        Returns:
+            list[Document] | list[Context]: The unique documents, or one context per sample.
+
+        """
+        if per_sample:
+            return self.known_contexts(range(len(self)))
         return self.context_collection
 
     def get_data_frame(self) -> pd.DataFrame:
         """Get the DataFrame."""
-        return pd.DataFrame([sample.dict() for sample in self.samples])
+        return pd.DataFrame(
+            {field: self._column(field) for field in FinQADatasetSample.model_fields}
+        )
 
     def create_context_ids(self) -> None:
-        """Create context ID for each sample and update both samples and qa_dataset."""
-        # Create mapping of unique contexts to UUIDs
-        context_dict = {}
-        for sample in self.samples:
-            if sample.context not in context_dict:
-                context_dict[sample.context] = str(uuid.uuid4())
-            sample.context_id = context_dict[sample.context]
-
-    def create_prompt_meta_data(self) -> list[MetaData]:
-        """Create metadata from samples."""
-        meta_datas = []
-        for _, sample in enumerate(self.samples):
-            meta_data = MetaData(
-                {
-                    "reference_answer": sample.program_answer or "",
-                    "id": sample.id,
-                    "reference_document": Document(
-                        id=uuid.UUID(sample.context_id) if sample.context_id else uuid.uuid4(),
-                        content=sample.context or "",
-                    ),
-                }
+        """Add every unique context to the context store and create the context ID column.
+
+        The context column is replaced by the stored text, so samples that share a context also
+        share one string object.
+        """
+        self.context_store = ContextStore()
+        contexts = self._column("context")
+        known_ids = self._column("context_id")
+        meta_data_columns = {key: self._column(key) for key in self.meta_data_keys}
+        context_ids = np.empty(len(self), dtype=object)
+        for i, context in enumerate(contexts):
+            context_ids[i] = self.context_store.add(
+                context,
+                {key: values[i] for key, values in meta_data_columns.items()},
+                context_id=known_ids[i],
+            )
+        self.columns["context_id"] = context_ids
+        if "context" in self.columns:
+            self.columns["context"] = np.fromiter(
+                (self.context_store.content(context_id) for context_id in context_ids),
+                dtype=object,
+                count=len(context_ids),
             )
-            meta_datas.append(meta_data)
-        return meta_datas
+
+    def filter(self, mask: np.ndarray) -> None:
+        """Keep only the samples where the mask is true."""
+        self.columns = {col: values[mask] for col, values in self.columns.items()}
+        if self.prompt_tokens is not None:
+            self.prompt_tokens = self.prompt_tokens[mask]
+        self.samples = LazySequence(len(self), self._sample_at)
+        self.prompt_meta_data = self.create_prompt_meta_data()
+        self.user_prompts = self._column("question").tolist()
+        self.context_collection = self.prepare_contexts_for_db()
+
+    def truncate_prompt_context(self, context_id: str, content: str) -> None:
+        """Send a shorter text of a context in the prompts of its samples.
+
+        Only the known contexts of the prompts change, the documents of the vector database
+        and the reference documents keep the full text and the context ID.
+        """
+        document = self.context_store.get(context_id)
+        self.prompt_contexts[context_id] = Document(
+            id=document.id, content=content, meta_data=document.meta_data
+        )
+
+    def create_prompt_meta_data(self) -> Sequence[MetaData]:
+        """Create metadata from samples, lazily per sample."""
+        return LazySequence(len(self), self._meta_data_at)
+
+    def _meta_data_at(self, index: int) -> MetaData:
+        return MetaData(
+            {
+                "reference_answer": self._column("program_answer")[index] or "",
+                "id": self.columns["id"][index],
+                "reference_document": self.context_store.get(self.columns["context_id"][index]),
+            }
+        )
 
     def prepare_contexts_for_db(self) -> list[Document]:
-        """Prepare contexts from samples for the vector database."""
-        context_collection = []
-        for sample in self.samples:
-            context = Document(
-                id=uuid.UUID(sample.context_id)
-                if isinstance(sample.context_id, str)
-                else sample.context_id or uuid.uuid4(),
-                content=sample.context or "",
-                meta_data=MetaData(
-                    {key: getattr(sample, key, None) for key in self.meta_data_keys}
-                ),
+        """Prepare the unique contexts of the samples for the vector database.
+
+        Samples that share a context share one document, so the collection is only meant for
+        ingestion. Prompts are paired with their contexts through `known_contexts`.
+        """
+        self.context_store = self.context_store.subset(
+            dict.fromkeys(self.columns["context_id"].tolist())
+        )
+        return self.context_store.documents()
+
+    def known_contexts(self, indices: Sequence[int]) -> list[Context]:
+        """Get the known context of each sample, in the order of the indices."""
+        context_ids = self.columns["context_id"]
+        return [
+            Context.from_documents(
+                [self.prompt_contexts.get(context_ids[i]) or self.context_store.get(context_ids[i])]
             )
-            context_collection.append(context)
-        return context_collection
+            for i in indices
+        ]
 
     def run(
         self,
@@ -159,43 +291,144 @@ class FinQADatasetCollection:
         sys_prompt: dict,
         template_name: str = "",
         response_format: type[BaseModel] | str | None = None,
+        inference_log: InferenceLog | None = None,
+        batch_size: int | None = None,
+        structured_output: StructuredOutputStage | None = None,
+        retry_runner: BatchInferenceRunner | None = None,
+        prefix_ordering: bool = False,
+        length_buckets: bool = False,
+        sample_mask: np.ndarray | None = None,
     ) -> ResponseWrapper:
-        """Run the dataset."""
-        retrieval_query = self._generate_retrieval_queries()
-        responses = rag_method_instance.run(
-            runner,
-            sys_prompt,
-            self.user_prompts,
-            self.prompt_meta_data,
-            retrieval_queries=retrieval_query,
-            response_format=response_format,
-        )
-        return self.post_response_processing(responses)
+        """Run the dataset.
+
+        Samples are sent in batches of `batch_size` and every processed batch is appended to the
+        `inference_log`. Samples whose ID is already in the log are skipped, so a crashed run can
+        be resumed from its log. Only the responses of this call are returned.
+
+        With a `structured_output` stage, samples whose response does not validate against the
+        response format are sent again through `retry_runner` (or `runner`) before the batch is
+        post-processed.
+
+        With `prefix_ordering`, samples that share a context are sent together, so that the
+        server can reuse the cached prefix of their prompts, and the schedule is kept in
+        `prefix_schedule`. With `length_buckets` and the token counts of the preflight, the
+        prompts are grouped by length, longest first, with or without prefix ordering. The
+        responses are returned in dataset order.
+
+        With a `sample_mask`, e.g. the shard of a worker, only the samples where it is true are
+        sent.
+
+        A `KnownContext` method gets the contexts of each batch in the order of its prompts, so
+        batching, resuming, prefix ordering and the sample mask keep every prompt with its own
+        context.
+        """
+        retrieval_queries = self._generate_retrieval_queries()
+        indices = list(range(len(self)))
+        if sample_mask is not None:
+            indices = [i for i in indices if sample_mask[i]]
+        if inference_log is not None:
+            completed_ids = inference_log.completed_ids()
+            indices = [i for i in indices if self.columns["id"][i] not in completed_ids]
+            if completed_ids:
+                logger.info(
+                    f"Resuming: {len(completed_ids)} samples done, {len(indices)} remaining"
+                )
+
+        batch_size = batch_size or max(len(indices), 1)
+        self.prefix_schedule = None
+        send_order = None
+        buckets = None
+        if length_buckets and self.prompt_tokens is not None:
+            buckets = [-length_bucket(self.prompt_tokens[i]) for i in indices]
+        if prefix_ordering:
+            with stage("prefix_ordering"):
+                self.prefix_schedule = schedule_by_prefix(
+                    [self.columns["context_id"][i] for i in indices],
+                    # The system prompt and the known context lead every prompt
+                    lambda context_id: f"{sys_prompt}\n{self.context_store.content(context_id)}",
+                    batch_size,
+                    buckets,
+                )
+            send_order = self.prefix_schedule.order
+            logger.info(
+                "Expected prefix reuse: "
+                f"{self.prefix_schedule.reuse_ratio:.1%} in {self.prefix_schedule.groups} groups, "
+                f"{self.prefix_schedule.reuse_ratio_unordered:.1%} in dataset order"
+            )
+        elif buckets is not None:
+            # A stable sort keeps the dataset order within a bucket
+            send_order = sorted(range(len(indices)), key=buckets.__getitem__)
+        if send_order is not None:
+            indices = [indices[position] for position in send_order]
+
+        def send(batch: list[int], batch_runner: BatchInferenceRunner) -> ResponseWrapper:
+            if isinstance(rag_method_instance, KnownContext):
+                rag_method_instance.context_collection = self.known_contexts(batch)
+            return rag_method_instance.run(
+                batch_runner,
+                sys_prompt,
+                [self.user_prompts[i] for i in batch],
+                [self.prompt_meta_data[i] for i in batch],
+                retrieval_queries=[retrieval_queries[i] for i in batch],
+                response_format=response_format,
+            )
+
+        response_data = []
+        for start in range(0, len(indices), batch_size):
+            batch = indices[start : start + batch_size]
+            with stage("rag"):
+                responses = send(batch, runner)
+            if structured_output is not None:
+
+                def resubmit(positions: list[int], batch: list[int] = batch) -> ResponseWrapper:
+                    return send([batch[position] for position in positions], retry_runner or runner)
+
+                with stage("parsing"):
+                    responses = structured_output.process(responses, resubmit)
+            with stage("parsing"):
+                responses = self.post_response_processing(responses)
+            if inference_log is not None:
+                inference_log.append(responses.response_data)
+            response_data.extend(responses.response_data)
+        if send_order is not None:
+            restored: list[Response] = [None] * len(response_data)  # type: ignore
+            for position, response in zip(send_order, response_data):
+                restored[position] = response
+            response_data = restored
+        return ResponseWrapper(response_data)
 
     def post_response_processing(
         self,
         responses: ResponseWrapper,
     ) -> ResponseWrapper:
-        """Post-process the response."""
+        """Post-process the response.
+
+        Responses that cannot be parsed get an empty answer and the reason in
+        `meta_data["parse_error"]`.
+        """
         for response in responses.response_data:
+            if "parse_error" in response.meta_data:
+                response.response = ""
+                continue
             try:
                 json_response = json.loads(response.response)
                 response.response = json_response["computed_formula"]
                 response.meta_data["reasoning_steps"] = json_response["reasoning_steps"]
                 response.meta_data["final_formula"] = json_response["final_formula"]
-            except json.JSONDecodeError as e:
-                print(f"Error decoding JSON: {e}")
-                print(f"Response: {response.response}")
-                response.response = ""
-            except TypeError as e:
-                print(f"TypeError: {e}")
-                print(f"Response: {response.response}")
+            except (json.JSONDecodeError, TypeError, KeyError) as e:
+                logger.debug(f"Unparsable response {response.response!r}: {e}")
+                response.meta_data["parse_error"] = type(e).__name__
                 response.response = ""
         return responses
 
     def _generate_retrieval_queries(self) -> list[str]:
         """Generate queries from samples."""
-        queries = [f"{sample.company_name} : {sample.question}" for sample in self.samples]
+        queries = [
+            f"{company_name} : {question}"
+            for company_name, question in zip(
+                self._column("company_name"), self._column("question")
+            )
+        ]
         if self.retrieval_query:
             queries = [f"Instruct: {self.retrieval_query}\nQuery: {q}" for q in queries]
         return queries
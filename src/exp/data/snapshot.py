@@ -0,0 +1,105 @@
+"""Local snapshot cache of preprocessed datasets."""
+
+import hashlib
+import json
+import logging
+import re
+from pathlib import Path
+from typing import Union
+
+import pandas as pd
+
+from exp.data.finqa_qa import normalize_finqa_frame
+
+logger = logging.getLogger(__name__)
+
+# Bump when `normalize_finqa_frame` changes, so that old snapshots are not used anymore
+PREPROCESSING_VERSION = 1
+
+
+class DatasetSnapshot:
+    """Parquet snapshot of a normalized dataset split.
+
+    The snapshot is keyed by the dataset name, the split, the metadata keys and the
+    preprocessing version. Once it exists, the dataset is read from the memory-mapped Parquet
+    file without touching the Hugging Face Hub, so warm starts also work offline.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Union[str, Path],
+        name: str,
+        split: str,
+        meta_data_keys: list[str] = [],
+    ) -> None:
+        """Initialize the snapshot.
+
+        Args:
+            cache_dir (Union[str, Path]): The folder with the snapshots.
+            name (str): The name of the dataset on the Hugging Face Hub.
+            split (str): The split, including slicing like `dev[:10]`.
+            meta_data_keys (list[str]): The metadata columns that are kept.
+
+        """
+        self.name = name
+        self.split = split
+        self.meta_data_keys = list(meta_data_keys)
+        key = json.dumps(
+            {
+                "name": name,
+                "split": split,
+                "meta_data_keys": self.meta_data_keys,
+                "version": PREPROCESSING_VERSION,
+            },
+            sort_keys=True,
+        )
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+        slug = re.sub(r"[^\w.-]+", "_", f"{name}_{split}")
+        self.path = Path(cache_dir) / f"{slug}-{digest}.parquet"
+
+    def exists(self) -> bool:
+        """Whether the snapshot was already written."""
+        return self.path.exists()
+
+    def load(self) -> pd.DataFrame:
+        """Read the normalized DataFrame from the snapshot."""
+        return pd.read_parquet(self.path, memory_map=True)
+
+    def save(self, df: pd.DataFrame) -> None:
+        """Write the normalized DataFrame, replacing the file atomically."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        df.to_parquet(tmp_path, index=False)
+        tmp_path.replace(self.path)
+
+
+def load_normalized_dataset(
+    name: str,
+    split: str,
+    meta_data_keys: list[str] = [],
+    cache_dir: Union[str, Path, None] = None,
+) -> pd.DataFrame:
+    """Load a normalized dataset split, from the snapshot cache if possible.
+
+    Args:
+        name (str): The name of the dataset on the Hugging Face Hub.
+        split (str): The split, including slicing like `dev[:10]`.
+        meta_data_keys (list[str]): The metadata columns that are kept.
+        cache_dir (Union[str, Path, None]): The snapshot folder, None disables the cache.
+
+    Returns:
+        pd.DataFrame: The DataFrame in the shape of `normalize_finqa_frame`.
+
+    """
+    snapshot = DatasetSnapshot(cache_dir, name, split, meta_data_keys) if cache_dir else None
+    if snapshot is not None and snapshot.exists():
+        logger.info(f"Loading dataset snapshot {snapshot.path}")
+        return snapshot.load()
+
+    from datasets import load_dataset
+
+    df = normalize_finqa_frame(load_dataset(name, split=split).to_pandas(), meta_data_keys)
+    if snapshot is not None:
+        snapshot.save(df)
+        logger.info(f"Wrote dataset snapshot {snapshot.path}")
+    return df
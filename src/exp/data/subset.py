@@ -0,0 +1,48 @@
+"""Deterministic subsets and shards of a dataset based on hashes of context and sample IDs."""
+
+import hashlib
+from typing import Iterable
+
+import numpy as np
+
+
+def hash_fraction(value: object, seed: str = "") -> float:
+    """Map a value to a fixed number in [0, 1) by hashing it.
+
+    A value is part of the subset of fraction `p` if its number is below `p`, so the 10% subset
+    is always contained in the 20% subset of the same seed.
+    """
+    digest = hashlib.blake2b(f"{seed}:{value}".encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") / 2**64
+
+
+def hash_subset(values: Iterable[object], fraction: float, seed: str = "") -> set[object]:
+    """Get the unique values whose hash fraction is below `fraction`."""
+    return {value for value in set(values) if hash_fraction(value, seed) < fraction}
+
+
+def hash_subset_mask(values: np.ndarray, fraction: float, seed: str = "") -> np.ndarray:
+    """Get a mask of the entries whose value is in the hash subset of `fraction`.
+
+    Every unique value is hashed once and looked up in a set.
+    """
+    if fraction >= 1.0:
+        return np.ones(len(values), dtype=bool)
+    kept = hash_subset(values.tolist(), fraction, seed)
+    return np.fromiter((value in kept for value in values), dtype=bool, count=len(values))
+
+
+def hash_shard_mask(values: np.ndarray, num_shards: int, shard_index: int) -> np.ndarray:
+    """Get a mask of the entries whose value hashes into shard `shard_index` of `num_shards`.
+
+    Entries with the same value are always in the same shard, and the shards do not depend on
+    the order of the entries or on the host.
+    """
+    if num_shards <= 1:
+        return np.ones(len(values), dtype=bool)
+    shards = {
+        value: int(hash_fraction(value, "shard") * num_shards) for value in set(values.tolist())
+    }
+    return np.fromiter(
+        (shards[value] == shard_index for value in values), dtype=bool, count=len(values)
+    )
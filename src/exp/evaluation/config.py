@@ -33,7 +33,11 @@ class Dataset:
     retrieval_query: str = ""
     template_name: str = ""
     document_percentage: float = 1.0
+    sample_percentage: float = 1.0
+    subset_seed: str = ""
     response_format: dict = field(default_factory=dict)
+    snapshot_cache: bool = True
+    snapshot_dir: str = "./.cache/datasets"
 
 
 @dataclass
@@ -42,6 +46,7 @@ class MLFlowConfig:
 
     experiment_id: str
     uri: str
+    spool_dir: str = "./.cache/mlflow_spool"
 
 
 @dataclass
@@ -51,6 +56,8 @@ class VectorDB:
     collection_name: str
     top_k: int
     embedding_function: str = "default"
+    embedding_cache: bool = True
+    embedding_cache_path: str = "./.cache/embeddings.sqlite"
 
 
 @dataclass
@@ -65,6 +72,110 @@ class RAGConfig:
     vllm_port: int = 18123
 
 
+@dataclass
+class Inference:
+    """Inference configuration."""
+
+    batch_size: int = 256
+    resume: bool = False
+    prefix_ordering: bool = True
+
+
+@dataclass
+class PreflightConfig:
+    """Token-length check of the prompts before inference."""
+
+    enabled: bool = True
+    policy: str = "warn"
+    length_buckets: bool = True
+    tokenizer: str | None = None
+
+
+@dataclass
+class StructuredOutputConfig:
+    """Validation and re-generation of unparsable structured outputs."""
+
+    enabled: bool = True
+    max_retries: int = 2
+    retry_temperature: float | None = 0.7
+    retry_max_tokens: int | None = None
+
+
+@dataclass
+class ServingConfig:
+    """Configuration of the served vLLM replicas."""
+
+    replicas: int = 1
+    max_failures: int = 3
+    cooldown_s: float = 30.0
+    wait_for_ready: bool = False
+    readiness_file: str = "./.cache/vllm_ready.json"
+    startup_log: str = "./.cache/vllm_startup.jsonl"
+    ready_timeout_s: float = 1800.0
+    poll_interval_s: float = 5.0
+    warmup_requests: int = 8
+    warmup_max_tokens: int = 16
+
+
+@dataclass
+class DispatcherConfig:
+    """Async request dispatcher configuration."""
+
+    enabled: bool = False
+    max_in_flight: int = 64
+    min_in_flight: int = 1
+    initial_in_flight: int = 8
+    latency_tolerance: float = 2.0
+    max_retries: int = 5
+    timeout_s: float = 600.0
+    stream: bool = False
+
+
+@dataclass
+class ResponseCacheConfig:
+    """Response cache configuration."""
+
+    enabled: bool = True
+    path: str = "./.cache/responses.sqlite"
+    max_size_mb: float | None = 2048
+    max_age_days: float | None = 30
+
+
+@dataclass
+class MetricSchedulerConfig:
+    """Metric scheduler configuration."""
+
+    max_workers: int = 4
+    slow_metrics: list[str] = field(default_factory=lambda: ["BERTScore", "GLEU"])
+    trace_memory: bool = True
+
+
+@dataclass
+class MetricWorkerConfig:
+    """Resident worker for model-based metrics."""
+
+    enabled: bool = True
+    socket: str = "./.cache/metric_worker.sock"
+    metrics: list[str] = field(default_factory=lambda: ["BERTScore"])
+    idle_timeout_s: float | None = 900.0
+
+
+@dataclass
+class ShardingConfig:
+    """Sharded execution over several worker processes or hosts."""
+
+    num_shards: int = 1
+    shard_index: int = 0
+    allow_partial: bool = False
+
+
+@dataclass
+class ProfilingConfig:
+    """Profiling configuration."""
+
+    cprofile: bool = False
+
+
 @dataclass
 class Config:
     """Configuration dataclass for the hydra modules."""
@@ -74,6 +185,16 @@ class Config:
     mlflow: MLFlowConfig
     vector_db: VectorDB
     rag: RAGConfig
+    inference: Inference
+    preflight: PreflightConfig
+    structured_output: StructuredOutputConfig
+    response_cache: ResponseCacheConfig
+    dispatcher: DispatcherConfig
+    serving: ServingConfig
     metrics: list[Union[str, dict[str, dict[str, str]]]]
+    metric_scheduler: MetricSchedulerConfig
+    metric_worker: MetricWorkerConfig
+    profiling: ProfilingConfig
+    sharding: ShardingConfig
     vllm_port: int
     base_url: str
@@ -6,67 +6,100 @@ from pathlib import Path
 import hydra
 import hydra.core.hydra_config
 import mlflow
-from encourage.llm import BatchInferenceRunner, Response, ResponseWrapper
-from encourage.metrics import Metric, MetricOutput
-from vllm import SamplingParams
+from encourage.llm import BatchInferenceRunner, ResponseWrapper, SamplingParams
 
 from exp.evaluation.config import Config
 from exp.evaluation.factory_helper import load_metrics
+from exp.evaluation.metric_plan import MetricPlan
+from exp.evaluation.metric_scheduler import MetricScheduler, timing_metrics
+from exp.evaluation.metric_worker import connect_metric_worker
+from exp.retrieval.retrieval_only import load_retrieval_responses, retrieval_metrics
 from exp.utils.file_manager import FileManager
 from exp.utils.flatten_dict import flatten_dict
+from exp.utils.inference_log import load_responses
+from exp.utils.mlflow_logger import MlflowLogger, tracked_run
+from exp.utils.profiler import active_profiler, profiling, stage
 
 logger = logging.getLogger(__name__)
 config_path = str((Path(__file__).parents[3] / "conf").resolve())
 
+EVALUATION_PROFILE_NAME = "profile_evaluation.json"
+
 
 @hydra.main(version_base=None, config_path=config_path, config_name="defaults")
 def main(cfg: Config) -> None:
     """Main function for evaluation of QA results with MLflow tracking."""
-    # Set MLflow tracking configuration
-    mlflow.set_tracking_uri(cfg.mlflow.uri)
-    mlflow.set_experiment(experiment_name=cfg.mlflow.experiment_id)
-
-    # Run the evaluation with MLflow tracking
-    if mlflow.active_run().info.run_id if mlflow.active_run() else False:  # type: ignore
-        evaluation(cfg)
-    else:
-        with mlflow.start_run():  # ty: ignore
-            evaluation(cfg)
-
+    evaluation(cfg)
+
+
+def evaluation(
+    cfg: Config, output_dir: str | Path | None = None, tracker: MlflowLogger | None = None
+) -> None:
+    """Evaluate the QA results with MLflow tracking.
+
+    The results are read from and the metrics written to `output_dir`, which defaults to the
+    output folder of the current Hydra run. Without a `tracker`, the active MLflow run is used
+    or a new one is started.
+    """
+    results_path = Path(output_dir or hydra.core.hydra_config.HydraConfig.get().runtime.output_dir)
+    if tracker is None:
+        # A standalone evaluation reports its own profile
+        with (
+            profiling() as profiler,
+            tracked_run(cfg.mlflow.uri, cfg.mlflow.experiment_id, cfg.mlflow.spool_dir) as tracker,
+        ):
+            evaluation(cfg, results_path, tracker)
+            tracker.log_metrics(profiler.metrics())
+            tracker.log_artifact(profiler.write(results_path / EVALUATION_PROFILE_NAME))
+        return
 
-def evaluation(cfg: Config) -> None:
-    """Evaluate the QA results with MLflow tracking."""
     flat_config = flatten_dict(cfg)
-    mlflow.log_params(flat_config)  # ty: ignore
+    tracker.log_params(flat_config)
 
-    with mlflow.start_span(name="loading_results"):
-        results_path = Path(hydra.core.hydra_config.HydraConfig.get().runtime.output_dir)
+    with mlflow.start_span(name="loading_results"), stage("load_results"):
         if not results_path.exists() or not results_path.is_dir():
             raise ValueError(f"Results folder not found: {results_path}")
 
-        # Convert to ResponseDataCollection format
-        responses_json = FileManager(list(results_path.glob("inference_log.json"))[0]).load_json()
-        responses = [Response.from_dict(item) for item in responses_json]
+        if cfg.rag.retrieval_only:
+            responses = load_retrieval_responses(results_path)
+        else:
+            responses = load_responses(results_path)
 
         logger.info(f"Loaded {len(responses)} responses!")
 
-    sampling_params = SamplingParams(
-        temperature=cfg.model.temperature, max_tokens=cfg.model.max_tokens
+    if cfg.rag.retrieval_only:
+        # Only the retrieval metrics, which need no runner
+        metrics_config, runner = retrieval_metrics(cfg.metrics), None
+    else:
+        sampling_params = SamplingParams(
+            temperature=cfg.model.temperature, max_tokens=cfg.model.max_tokens
+        )
+        metrics_config = cfg.metrics
+        runner = BatchInferenceRunner(sampling_params, cfg.model.model_name, base_url=cfg.base_url)
+
+    # Load metrics and run them concurrently on one shared wrapper
+    worker = connect_metric_worker(cfg.metric_worker.socket) if cfg.metric_worker.enabled else None
+    plan: MetricPlan = load_metrics(
+        metrics_config,
+        runner,
+        worker,
+        cfg.metric_worker.metrics,  # ty: ignore
     )
-    runner = BatchInferenceRunner(sampling_params, cfg.model.model_name, base_url=cfg.base_url)
-
-    # Load metrics
-    metrics: list[Metric] = load_metrics(cfg.metrics, runner)
-    metrics_log = []
-    for metric in metrics:
-        result: MetricOutput = metric(ResponseWrapper(responses))
-        metrics_log.append({metric.name: result.to_dict()})
+    scheduler = MetricScheduler(cfg.metric_scheduler.max_workers, cfg.metric_scheduler.trace_memory)
+    results, timings = scheduler.run(
+        plan.tasks(cfg.metric_scheduler.slow_metrics), ResponseWrapper(responses)
+    )
+    results = plan.order(results)
+    profiler = active_profiler()
+    if profiler is not None:
+        for name, timing in timings.items():
+            profiler.add_stage(f"metric/{name}", timing.seconds)
 
-        mlflow.log_metric(metric.name, result.score)  # ty: ignore
+    metrics_log = [{name: result.to_dict()} for name, result in results.items()]
+    tracker.log_metrics({name: result.score for name, result in results.items()})
+    tracker.log_metrics(timing_metrics(timings))
 
-    FileManager(
-        hydra.core.hydra_config.HydraConfig.get().runtime.output_dir + "/metrics_log.json"
-    ).dump_json(metrics_log, pydantic_encoder=True)
+    FileManager(results_path / "metrics_log.json").dump_json(metrics_log, pydantic_encoder=True)
 
 
 if __name__ == "__main__":
@@ -1,28 +1,217 @@
 """Module for evaluation of QA datasets."""
 
+from dataclasses import dataclass
 from pathlib import Path
+from typing import TYPE_CHECKING
 
 import hydra
 import hydra.core.hydra_config
 import mlflow
-import mlflow.data.pandas_dataset
-import pandas as pd
-from datasets import load_dataset
 from dotenv import load_dotenv
-from encourage.llm import BatchInferenceRunner, ResponseWrapper
-from encourage.rag import RAGFactory
-from vllm import SamplingParams
+from encourage.llm import BatchInferenceRunner, ResponseWrapper, SamplingParams
 
 from exp.data.finqa_qa import FinQADatasetCollection
+from exp.data.snapshot import load_normalized_dataset
+from exp.data.subset import hash_shard_mask
 from exp.evaluation.config import Config
-from exp.evaluation.evaluation import main as evaluation
+from exp.evaluation.evaluation import evaluation
 from exp.evaluation.factory_helper import get_response_format
+from exp.evaluation.sharding import manifest_name, shard_file_name, write_manifest
+from exp.inference.dispatcher import AdaptiveConcurrency, AsyncDispatcher, DispatchingRunner
+from exp.inference.preflight import PreflightReport, load_tokenizer, preflight
+from exp.inference.readiness import ReadinessFile, startup_metrics
+from exp.inference.replicas import ReplicaPool, replica_base_urls
+from exp.inference.response_cache import CachedRunner, ResponseCache
+from exp.inference.runner import ProfilingRunner
+from exp.inference.structured_output import StructuredOutputStage
+from exp.retrieval.embedding_cache import CachedEmbeddingFunction, EmbeddingCache, create_rag
+from exp.retrieval.retrieval_only import RETRIEVAL_LOG_NAME, run_retrieval
 from exp.utils.file_manager import FileManager
 from exp.utils.flatten_dict import flatten_dict
+from exp.utils.inference_log import INFERENCE_LOG_NAME, InferenceLog
+from exp.utils.mlflow_logger import tracked_run
+from exp.utils.profiler import PROFILE_NAME, active_profiler, profiling, stage
+from exp.utils.response_table import RESPONSE_TABLE_NAME, ResponseTableBuilder
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 config_path = str((Path(__file__).parents[3] / "conf").resolve())
 
 
+@dataclass
+class SharedResources:
+    """Objects that several runs with the same model and dataset can share."""
+
+    qa_dataset: "pd.DataFrame"
+    dataset_obj: FinQADatasetCollection
+    runner: BatchInferenceRunner | None
+    sampling_params: SamplingParams
+    response_cache: ResponseCache | None = None
+    embedding_function: str | CachedEmbeddingFunction = "default"
+    retry_runner: BatchInferenceRunner | None = None
+    preflight: PreflightReport | None = None
+    replica_pool: ReplicaPool | None = None
+
+
+def build_runner(
+    cfg: Config,
+    sampling_params: SamplingParams,
+    use_cache: bool = True,
+    replica_pool: ReplicaPool | None = None,
+) -> tuple[BatchInferenceRunner, ResponseCache | None]:
+    """Create the inference runner with the configured dispatcher and response cache.
+
+    With several replicas the requests are routed through `replica_pool`, a new pool is created
+    if none is given.
+    """
+    runner = BatchInferenceRunner(sampling_params, cfg.model.model_name, base_url=cfg.base_url)
+    # Load balancing over several replicas happens in the dispatcher
+    use_dispatcher = cfg.dispatcher.enabled or cfg.serving.replicas > 1
+    if not use_dispatcher:
+        # The dispatcher records its requests itself, including tokens and time to first token
+        runner = ProfilingRunner(runner, stage_name=None, record_requests=True)
+    else:
+        if replica_pool is None and cfg.serving.replicas > 1:
+            replica_pool = build_replica_pool(cfg)
+        controller = AdaptiveConcurrency(
+            cfg.dispatcher.max_in_flight,
+            cfg.dispatcher.min_in_flight,
+            cfg.dispatcher.initial_in_flight,
+            cfg.dispatcher.latency_tolerance,
+        )
+        dispatcher = AsyncDispatcher(
+            cfg.base_url,
+            cfg.model.model_name,
+            sampling_params,
+            controller,
+            max_retries=cfg.dispatcher.max_retries,
+            timeout_s=cfg.dispatcher.timeout_s,
+            replica_pool=replica_pool,
+            stream=cfg.dispatcher.stream,
+        )
+        runner = DispatchingRunner(runner, dispatcher)
+    response_cache = None
+    if cfg.response_cache.enabled and use_cache:
+        response_cache = ResponseCache(
+            cfg.response_cache.path, cfg.response_cache.max_size_mb, cfg.response_cache.max_age_days
+        )
+        runner = CachedRunner(runner, response_cache, cfg.model.model_name, sampling_params)
+    return ProfilingRunner(runner), response_cache
+
+
+def build_replica_pool(cfg: Config) -> ReplicaPool:
+    """Create the pool of the configured vLLM replicas."""
+    return ReplicaPool(
+        replica_base_urls(cfg.base_url, cfg.serving.replicas),
+        cfg.serving.max_failures,
+        cfg.serving.cooldown_s,
+    )
+
+
+def prepare_resources(cfg: Config, qa_dataset: "pd.DataFrame | None" = None) -> SharedResources:
+    """Load the dataset and create the runner and the embedding function.
+
+    A `qa_dataset` in the shape of `normalize_finqa_frame`, e.g. a synthetic one, is used instead
+    of the configured dataset.
+    """
+    sampling_params = SamplingParams(
+        temperature=cfg.model.temperature, max_tokens=cfg.model.max_tokens
+    )
+    # Retrieval-only runs never talk to the LLM server
+    runner, response_cache, retry_runner, replica_pool = None, None, None, None
+    if not cfg.rag.retrieval_only:
+        # The retries share the pool, so that it sees all outstanding requests of a replica
+        if cfg.serving.replicas > 1:
+            replica_pool = build_replica_pool(cfg)
+        runner, response_cache = build_runner(cfg, sampling_params, replica_pool=replica_pool)
+    if (
+        not cfg.rag.retrieval_only
+        and cfg.structured_output.enabled
+        and cfg.structured_output.max_retries > 0
+    ):
+        retry_params = SamplingParams(
+            temperature=cfg.structured_output.retry_temperature
+            if cfg.structured_output.retry_temperature is not None
+            else cfg.model.temperature,
+            max_tokens=cfg.structured_output.retry_max_tokens or cfg.model.max_tokens,
+        )
+        retry_runner, _ = build_runner(
+            cfg, retry_params, use_cache=False, replica_pool=replica_pool
+        )
+        if response_cache is not None:
+            # A recovered response is stored under the key of the original request, so that a
+            # rerun gets it from the cache without a retry
+            retry_runner = CachedRunner(
+                retry_runner, response_cache, cfg.model.model_name, sampling_params
+            )
+
+    with stage("dataset_load"):
+        if qa_dataset is None:
+            qa_dataset = load_normalized_dataset(
+                cfg.dataset.name,
+                cfg.dataset.split,
+                cfg.dataset.meta_data_keys,
+                cfg.dataset.snapshot_dir if cfg.dataset.snapshot_cache else None,
+            )
+    with stage("dataset_construction"):
+        dataset_obj = FinQADatasetCollection(
+            qa_dataset,
+            cfg.dataset.retrieval_query,
+            cfg.dataset.meta_data_keys,
+            cfg.dataset.document_percentage,
+            normalized=True,
+            sample_percentage=cfg.dataset.sample_percentage,
+            subset_seed=cfg.dataset.subset_seed,
+        )
+    preflight_report = None
+    if cfg.preflight.enabled and not cfg.rag.retrieval_only:
+        with stage("preflight"):
+            preflight_report = run_preflight(cfg, dataset_obj)
+
+    embedding_function = cfg.vector_db.embedding_function
+    if cfg.vector_db.embedding_cache and embedding_function != "default":
+        embedding_function = CachedEmbeddingFunction(
+            embedding_function, EmbeddingCache(cfg.vector_db.embedding_cache_path)
+        )
+    return SharedResources(
+        qa_dataset,
+        dataset_obj,
+        runner,
+        sampling_params,
+        response_cache,
+        embedding_function,
+        retry_runner,
+        preflight_report,
+        replica_pool,
+    )
+
+
+def run_preflight(cfg: Config, dataset_obj: FinQADatasetCollection) -> PreflightReport | None:
+    """Check the prompt lengths with the tokenizer of the model, None if it can not be loaded."""
+    tokenizer_name = cfg.preflight.tokenizer or cfg.model.model_name
+    try:
+        tokenizer = load_tokenizer(tokenizer_name)
+    except (OSError, ValueError) as e:
+        print(f"Skipping the preflight, no tokenizer for {tokenizer_name}: {e}")
+        return None
+    report = preflight(
+        dataset_obj,
+        tokenizer,
+        FileManager(cfg.dataset.sys_prompt_path).read(),
+        cfg.dataset.template_name,
+        cfg.model.max_model_len - cfg.model.max_tokens,
+        cfg.preflight.policy,  # ty: ignore
+        # Only KnownContext sends the context of the sample, the others retrieved documents
+        {"KnownContext": None, "NoContext": 0}.get(cfg.rag.method, cfg.vector_db.top_k),
+    )
+    print(
+        f"Preflight: {report.over_budget} of {len(report.prompt_tokens) + len(report.rejected_ids)}"
+        f" prompts over {report.budget} tokens, {len(report.rejected_ids)} rejected"
+    )
+    return report
+
+
 @hydra.main(version_base=None, config_path=config_path, config_name="defaults")
 def main(cfg: Config) -> None:
     """Main function for evaluation of QA datasets."""
@@ -30,65 +219,171 @@ def main(cfg: Config) -> None:
 
     mlflow.openai.autolog()
 
-    # Setup the inference runner and system prompt
-    sampling_params = SamplingParams(
-        temperature=cfg.model.temperature, max_tokens=cfg.model.max_tokens
-    )
-    runner = BatchInferenceRunner(sampling_params, cfg.model.model_name, base_url=cfg.base_url)
+    execute(cfg, Path(hydra.core.hydra_config.HydraConfig.get().runtime.output_dir))
+
+
+def execute(cfg: Config, output_dir: Path, resources: SharedResources | None = None) -> None:
+    """Run inference and evaluation for one configuration.
+
+    The stage timings and request statistics of the run are written to `profile.json` in the
+    output folder and logged to MLflow. With `sharding.num_shards > 1`, only the samples of
+    `sharding.shard_index` are run into a partial log and the evaluation is left to the merge.
+
+    Args:
+        cfg (Config): The configuration of the run.
+        output_dir (Path): The folder for the inference log and the metrics.
+        resources (SharedResources | None): Dataset, runner and embedding function shared with
+            other runs, created from `cfg` if not given.
+
+    """
+    with profiling(output_dir / "profile.prof" if cfg.profiling.cprofile else None):
+        _execute(cfg, output_dir, resources)
+
+
+def _execute(cfg: Config, output_dir: Path, resources: SharedResources | None) -> None:
+    # Only a run that generates needs the RAG methods and the dataset logging of MLflow
+    import mlflow.data.pandas_dataset
+    from encourage.rag import RAGMethod
+
+    resources = resources or prepare_resources(cfg)
+    runner = resources.runner
+    response_cache = resources.response_cache
+    embedding_function = resources.embedding_function
+    qa_dataset = resources.qa_dataset
+    dataset_obj = resources.dataset_obj
+    # Counters of shared caches are reported per run
+    if response_cache is not None:
+        response_cache.reset_counters()
+    if isinstance(embedding_function, CachedEmbeddingFunction):
+        embedding_function.reset_counters()
+    if resources.replica_pool is not None:
+        resources.replica_pool.reset_counters()
     sys_prompt = FileManager(cfg.dataset.sys_prompt_path).read()
 
-    ## MLflow setup
-    mlflow.set_tracking_uri(cfg.mlflow.uri)
-    mlflow.set_experiment(experiment_name=cfg.mlflow.experiment_id)
+    num_shards, shard_index = cfg.sharding.num_shards, cfg.sharding.shard_index
+    sharded = num_shards > 1
+    sample_mask = None
+    file_names = (INFERENCE_LOG_NAME, RETRIEVAL_LOG_NAME, PROFILE_NAME)
+    if sharded:
+        if not 0 <= shard_index < num_shards:
+            raise ValueError(f"sharding.shard_index must be in [0, {num_shards}): {shard_index}")
+        # Only the samples of the shard are sent, the contexts of all samples stay in the
+        # vector DB so that retrieval searches the full corpus
+        sample_mask = hash_shard_mask(dataset_obj.columns["context_id"], num_shards, shard_index)
+        file_names = tuple(shard_file_name(name, shard_index, num_shards) for name in file_names)
+        # The manifest of an earlier attempt must not mark the shard as finished
+        FileManager(output_dir / manifest_name(shard_index, num_shards)).delete()
+    inference_log_name, retrieval_log_name, profile_name = file_names
 
-    qa_dataset = load_dataset(cfg.dataset.name, split=cfg.dataset.split).to_pandas()
-    dataset_obj = FinQADatasetCollection(
-        qa_dataset, cfg.dataset.retrieval_query, cfg.dataset.meta_data_keys
-    )
+    server_info = None
+    if cfg.serving.wait_for_ready:
+        server_info = ReadinessFile(cfg.serving.readiness_file).wait(cfg.serving.ready_timeout_s)
 
-    with mlflow.start_run():
-        mlflow.log_params(flatten_dict(cfg))
-        mlflow.log_params({"dataset_size": len(qa_dataset)})
-        mlflow.log_input(
+    ## MLflow setup, logging happens in the background and is spooled if the server is down
+    with tracked_run(cfg.mlflow.uri, cfg.mlflow.experiment_id, cfg.mlflow.spool_dir) as tracker:
+        tracker.log_params(flatten_dict(cfg))
+        if server_info is not None:
+            tracker.log_metrics(startup_metrics(server_info))
+        tracker.log_params(
+            {
+                "dataset_size": len(qa_dataset),
+                "subset_size": len(dataset_obj),
+                "unique_documents": len(dataset_obj.context_store),
+                "shard_size": len(dataset_obj) if sample_mask is None else int(sample_mask.sum()),
+            }
+        )
+        tracker.log_input(
             mlflow.data.pandas_dataset.from_pandas(qa_dataset, name=cfg.dataset.name),
             context="inference",
         )
 
+        inference_log = InferenceLog(output_dir / inference_log_name)
+        if not cfg.inference.resume:
+            inference_log.reset()
+
+        structured_output = None
         with mlflow.start_span(name="root"):
             rag_config = {
                 **cfg.rag,
-                "context_collection": dataset_obj.get_context_collection(),
+                "context_collection": dataset_obj.get_context_collection(
+                    per_sample=cfg.rag.method == RAGMethod.KnownContext.value
+                ),
                 "collection_name": cfg.vector_db.collection_name,
-                "embedding_function": cfg.vector_db.embedding_function,
+                "embedding_function": embedding_function,
                 "top_k": cfg.vector_db.top_k,
                 "runner": runner,
                 "template_name": cfg.dataset.template_name,
             }
-            rag_method_instance = RAGFactory.create(rag_config)
-            responses: ResponseWrapper = dataset_obj.run(
-                rag_method_instance,
-                runner,
-                sys_prompt,
-                cfg.dataset.template_name,
-                response_format=get_response_format(cfg),
-            )
-
-        json_dump = [response.to_dict() for response in responses.response_data]
-        FileManager(
-            hydra.core.hydra_config.HydraConfig.get().runtime.output_dir + "/inference_log.json"
-        ).dump_json(json_dump)
-        json_dump = [flatten_dict(response.to_dict()) for response in responses.response_data]
+            with stage("vector_ingestion"):
+                rag_method_instance = create_rag(rag_config)
+            if cfg.rag.retrieval_only:
+                with stage("retrieval"):
+                    n_samples = run_retrieval(
+                        rag_method_instance,
+                        dataset_obj,
+                        output_dir / retrieval_log_name,
+                        cfg.inference.batch_size,
+                        sample_mask,
+                    )
+                print(f"Retrieved contexts for {n_samples} samples")
+            else:
+                response_format = get_response_format(cfg)
+                if cfg.structured_output.enabled and response_format is not None:
+                    structured_output = StructuredOutputStage(
+                        response_format, cfg.structured_output.max_retries
+                    )
+                responses: ResponseWrapper = dataset_obj.run(
+                    rag_method_instance,
+                    runner,  # ty: ignore
+                    sys_prompt,
+                    cfg.dataset.template_name,
+                    response_format=response_format,
+                    inference_log=inference_log,
+                    batch_size=cfg.inference.batch_size,
+                    structured_output=structured_output,
+                    retry_runner=resources.retry_runner,
+                    prefix_ordering=cfg.inference.prefix_ordering,
+                    length_buckets=cfg.preflight.length_buckets,
+                    sample_mask=sample_mask,
+                )
+                print(f"Generated {len(responses.response_data)} new responses")
+        if structured_output is not None:
+            tracker.log_metrics(structured_output.stats())
+        if resources.preflight is not None:
+            tracker.log_metrics(resources.preflight.metrics())
+        if dataset_obj.prefix_schedule is not None:
+            tracker.log_metrics(dataset_obj.prefix_schedule.metrics())
+        if response_cache is not None:
+            tracker.log_metrics(response_cache.stats())
+        if isinstance(embedding_function, CachedEmbeddingFunction):
+            tracker.log_metrics(embedding_function.stats())
+        if resources.replica_pool is not None:
+            tracker.log_metrics(resources.replica_pool.stats())
 
-        active_run = mlflow.active_run()
-        run_name = active_run.info.run_name if active_run else "responses"
+        if sharded:
+            write_manifest(
+                output_dir,
+                shard_index,
+                num_shards,
+                [str(sample_id) for sample_id in dataset_obj.columns["id"][sample_mask]],
+                resources.preflight.rejected_ids if resources.preflight is not None else [],
+            )
+        elif not cfg.rag.retrieval_only:
+            # The log also holds the responses of earlier attempts when resuming
+            with stage("response_table"):
+                table_path = ResponseTableBuilder.from_records(
+                    inference_log.latest_records()
+                ).write(output_dir / RESPONSE_TABLE_NAME)
+            tracker.log_artifact(table_path)
 
-        try:
-            mlflow.log_table(data=pd.DataFrame(json_dump), artifact_file=f"{run_name}.json")
-        except Exception as e:
-            print(f"Failed to log table to MLflow: {e}")
+        # Evaluate the retrieval, a sharded run is evaluated once all shards are merged
+        if not sharded:
+            evaluation(cfg, output_dir, tracker)
 
-        # Evaluate the retrieval
-        evaluation(cfg)
+        profiler = active_profiler()
+        if profiler is not None:
+            tracker.log_metrics(profiler.metrics())
+            tracker.log_artifact(profiler.write(output_dir / profile_name))
 
 
 if __name__ == "__main__":
@@ -1,5 +1,7 @@
 """Helper functions for the evaluation factory."""
 
+import logging
+from multiprocessing.managers import BaseProxy
 from typing import Any, Dict, Optional, Tuple
 
 from encourage.llm import BatchInferenceRunner
@@ -8,13 +10,24 @@ from omegaconf import DictConfig, OmegaConf
 from pydantic import BaseModel, create_model
 
 from exp.evaluation.config import Config
+from exp.evaluation.metric_plan import METRIC_FAMILIES, MetricPlan, PlannedMetric
+from exp.evaluation.metric_worker import RemoteMetric
+
+logger = logging.getLogger(__name__)
 
 
 def load_metrics(
-    config: list[str | dict[str, dict[str, str]]], runner: BatchInferenceRunner = None
-) -> list:
-    """Load metrics from the config."""
-    metrics = []
+    config: list[str | dict[str, dict[str, str]]],
+    runner: BatchInferenceRunner = None,
+    worker: BaseProxy | None = None,
+    worker_metrics: list[str] = [],
+) -> MetricPlan:
+    """Load metrics from the config into a plan that shares work between metric variants.
+
+    Metrics in `worker_metrics` are scored by the resident metric worker, if one is given.
+    """
+    served = {name.lower() for name in worker_metrics} if worker is not None else set()
+    plan = MetricPlan()
     for m in config:
         if isinstance(m, str):
             name, args = m, {}  # type: ignore
@@ -27,13 +40,22 @@ def load_metrics(
 
         cls = METRIC_REGISTRY[name.lower()]
 
-        if cls.requires_runner():
+        metric = None
+        # Metric families and metrics that need the runner are always computed locally
+        if name.lower() in served - METRIC_FAMILIES.keys() and not cls.requires_runner():
+            try:
+                metric = RemoteMetric(worker, name, args)  # ty: ignore
+            except (OSError, EOFError) as e:
+                logger.warning(f"Metric worker failed, loading {name} locally: {e}")
+        if metric is not None:
+            logger.info(f"Scoring {name} with the metric worker")
+        elif cls.requires_runner():
             metric = get_metric_from_registry(name, runner=runner, **args)
         else:
             metric = get_metric_from_registry(name, **args)
 
-        metrics.append(metric)
-    return metrics
+        plan.planned.append(PlannedMetric(name, args, metric))  # ty: ignore
+    return plan
 
 
 def get_response_format(cfg: Config) -> Optional[type[BaseModel]]:
@@ -0,0 +1,182 @@
+"""Metric plan that computes parameterized variants of a metric family in one pass."""
+
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterator
+
+import numpy as np
+from encourage.llm import Response, ResponseWrapper
+from encourage.metrics import Metric, MetricOutput
+
+from exp.evaluation.metric_scheduler import MetricTask, metric_task
+
+
+@dataclass
+class PlannedMetric:
+    """A metric of the plan together with the registry name and arguments it was created with."""
+
+    name: str
+    args: dict[str, Any]
+    metric: Metric
+
+
+FamilyRunner = Callable[[list[PlannedMetric], ResponseWrapper], list[tuple[str, MetricOutput]]]
+
+
+def _document_id(document: Any) -> str | None:
+    if document is None:
+        return None
+    if isinstance(document, dict):
+        return str(document.get("id"))
+    return str(getattr(document, "id", document))
+
+
+def _reference_ids(response: Response) -> set[str]:
+    reference = response.meta_data["reference_document"]
+    references = reference if isinstance(reference, list) else [reference]
+    return {ref_id for ref_id in map(_document_id, references) if ref_id is not None}
+
+
+def _ranked_ids(response: Response) -> list[str]:
+    """Get the IDs of the retrieved documents by descending score, as ir_measures ranks them."""
+    context = response.context
+    documents = getattr(context, "documents", None)
+    if documents is None and isinstance(context, dict):
+        documents = context.get("documents", [])
+    scores: dict[str, float] = {}
+    for document in documents or []:
+        score = (
+            document.get("score") if isinstance(document, dict) else getattr(document, "score", 0)
+        )
+        scores[_document_id(document)] = float(score or 0.0)  # type: ignore
+    # Ties are broken by the descending document ID, like trec_eval does
+    return sorted(scores, key=lambda doc_id: (scores[doc_id], doc_id), reverse=True)
+
+
+def rank_matrix(responses: ResponseWrapper, depth: int) -> tuple[np.ndarray, np.ndarray]:
+    """Build the relevance matrix of the retrieved documents, ranked by their score.
+
+    Args:
+        responses (ResponseWrapper): The responses with retrieved contexts.
+        depth (int): The number of ranks to consider.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: A boolean matrix of shape (responses, depth) that is true
+            where the document at that rank is relevant, and the number of relevant documents
+            per response.
+
+    """
+    response_data = responses.response_data
+    relevant = np.zeros((len(response_data), depth), dtype=bool)
+    n_relevant = np.zeros(len(response_data), dtype=np.int64)
+    for i, response in enumerate(response_data):
+        reference_ids = _reference_ids(response)
+        n_relevant[i] = len(reference_ids)
+        retrieved = _ranked_ids(response)[:depth]
+        relevant[i, : len(retrieved)] = [doc_id in reference_ids for doc_id in retrieved]
+    return relevant, n_relevant
+
+
+def recall_at_k_family(
+    members: list[PlannedMetric], responses: ResponseWrapper
+) -> list[tuple[str, MetricOutput]]:
+    """Compute RecallAtK for all k values from one rank matrix."""
+    members[0].metric.validate_nested_keys(responses)
+    ks = [int(member.args["k"]) for member in members]
+    relevant, n_relevant = rank_matrix(responses, max(ks))
+    hits = np.cumsum(relevant, axis=1)
+    denominator = np.maximum(n_relevant, 1)[:, None]
+    recall = hits / denominator
+    outputs = []
+    for member, k in zip(members, ks):
+        raw = recall[:, k - 1] if len(recall) else np.zeros(0)
+        outputs.append(
+            (
+                member.metric.name,
+                MetricOutput(score=float(raw.mean()) if len(raw) else 0.0, raw=raw.tolist()),
+            )
+        )
+    return outputs
+
+
+def rouge_family(
+    members: list[PlannedMetric], responses: ResponseWrapper
+) -> list[tuple[str, MetricOutput]]:
+    """Compute all ROUGE types with one scorer pass over the responses."""
+    from rouge_score import rouge_scorer
+
+    rouge_types = [str(member.args["rouge_type"]) for member in members]
+    scorer = rouge_scorer.RougeScorer(list(dict.fromkeys(rouge_types)))
+    results = [
+        scorer.score(
+            str(response.meta_data["reference_answer"] or ""), str(response.response or "")
+        )
+        for response in responses.response_data
+    ]
+    scores = np.array(
+        [[result[rouge_type].fmeasure for rouge_type in rouge_types] for result in results],
+        dtype=float,
+    ).reshape(len(results), len(rouge_types))
+    return [
+        (
+            member.metric.name,
+            MetricOutput(
+                score=float(scores[:, i].mean()) if len(scores) else 0.0,
+                raw=scores[:, i].tolist(),
+            ),
+        )
+        for i, member in enumerate(members)
+    ]
+
+
+# Registry names of the metric families whose variants are computed in one pass
+METRIC_FAMILIES: dict[str, FamilyRunner] = {
+    "recallatk": recall_at_k_family,
+    "rouge": rouge_family,
+}
+
+
+@dataclass
+class MetricPlan:
+    """Metrics loaded from the config, grouped into tasks for the `MetricScheduler`.
+
+    Variants of a metric in `METRIC_FAMILIES` become a single task that computes all of them
+    in one pass. Outputs keep the per-variant names of the original metrics.
+    """
+
+    planned: list[PlannedMetric] = field(default_factory=list)
+
+    def __iter__(self) -> Iterator[Metric]:
+        return (planned.metric for planned in self.planned)
+
+    def __len__(self) -> int:
+        return len(self.planned)
+
+    @property
+    def metric_names(self) -> list[str]:
+        """The names of the metrics in config order."""
+        return [planned.metric.name for planned in self.planned]
+
+    def tasks(self, slow_metrics: list[str] = []) -> list[MetricTask]:
+        """Create the scheduler tasks, one per metric family and one per other metric."""
+        families: dict[str, list[PlannedMetric]] = {}
+        tasks = []
+        for planned in self.planned:
+            family = planned.name.lower()
+            if family not in METRIC_FAMILIES:
+                tasks.append(metric_task(planned.metric, slow_metrics))
+                continue
+            if family not in families:
+                families[family] = []
+                tasks.append(self._family_task(family, families[family]))
+            families[family].append(planned)
+        return tasks
+
+    def order(self, outputs: dict[str, MetricOutput]) -> dict[str, MetricOutput]:
+        """Sort the outputs of the scheduler by config order."""
+        return {name: outputs[name] for name in self.metric_names if name in outputs}
+
+    @staticmethod
+    def _family_task(family: str, members: list[PlannedMetric]) -> MetricTask:
+        return MetricTask(
+            name=family, run=lambda responses: METRIC_FAMILIES[family](members, responses)
+        )
@@ -0,0 +1,135 @@
+"""Concurrent execution of evaluation metrics with per-metric timing."""
+
+import logging
+import re
+import threading
+import time
+import tracemalloc
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable
+
+from encourage.llm import ResponseWrapper
+from encourage.metrics import Metric, MetricOutput
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class MetricTask:
+    """A unit of evaluation work that produces one or more named metric outputs."""
+
+    name: str
+    run: Callable[[ResponseWrapper], list[tuple[str, MetricOutput]]]
+    slow: bool = False
+
+
+@dataclass
+class MetricTiming:
+    """Wall time and peak memory of a metric task."""
+
+    seconds: float
+    peak_memory_mb: float | None = None
+
+
+def metric_task(metric: Metric, slow_metrics: list[str] = []) -> MetricTask:
+    """Wrap a metric in a task, marking it as slow if its class or name is in `slow_metrics`."""
+    slow_names = {name.lower() for name in slow_metrics}
+    class_name = getattr(metric, "class_name", type(metric).__name__)
+    slow = class_name.lower() in slow_names or metric.name.lower() in slow_names
+    return MetricTask(
+        name=metric.name, run=lambda responses: [(metric.name, metric(responses))], slow=slow
+    )
+
+
+class MetricScheduler:
+    """Runs metric tasks concurrently on one shared `ResponseWrapper`.
+
+    Cheap tasks share a thread pool, slow model-based tasks run one after another in a separate
+    worker thread, so the cheap tasks do not queue behind them. Model-based metrics spend most
+    of their time in native code that releases the GIL, which lets both lanes progress at once.
+    """
+
+    def __init__(self, max_workers: int = 4, trace_memory: bool = True) -> None:
+        """Initialize the scheduler.
+
+        Args:
+            max_workers (int): The number of threads for the cheap tasks.
+            trace_memory (bool): Whether to record the peak memory of each task with tracemalloc.
+                Tasks that overlap share the tracer, so their peaks are approximate.
+
+        """
+        self.max_workers = max_workers
+        self.trace_memory = trace_memory
+        self._memory_lock = threading.Lock()
+
+    def run(
+        self, tasks: list[MetricTask], responses: ResponseWrapper
+    ) -> tuple[dict[str, MetricOutput], dict[str, MetricTiming]]:
+        """Run all tasks and collect their outputs and timings.
+
+        Args:
+            tasks (list[MetricTask]): The tasks to run.
+            responses (ResponseWrapper): The responses to evaluate, shared by all tasks.
+
+        Returns:
+            tuple[dict[str, MetricOutput], dict[str, MetricTiming]]: The outputs by metric name in
+                task order, and the timing of every task by task name.
+
+        """
+        started_tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        try:
+            with (
+                ThreadPoolExecutor(self.max_workers, thread_name_prefix="metric") as cheap_pool,
+                ThreadPoolExecutor(1, thread_name_prefix="slow-metric") as slow_pool,
+            ):
+                futures: list[Future] = [
+                    (slow_pool if task.slow else cheap_pool).submit(self._run_task, task, responses)
+                    for task in tasks
+                ]
+                results = [future.result() for future in futures]
+        finally:
+            if started_tracing:
+                tracemalloc.stop()
+
+        outputs: dict[str, MetricOutput] = {}
+        timings: dict[str, MetricTiming] = {}
+        for task, (task_outputs, timing) in zip(tasks, results):
+            outputs.update(task_outputs)
+            timings[task.name] = timing
+            logger.info(f"Metric {task.name} took {timing.seconds:.2f}s")
+        return outputs, timings
+
+    def _run_task(
+        self, task: MetricTask, responses: ResponseWrapper
+    ) -> tuple[list[tuple[str, MetricOutput]], MetricTiming]:
+        start_memory = self._traced_memory()
+        start = time.perf_counter()
+        outputs = task.run(responses)
+        seconds = time.perf_counter() - start
+        peak_memory_mb = None
+        if start_memory is not None:
+            _, peak = tracemalloc.get_traced_memory()
+            peak_memory_mb = max(peak - start_memory, 0) / (1024 * 1024)
+        return outputs, MetricTiming(seconds, peak_memory_mb)
+
+    def _traced_memory(self) -> int | None:
+        if not tracemalloc.is_tracing():
+            return None
+        with self._memory_lock:
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+        return current
+
+
+def timing_metrics(timings: dict[str, MetricTiming]) -> dict[str, float]:
+    """Convert task timings to MLflow metrics."""
+    metrics = {}
+    for name, timing in timings.items():
+        key = re.sub(r"[^\w\-./ ]", "_", name)
+        metrics[f"timing/{key}/seconds"] = timing.seconds
+        if timing.peak_memory_mb is not None:
+            metrics[f"timing/{key}/peak_memory_mb"] = timing.peak_memory_mb
+    return metrics
@@ -0,0 +1,286 @@
+"""Resident worker that keeps model-based metrics loaded between evaluations.
+
+Metrics like BERTScore load a transformer model every time they are created, which on CPU
+often takes longer than the scoring itself. The worker creates these metrics once and serves
+batched scoring requests over a Unix socket with a multiprocessing manager. `load_metrics` uses
+the worker for the metrics in `metric_worker.metrics` when it is running. Metrics that were not
+used for `metric_worker.idle_timeout_s` seconds are dropped to free their memory.
+
+Usage (takes the same Hydra overrides as the evaluation, the metrics of the config are loaded
+at start):
+    uv run python -m exp.evaluation.metric_worker metric_worker.idle_timeout_s=1800
+"""
+
+import argparse
+import gc
+import json
+import logging
+import os
+import secrets
+import sys
+import threading
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.managers import BaseManager, BaseProxy
+from pathlib import Path
+from typing import Any, Union
+
+from encourage.llm import Response, ResponseWrapper
+from encourage.metrics import Metric, MetricOutput, get_metric_from_registry
+
+logger = logging.getLogger(__name__)
+config_path = str((Path(__file__).parents[3] / "conf").resolve())
+
+WORKER_METHODS = ("describe", "score", "stats")
+
+
+def _authkey_path(socket_path: Path) -> Path:
+    return socket_path.with_name(f"{socket_path.name}.key")
+
+
+def _metric_key(name: str, args: dict[str, Any]) -> str:
+    return json.dumps([name.lower(), args], sort_keys=True, default=str)
+
+
+class _LoadedMetric:
+    def __init__(self, metric: Metric) -> None:
+        self.metric = metric
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+
+
+class MetricWorker:
+    """Creates metrics on first use, keeps them in memory and evicts idle ones."""
+
+    def __init__(self, idle_timeout_s: float | None = 900.0) -> None:
+        """Initialize the worker.
+
+        Args:
+            idle_timeout_s (float | None): Seconds after which an unused metric is dropped,
+                None keeps all metrics until the worker stops.
+
+        """
+        self.idle_timeout_s = idle_timeout_s
+        self.last_request = time.monotonic()
+        self.requests = 0
+        self.evictions = 0
+        self._metrics: dict[str, _LoadedMetric] = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name: str, args: dict[str, Any]) -> tuple[str, str]:
+        """Load a metric and get its output name and class name."""
+        metric = self._get(name, args).metric
+        return metric.name, type(metric).__name__
+
+    def score(self, name: str, args: dict[str, Any], response_data: list[Response]) -> MetricOutput:
+        """Score a batch of responses with a metric, loading the metric if needed."""
+        loaded = self._get(name, args)
+        # A metric is not necessarily thread-safe, concurrent requests for it are serialized
+        with loaded.lock:
+            output = loaded.metric(ResponseWrapper(response_data))
+            loaded.last_used = time.monotonic()
+        with self._lock:
+            self.requests += 1
+            self.last_request = time.monotonic()
+        return output
+
+    def stats(self) -> dict[str, Any]:
+        """Get the loaded metrics and the request and eviction counts."""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "loaded": {key: now - loaded.last_used for key, loaded in self._metrics.items()},
+                "requests": self.requests,
+                "evictions": self.evictions,
+                "idle_s": now - self.last_request,
+            }
+
+    def evict_idle(self) -> list[str]:
+        """Drop the metrics that were not used for `idle_timeout_s` seconds.
+
+        Returns:
+            list[str]: The keys of the dropped metrics.
+
+        """
+        if self.idle_timeout_s is None:
+            return []
+        now = time.monotonic()
+        with self._lock:
+            idle = [
+                key
+                for key, loaded in self._metrics.items()
+                if now - loaded.last_used > self.idle_timeout_s and not loaded.lock.locked()
+            ]
+            for key in idle:
+                del self._metrics[key]
+            self.evictions += len(idle)
+        if idle:
+            gc.collect()
+            torch = sys.modules.get("torch")
+            if torch is not None and torch.cuda.is_available():
+                torch.cuda.empty_cache()
+            logger.info(f"Evicted idle metrics: {idle}")
+        return idle
+
+    def _get(self, name: str, args: dict[str, Any]) -> _LoadedMetric:
+        key = _metric_key(name, args)
+        with self._lock:
+            loaded = self._metrics.get(key)
+            if loaded is None:
+                start = time.perf_counter()
+                loaded = _LoadedMetric(get_metric_from_registry(name, **args))
+                self._metrics[key] = loaded
+                logger.info(f"Loaded metric {key} in {time.perf_counter() - start:.1f}s")
+            loaded.last_used = time.monotonic()
+            return loaded
+
+
+class MetricWorkerManager(BaseManager):
+    """Manager that exposes the `MetricWorker` of the worker process."""
+
+
+MetricWorkerManager.register("worker", exposed=WORKER_METHODS)
+
+
+class RemoteMetric:
+    """A metric that is scored by the resident worker, with the call interface of a `Metric`."""
+
+    def __init__(self, worker: BaseProxy, name: str, args: dict[str, Any]) -> None:
+        """Load the metric in the worker, if it is not loaded yet."""
+        self.worker = worker
+        self.registry_name = name
+        self.args = args
+        self.name, self.class_name = worker.describe(name, args)
+
+    def __call__(self, responses: ResponseWrapper) -> MetricOutput:
+        """Send all responses as one batch to the worker and get the output."""
+        return self.worker.score(self.registry_name, self.args, responses.response_data)
+
+
+def connect_metric_worker(socket_path: Union[str, Path]) -> BaseProxy | None:
+    """Connect to the worker, None if it is not running or its key is not readable."""
+    socket_path = Path(socket_path)
+    if not socket_path.exists():
+        return None
+    try:
+        authkey = _authkey_path(socket_path).read_bytes()
+        manager = MetricWorkerManager(address=str(socket_path), authkey=authkey)
+        manager.connect()
+        return manager.worker()  # ty: ignore
+    except (OSError, EOFError, AuthenticationError) as e:
+        logger.warning(f"Metric worker at {socket_path} is not reachable: {e}")
+        return None
+
+
+def wait_for_metric_worker(socket_path: Union[str, Path], timeout_s: float = 600.0) -> BaseProxy:
+    """Wait until a starting worker accepts connections."""
+    start = time.perf_counter()
+    while (worker := connect_metric_worker(socket_path)) is None:
+        if time.perf_counter() - start > timeout_s:
+            raise TimeoutError(f"Metric worker at {socket_path} not ready after {timeout_s}s")
+        time.sleep(1.0)
+    return worker
+
+
+def serve(
+    socket_path: Union[str, Path],
+    worker: MetricWorker,
+    preload: list[tuple[str, dict[str, Any]]] = [],
+    exit_after_idle_s: float | None = None,
+) -> None:
+    """Serve the worker on a Unix socket until it is interrupted.
+
+    Args:
+        socket_path (Union[str, Path]): The path of the Unix socket.
+        worker (MetricWorker): The worker to serve.
+        preload (list[tuple[str, dict[str, Any]]]): Registry names and arguments of the metrics
+            to load before accepting requests.
+        exit_after_idle_s (float | None): Seconds without requests after which the worker stops,
+            None runs until it is interrupted.
+
+    """
+    socket_path = Path(socket_path)
+    if connect_metric_worker(socket_path) is not None:
+        raise RuntimeError(f"A metric worker is already running at {socket_path}")
+    socket_path.parent.mkdir(parents=True, exist_ok=True)
+    socket_path.unlink(missing_ok=True)
+    for name, args in preload:
+        worker.describe(name, args)
+
+    class _ServerManager(MetricWorkerManager):
+        pass
+
+    _ServerManager.register("worker", callable=lambda: worker, exposed=WORKER_METHODS)
+    # The responses are pickled, so only the user may connect. A random key per worker is
+    # shared in a file that only the user can read, and the socket and the key file are
+    # created without access for others, instead of changing the mode after binding.
+    authkey = secrets.token_bytes(32)
+    authkey_path = _authkey_path(socket_path)
+    authkey_path.unlink(missing_ok=True)
+    umask = os.umask(0o077)
+    try:
+        fd = os.open(authkey_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(authkey)
+        server = _ServerManager(address=str(socket_path), authkey=authkey).get_server()
+    finally:
+        os.umask(umask)
+
+    # The accept loop of `serve_forever` is run by hand, so that the reaper can stop it
+    server.stop_event = stop_event = threading.Event()  # ty: ignore
+
+    def _reap() -> None:
+        interval = min(filter(None, [worker.idle_timeout_s, exit_after_idle_s, 60.0]))
+        while not stop_event.wait(interval / 2):
+            worker.evict_idle()
+            idle_s = time.monotonic() - worker.last_request
+            if exit_after_idle_s is not None and idle_s > exit_after_idle_s:
+                logger.info(f"No requests for {idle_s:.0f}s, stopping the metric worker")
+                stop_event.set()
+
+    threading.Thread(target=server.accepter, name="metric-worker", daemon=True).start()
+    threading.Thread(target=_reap, name="metric-worker-reaper", daemon=True).start()
+    logger.info(f"Metric worker listening on {socket_path}")
+    try:
+        while not stop_event.wait(1.0):
+            pass
+    except KeyboardInterrupt:
+        stop_event.set()
+    finally:
+        server.listener.close()
+        socket_path.unlink(missing_ok=True)
+        authkey_path.unlink(missing_ok=True)
+
+
+def main() -> None:
+    """Start the worker with the metrics of the config."""
+    from hydra import compose, initialize_config_dir
+    from omegaconf import DictConfig, OmegaConf
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--exit-after", type=float, default=None, help="Idle seconds until exit")
+    args, overrides = parser.parse_known_args()
+    logging.basicConfig(level=logging.INFO)
+
+    with initialize_config_dir(config_dir=config_path, version_base=None):
+        cfg = compose("defaults", overrides=overrides)
+    served = {name.lower() for name in cfg.metric_worker.metrics}
+    preload = []
+    for m in cfg.metrics:
+        if isinstance(m, DictConfig):
+            m = OmegaConf.to_container(m, resolve=True)
+            name, metric_args = next(iter(m.items()))  # type: ignore
+        else:
+            name, metric_args = m, {}
+        if name.lower() in served:
+            preload.append((name, metric_args))
+    serve(
+        cfg.metric_worker.socket,
+        MetricWorker(cfg.metric_worker.idle_timeout_s),
+        preload,
+        args.exit_after,
+    )
+
+
+if __name__ == "__main__":
+    main()
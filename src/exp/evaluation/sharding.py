@@ -0,0 +1,282 @@
+"""Sharded execution over several worker processes or hosts, and the merge of the shards.
+
+With `sharding.num_shards > 1`, `execute` only sends the samples of shard `sharding.shard_index`.
+Samples are assigned to shards by the hash of their context ID, so every worker computes the
+same shards on any host, and samples that share a context stay in one shard for the prefix
+cache. Each worker writes a partial inference log and a manifest with its sample IDs into the
+shared output folder and skips the evaluation. The merge checks that every shard finished and
+every sample has a response, writes the combined log and evaluates it once.
+
+Usage:
+    # One worker per shard, on any host that sees the output folder
+    exp execute sharding.num_shards=4 sharding.shard_index=0 hydra.run.dir=outputs/sharded
+    exp merge sharding.num_shards=4 hydra.run.dir=outputs/sharded
+
+    # All shards as local processes against the mock server, followed by the merge
+    exp shards --shards 4 --mock --output-dir outputs/sharded dataset.sample_percentage=0.1
+"""
+
+import argparse
+import socket
+import subprocess
+import sys
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable
+
+import hydra
+import hydra.core.hydra_config
+from dotenv import load_dotenv
+
+from exp.evaluation.config import Config
+from exp.evaluation.evaluation import EVALUATION_PROFILE_NAME, evaluation
+from exp.retrieval.retrieval_only import RETRIEVAL_LOG_NAME
+from exp.utils.file_manager import FileManager
+from exp.utils.inference_log import INFERENCE_LOG_NAME, record_sample_id
+from exp.utils.mlflow_logger import tracked_run
+from exp.utils.profiler import profiling, stage
+from exp.utils.response_table import RESPONSE_TABLE_NAME, ResponseTableBuilder
+
+config_path = str((Path(__file__).parents[3] / "conf").resolve())
+
+
+def shard_file_name(name: str, shard_index: int, num_shards: int) -> str:
+    """Get the name of the partial file of a shard, e.g. `inference_log.shard-000-of-004.jsonl`."""
+    stem, _, suffixes = name.partition(".")
+    return f"{stem}.shard-{shard_index:03d}-of-{num_shards:03d}.{suffixes}"
+
+
+def manifest_name(shard_index: int, num_shards: int) -> str:
+    """Get the name of the manifest that a shard writes when it is finished."""
+    return f"shard-{shard_index:03d}-of-{num_shards:03d}.json"
+
+
+def write_manifest(
+    output_dir: Path,
+    shard_index: int,
+    num_shards: int,
+    sample_ids: list[str],
+    rejected_ids: list[str] = [],
+) -> Path:
+    """Write the manifest of a finished shard.
+
+    Args:
+        output_dir (Path): The shared output folder.
+        shard_index (int): The index of the shard.
+        num_shards (int): The number of shards.
+        sample_ids (list[str]): The IDs of the samples in the shard, which the merge expects in
+            its partial log.
+        rejected_ids (list[str]): The IDs the preflight rejected, they are in no shard.
+
+    Returns:
+        Path: The path of the manifest.
+
+    """
+    manifest = FileManager(output_dir / manifest_name(shard_index, num_shards))
+    manifest.dump_json(
+        {
+            "shard_index": shard_index,
+            "num_shards": num_shards,
+            "sample_ids": sample_ids,
+            "rejected_ids": rejected_ids,
+            "host": socket.gethostname(),
+            "finished_at": datetime.now().isoformat(timespec="seconds"),
+        }
+    )
+    return manifest.filepath
+
+
+@dataclass
+class MergeReport:
+    """Coverage of the merged shards."""
+
+    num_shards: int
+    samples: int = 0
+    missing_shards: list[int] = field(default_factory=list)
+    missing_ids: list[str] = field(default_factory=list)
+    duplicate_ids: int = 0
+    unexpected_ids: int = 0
+    rejected_ids: set[str] = field(default_factory=set)
+
+    @property
+    def complete(self) -> bool:
+        """Whether every shard finished and every expected sample has a record."""
+        return not self.missing_shards and not self.missing_ids
+
+    def metrics(self) -> dict[str, float]:
+        """Get the report as MLflow metrics."""
+        return {
+            "merge/shards": self.num_shards,
+            "merge/samples": self.samples,
+            "merge/missing_shards": len(self.missing_shards),
+            "merge/missing_samples": len(self.missing_ids),
+            "merge/duplicate_samples": self.duplicate_ids,
+            "merge/unexpected_samples": self.unexpected_ids,
+            "merge/rejected_samples": len(self.rejected_ids),
+        }
+
+
+def merge_shards(
+    output_dir: Path,
+    num_shards: int,
+    log_name: str,
+    record_id: Callable[[dict[str, Any]], Any],
+    allow_partial: bool = False,
+) -> tuple[list[dict[str, Any]], MergeReport]:
+    """Combine the partial logs of all shards into one log in the output folder.
+
+    The latest record per sample ID is kept, records of samples that are not in the manifest of
+    their shard, e.g. from an older attempt, are dropped.
+
+    Args:
+        output_dir (Path): The shared output folder with the partial logs and manifests.
+        num_shards (int): The number of shards.
+        log_name (str): The name of the merged log, the partial logs are named after it.
+        record_id (Callable[[dict[str, Any]], Any]): Gets the sample ID of a record.
+        allow_partial (bool): Whether to merge even if shards or samples are missing.
+
+    Returns:
+        tuple[list[dict[str, Any]], MergeReport]: The merged records and the coverage.
+
+    """
+    report = MergeReport(num_shards)
+    records: dict[Any, dict[str, Any]] = {}
+    record_shards: dict[Any, int] = {}
+    expected: set[str] = set()
+    for shard_index in range(num_shards):
+        manifest = FileManager(output_dir / manifest_name(shard_index, num_shards))
+        if not manifest.file_exists():
+            report.missing_shards.append(shard_index)
+            continue
+        manifest_data = manifest.load_json()
+        shard_ids = {str(sample_id) for sample_id in manifest_data["sample_ids"]}
+        expected |= shard_ids
+        # Every shard reports the rejections of the whole dataset
+        report.rejected_ids.update(manifest_data.get("rejected_ids", []))
+
+        log = FileManager(output_dir / shard_file_name(log_name, shard_index, num_shards))
+        if not log.file_exists():
+            continue
+        for record in log.iter_jsonlines(skip_invalid=True):
+            sample_id = str(record_id(record))
+            if sample_id not in shard_ids:
+                report.unexpected_ids += 1
+                continue
+            if record_shards.setdefault(sample_id, shard_index) != shard_index:
+                report.duplicate_ids += 1
+            records[sample_id] = record
+
+    report.missing_ids = sorted(expected - set(records))
+    report.samples = len(records)
+    if not report.complete and not allow_partial:
+        raise ValueError(
+            f"Incomplete shards in {output_dir}: missing shards {report.missing_shards}, "
+            f"{len(report.missing_ids)} samples without a record, e.g. {report.missing_ids[:5]}. "
+            "Run the missing shards again, or set sharding.allow_partial=True"
+        )
+    FileManager(output_dir / log_name).write_jsonlines(records.values())
+    return list(records.values()), report
+
+
+def merge(cfg: Config, output_dir: Path) -> MergeReport:
+    """Merge the shards of a run and evaluate the merged log once."""
+    if cfg.sharding.num_shards <= 1:
+        raise ValueError("Set sharding.num_shards to the number of shards to merge")
+    retrieval_only = cfg.rag.retrieval_only
+    with (
+        profiling() as profiler,
+        tracked_run(cfg.mlflow.uri, cfg.mlflow.experiment_id, cfg.mlflow.spool_dir) as tracker,
+    ):
+        with stage("merge"):
+            records, report = merge_shards(
+                output_dir,
+                cfg.sharding.num_shards,
+                RETRIEVAL_LOG_NAME if retrieval_only else INFERENCE_LOG_NAME,
+                (lambda record: record["id"]) if retrieval_only else record_sample_id,
+                cfg.sharding.allow_partial,
+            )
+        print(
+            f"Merged {report.samples} samples of {cfg.sharding.num_shards} shards, "
+            f"{len(report.missing_ids)} missing"
+        )
+        tracker.log_metrics(report.metrics())
+        if not retrieval_only:
+            with stage("response_table"):
+                table_path = ResponseTableBuilder.from_records(records).write(
+                    output_dir / RESPONSE_TABLE_NAME
+                )
+            tracker.log_artifact(table_path)
+
+        evaluation(cfg, output_dir, tracker)
+
+        tracker.log_metrics(profiler.metrics())
+        tracker.log_artifact(profiler.write(output_dir / EVALUATION_PROFILE_NAME))
+    return report
+
+
+@hydra.main(version_base=None, config_path=config_path, config_name="defaults")
+def main(cfg: Config) -> None:
+    """Merge and evaluate the shards in the output folder of the Hydra run."""
+    load_dotenv(".env")
+    merge(cfg, Path(hydra.core.hydra_config.HydraConfig.get().runtime.output_dir))
+
+
+def launch_local(argv: list[str]) -> None:
+    """Run every shard in its own local process, wait for all of them and merge the shards.
+
+    The arguments are `--shards`, `--output-dir` and `--mock`, followed by Hydra overrides for
+    every shard and the merge. With `--mock`, the shards send their requests to a mock server
+    in this process.
+    """
+    from hydra import compose, initialize_config_dir
+
+    from exp.inference.mock_server import MockServer, MockServerConfig, mock_overrides
+
+    parser = argparse.ArgumentParser(prog="exp shards", description=launch_local.__doc__)
+    parser.add_argument("--shards", type=int, default=2)
+    parser.add_argument(
+        "--output-dir",
+        type=Path,
+        default=Path(f"outputs/{datetime.now():%y-%m-%d_%H:%M}_sharded"),
+    )
+    parser.add_argument("--mock", action="store_true", help="Serve the requests with a mock")
+    parser.add_argument("overrides", nargs=argparse.REMAINDER, help="Hydra overrides")
+    args = parser.parse_args(argv)
+
+    server = MockServer(MockServerConfig()).start() if args.mock else None
+    overrides = [
+        *(mock_overrides(server.base_url, server.config.model_name) if server else []),
+        f"sharding.num_shards={args.shards}",
+        *args.overrides,
+    ]
+    try:
+        workers = [
+            subprocess.Popen(
+                [
+                    sys.executable,
+                    "-m",
+                    "exp.cli",
+                    "execute",
+                    *overrides,
+                    f"sharding.shard_index={shard_index}",
+                    f"hydra.run.dir={args.output_dir}",
+                ]
+            )
+            for shard_index in range(args.shards)
+        ]
+        failed = [i for i, worker in enumerate(workers) if worker.wait() != 0]
+        if failed:
+            sys.exit(f"Shards {failed} failed, run them again with exp execute, then exp merge")
+
+        with initialize_config_dir(config_dir=config_path, version_base=None):
+            cfg = compose("defaults", overrides=overrides)
+        merge(cfg, args.output_dir)  # ty: ignore
+    finally:
+        # Model-based metrics of the merge may still send requests to the mock server
+        if server is not None:
+            server.stop()
+
+
+if __name__ == "__main__":
+    main()
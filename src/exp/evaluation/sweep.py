@@ -0,0 +1,180 @@
+r"""Sweep runner that groups runs by model so that setup happens once per model.
+
+A Hydra multirun over `model=...` and `rag=...` reloads the dataset, rebuilds the dataset
+collection and the embeddings and needs its own vLLM server for every job. This runner starts
+the server once per model and shares the dataset, the runner and the embedding function
+between the RAG methods of that model. Every run still gets its own output folder and MLflow run.
+With `--metric-worker`, model-based metrics are loaded once for the whole sweep.
+
+Usage:
+    uv run python -m exp.evaluation.sweep --models gemma3-27b qwen_25 \
+        --rags base bm25 hybrid reranker --launch --metric-worker dataset.split=dev
+"""
+
+import argparse
+import signal
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import mlflow
+from dotenv import load_dotenv
+from hydra import compose, initialize_config_dir
+from omegaconf import OmegaConf
+
+from exp.evaluation.config import Config
+from exp.evaluation.execution import SharedResources, execute, prepare_resources
+from exp.evaluation.metric_worker import connect_metric_worker, wait_for_metric_worker
+from exp.inference.readiness import ReadinessFile
+
+config_path = str((Path(__file__).parents[3] / "conf").resolve())
+launcher_path = str((Path(__file__).parents[3] / "start_vllm_server_as_process.py").resolve())
+
+
+def _resource_key(cfg: Config) -> str:
+    """Configuration that decides whether two runs can share their resources."""
+    return OmegaConf.to_yaml(
+        {
+            "model": cfg.model,
+            "dataset": cfg.dataset,
+            "vector_db": cfg.vector_db,
+            "base_url": cfg.base_url,
+            "serving": cfg.serving,
+            "dispatcher": cfg.dispatcher,
+            "response_cache": cfg.response_cache,
+            "structured_output": cfg.structured_output,
+            "preflight": cfg.preflight,
+            "retrieval_only": cfg.rag.retrieval_only,
+        }
+    )
+
+
+def launch_server(model: str, overrides: list[str], cfg: Config) -> subprocess.Popen:
+    """Start the vLLM launcher for a model and wait until it reports readiness."""
+    readiness_file = ReadinessFile(cfg.serving.readiness_file)
+    readiness_file.reset()
+    process = subprocess.Popen([sys.executable, launcher_path, f"model={model}", *overrides])
+    try:
+        readiness_file.wait(cfg.serving.ready_timeout_s)
+    except (RuntimeError, TimeoutError):
+        stop_server(process)
+        raise
+    return process
+
+
+def stop_server(process: subprocess.Popen) -> None:
+    """Stop the launcher, which in turn stops its vLLM replicas."""
+    if process.poll() is None:
+        # The launcher shuts its replicas down on KeyboardInterrupt
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(timeout=120)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def launch_metric_worker(overrides: list[str], cfg: Config) -> subprocess.Popen | None:
+    """Start the metric worker and wait until it accepts requests, None if one is running."""
+    if connect_metric_worker(cfg.metric_worker.socket) is not None:
+        return None
+    process = subprocess.Popen([sys.executable, "-m", "exp.evaluation.metric_worker", *overrides])
+    try:
+        wait_for_metric_worker(cfg.metric_worker.socket)
+    except TimeoutError:
+        stop_server(process)
+        raise
+    return process
+
+
+def run_sweep(
+    models: list[str],
+    rags: list[str],
+    overrides: list[str] = [],
+    launch: bool = False,
+    output_root: Path = Path("outputs"),
+    metric_worker: bool = False,
+) -> None:
+    """Run every combination of model and RAG method, grouped by model.
+
+    Args:
+        models (list[str]): Names of the `conf/model` configs.
+        rags (list[str]): Names of the `conf/rag` configs.
+        overrides (list[str]): Further Hydra overrides applied to every run.
+        launch (bool): Whether to start and stop a vLLM server per model.
+        output_root (Path): The folder that holds the output folder of every run.
+        metric_worker (bool): Whether to start a metric worker for the sweep, if none is running.
+
+    """
+    with initialize_config_dir(config_dir=config_path, version_base=None):
+        worker = None
+        if metric_worker:
+            worker = launch_metric_worker(overrides, compose("defaults", overrides=overrides))
+        try:
+            for model in models:
+                _run_model(model, rags, overrides, launch, output_root)
+        finally:
+            if worker is not None:
+                stop_server(worker)
+
+
+def new_output_dir(output_root: Path, name: str) -> Path:
+    """Create a new output folder, with a numbered suffix if a run already took the name."""
+    for attempt in range(1000):
+        output_dir = output_root / (name if attempt == 0 else f"{name}_{attempt}")
+        try:
+            output_dir.mkdir(parents=True)
+            return output_dir
+        except FileExistsError:
+            continue
+    raise FileExistsError(f"No free output folder for {name} in {output_root}")
+
+
+def _run_model(
+    model: str, rags: list[str], overrides: list[str], launch: bool, output_root: Path
+) -> None:
+    group_start = time.perf_counter()
+    cfgs: list[Config] = [
+        compose("defaults", overrides=[f"model={model}", f"rag={rag}", *overrides]) for rag in rags
+    ]  # type: ignore
+    server = launch_server(model, overrides, cfgs[0]) if launch else None
+    try:
+        resources: dict[str, SharedResources] = {}
+        for rag, cfg in zip(rags, cfgs):
+            key = _resource_key(cfg)
+            if key not in resources:
+                resources[key] = prepare_resources(cfg)
+            timestamp = datetime.now().strftime("%y-%m-%d_%H:%M:%S")
+            output_dir = new_output_dir(
+                output_root, f"{timestamp}_{cfg.model.model_name_short}_{rag}"
+            )
+            # Like the folder of a Hydra run, so that `exp evaluate` can be pointed at it
+            (output_dir / ".hydra").mkdir()
+            OmegaConf.save(cfg, output_dir / ".hydra" / "config.yaml")
+            print(f"Running model={model} rag={rag} into {output_dir}")
+            execute(cfg, output_dir, resources[key])
+    finally:
+        if server is not None:
+            stop_server(server)
+    elapsed = time.perf_counter() - group_start
+    print(f"Finished {len(rags)} runs for {model} in {elapsed:.0f}s")
+
+
+def main() -> None:
+    """Parse the command line and run the sweep."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--models", nargs="+", required=True, help="Names of conf/model configs")
+    parser.add_argument("--rags", nargs="+", required=True, help="Names of conf/rag configs")
+    parser.add_argument("--launch", action="store_true", help="Start a vLLM server per model")
+    parser.add_argument("--output-root", type=Path, default=Path("outputs"))
+    parser.add_argument("--metric-worker", action="store_true", help="Start a metric worker")
+    args, overrides = parser.parse_known_args()
+
+    load_dotenv(".env")
+    mlflow.openai.autolog()
+    run_sweep(args.models, args.rags, overrides, args.launch, args.output_root, args.metric_worker)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,371 @@
+"""Asyncio request dispatcher for OpenAI-compatible endpoints with adaptive concurrency."""
+
+import asyncio
+import logging
+import os
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable
+
+from encourage.llm import BatchInferenceRunner, Response, ResponseWrapper
+from encourage.prompts import Prompt, PromptCollection
+from openai import APIConnectionError, APIStatusError, AsyncOpenAI
+from pydantic import BaseModel
+
+from exp.inference.replicas import ReplicaPool
+from exp.inference.runner import RunnerWrapper, prompt_messages
+from exp.utils.profiler import active_profiler
+
+logger = logging.getLogger(__name__)
+
+# Status codes that mean the server is overloaded and the request should be retried
+OVERLOAD_STATUS_CODES = {429, 503}
+
+
+@dataclass
+class ChatResult:
+    """Result of one chat completion request."""
+
+    index: int
+    text: str = ""
+    error: str | None = None
+    started: float = 0.0
+    finished: float = 0.0
+    retries: int = 0
+    prompt_tokens: int | None = None
+    completion_tokens: int | None = None
+    first_token: float | None = None
+
+    @property
+    def latency(self) -> float:
+        """Time from sending the request to receiving the full response."""
+        return self.finished - self.started
+
+    @property
+    def time_to_first_token(self) -> float | None:
+        """Time from sending the request to the first streamed token, if it was streamed."""
+        return None if self.first_token is None else self.first_token - self.started
+
+
+class AdaptiveConcurrency:
+    """Limit of in-flight requests that adapts to the measured latency and overload responses.
+
+    The limit grows by one per window of successful requests (additive increase) and shrinks
+    multiplicatively when the server answers 429/503 or when the latency exceeds
+    `latency_tolerance` times the best smoothed latency seen so far.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = 64,
+        min_in_flight: int = 1,
+        initial_in_flight: int | None = None,
+        latency_tolerance: float = 2.0,
+    ) -> None:
+        """Initialize the controller.
+
+        Args:
+            max_in_flight (int): The upper bound of concurrent requests.
+            min_in_flight (int): The lower bound of concurrent requests.
+            initial_in_flight (int | None): The starting limit, defaults to `min_in_flight`.
+            latency_tolerance (float): Factor over the best smoothed latency that counts as
+                congestion.
+
+        """
+        self.max_in_flight = max_in_flight
+        self.min_in_flight = min_in_flight
+        self.limit = float(initial_in_flight or min_in_flight)
+        self.latency_tolerance = latency_tolerance
+        self.in_flight = 0
+        self.smoothed_latency: float | None = None
+        self.best_latency: float | None = None
+        self._condition: asyncio.Condition | None = None
+
+    @property
+    def condition(self) -> asyncio.Condition:
+        """Condition bound to the running event loop."""
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    def reset(self) -> None:
+        """Forget the in-flight requests and the event loop of an earlier run, keep the limit."""
+        self.in_flight = 0
+        self._condition = None
+
+    async def acquire(self) -> None:
+        """Wait until another request may be sent."""
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self) -> None:
+        """Mark a request as finished."""
+        async with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def on_success(self, latency: float) -> None:
+        """Update the limit after a successful request."""
+        self.smoothed_latency = (
+            latency
+            if self.smoothed_latency is None
+            else 0.8 * self.smoothed_latency + 0.2 * latency
+        )
+        if self.best_latency is None or self.smoothed_latency < self.best_latency:
+            self.best_latency = self.smoothed_latency
+        if self.smoothed_latency > self.latency_tolerance * self.best_latency:
+            self._decrease(0.9)
+        else:
+            self.limit = min(float(self.max_in_flight), self.limit + 1.0 / self.limit)
+
+    def on_overload(self) -> None:
+        """Update the limit after the server signalled overload."""
+        self._decrease(0.5)
+
+    def _decrease(self, factor: float) -> None:
+        self.limit = max(float(self.min_in_flight), self.limit * factor)
+
+
+@dataclass
+class AsyncDispatcher:
+    """Sends chat completion requests concurrently and yields them as they complete.
+
+    With a `replica_pool` every request goes to the replica with the fewest outstanding
+    requests, and retries of failed requests can land on another replica. With `stream` the
+    responses are streamed, which adds the time to first token to the results.
+    """
+
+    base_url: str
+    model_name: str
+    sampling_params: Any
+    controller: AdaptiveConcurrency = field(default_factory=AdaptiveConcurrency)
+    max_retries: int = 5
+    timeout_s: float = 600.0
+    api_key: str | None = None
+    replica_pool: ReplicaPool | None = None
+    stream: bool = False
+
+    def _clients(self) -> dict[str, AsyncOpenAI]:
+        base_urls = self.replica_pool.base_urls if self.replica_pool else [self.base_url]
+        return {
+            base_url: AsyncOpenAI(
+                base_url=base_url,
+                api_key=self.api_key or os.getenv("VLLM_API_KEY", "EMPTY"),
+                timeout=self.timeout_s,
+                max_retries=0,
+            )
+            for base_url in base_urls
+        }
+
+    def _request_kwargs(self, response_format: type[BaseModel] | str | None) -> dict[str, Any]:
+        kwargs: dict[str, Any] = {
+            key: getattr(self.sampling_params, key)
+            for key in ("temperature", "max_tokens", "top_p")
+            if getattr(self.sampling_params, key, None) is not None
+        }
+        if isinstance(response_format, type) and issubclass(response_format, BaseModel):
+            kwargs["response_format"] = {
+                "type": "json_schema",
+                "json_schema": {
+                    "name": response_format.__name__,
+                    "schema": response_format.model_json_schema(),
+                },
+            }
+        return kwargs
+
+    async def dispatch(
+        self,
+        requests: list[list[dict[str, Any]]],
+        response_format: type[BaseModel] | str | None = None,
+    ) -> AsyncIterator[ChatResult]:
+        """Send all requests and yield their results in completion order.
+
+        Args:
+            requests (list[list[dict[str, Any]]]): The chat messages of every request.
+            response_format (type[BaseModel] | str | None): The structured output format.
+
+        Yields:
+            ChatResult: The result of a request, with `index` pointing into `requests`.
+
+        """
+        clients = self._clients()
+        kwargs = self._request_kwargs(response_format)
+        tasks = [
+            asyncio.create_task(self._send(clients, index, messages, kwargs))
+            for index, messages in enumerate(requests)
+        ]
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                yield await next_result
+        finally:
+            for task in tasks:
+                task.cancel()
+            for client in clients.values():
+                await client.close()
+
+    async def _send(
+        self,
+        clients: dict[str, AsyncOpenAI],
+        index: int,
+        messages: list[dict[str, Any]],
+        kwargs: dict[str, Any],
+    ) -> ChatResult:
+        result = ChatResult(index=index)
+        for attempt in range(self.max_retries + 1):
+            result.retries = attempt
+            await self.controller.acquire()
+            replica = self.replica_pool.acquire() if self.replica_pool else None
+            client = clients[replica.base_url if replica else self.base_url]
+            replica_ok = False
+            result.started = time.time()
+            result.first_token = None
+            try:
+                await self._complete(client, messages, kwargs, result)
+            except APIStatusError as e:
+                result.finished = time.time()
+                result.error = f"{e.status_code}: {e.message}"
+                # A replica that rate limits is alive, one that is unavailable is not
+                replica_ok = e.status_code < 500
+                if e.status_code not in OVERLOAD_STATUS_CODES:
+                    return result
+                self.controller.on_overload()
+            except APIConnectionError as e:
+                result.error = str(e)
+                self.controller.on_overload()
+            else:
+                result.finished = time.time()
+                result.error = None
+                replica_ok = True
+                self.controller.on_success(result.latency)
+                profiler = active_profiler()
+                if profiler is not None:
+                    profiler.record_request(
+                        result.latency,
+                        result.time_to_first_token,
+                        result.prompt_tokens,
+                        result.completion_tokens,
+                    )
+                return result
+            finally:
+                if replica is not None:
+                    self.replica_pool.release(replica, replica_ok)  # type: ignore
+                await self.controller.release()
+            await asyncio.sleep(min(2.0**attempt * 0.5, 30.0))
+        result.finished = time.time()
+        return result
+
+    async def _complete(
+        self,
+        client: AsyncOpenAI,
+        messages: list[dict[str, Any]],
+        kwargs: dict[str, Any],
+        result: ChatResult,
+    ) -> None:
+        """Send one request and store the text and the token counts in the result."""
+        if not self.stream:
+            completion = await client.chat.completions.create(
+                model=self.model_name,
+                messages=messages,  # type: ignore
+                **kwargs,
+            )
+            result.text = completion.choices[0].message.content or ""
+            usage = completion.usage
+        else:
+            chunks = await client.chat.completions.create(
+                model=self.model_name,
+                messages=messages,  # type: ignore
+                stream=True,
+                stream_options={"include_usage": True},
+                **kwargs,
+            )
+            parts = []
+            usage = None
+            async for chunk in chunks:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if result.first_token is None:
+                        result.first_token = time.time()
+                    parts.append(chunk.choices[0].delta.content)
+                if chunk.usage is not None:
+                    usage = chunk.usage
+            result.text = "".join(parts)
+        if usage is not None:
+            result.prompt_tokens = usage.prompt_tokens
+            result.completion_tokens = usage.completion_tokens
+
+    def run(
+        self,
+        requests: list[list[dict[str, Any]]],
+        response_format: type[BaseModel] | str | None = None,
+        on_result: Callable[[ChatResult], None] | None = None,
+    ) -> list[ChatResult]:
+        """Send all requests from synchronous code and return the results in request order.
+
+        Args:
+            requests (list[list[dict[str, Any]]]): The chat messages of every request.
+            response_format (type[BaseModel] | str | None): The structured output format.
+            on_result (Callable[[ChatResult], None] | None): Called with every result as soon as
+                it completes.
+
+        Returns:
+            list[ChatResult]: The results in the order of `requests`.
+
+        """
+
+        async def _collect() -> list[ChatResult]:
+            results: list[ChatResult | None] = [None] * len(requests)
+            async for result in self.dispatch(requests, response_format):
+                results[result.index] = result
+                if on_result is not None:
+                    on_result(result)
+            return results  # type: ignore
+
+        self.controller.reset()
+        return asyncio.run(_collect())
+
+
+def build_response(prompt: Prompt, result: ChatResult) -> Response:
+    """Create an encourage `Response` for a prompt from a chat result."""
+    if result.error is not None:
+        logger.warning(
+            f"Request {result.index} failed after {result.retries} retries: {result.error}"
+        )
+    return Response(
+        request_id=str(uuid.uuid4()),
+        prompt_id=str(prompt.id),
+        sys_prompt=prompt.conversation.sys_prompt,
+        user_prompt=prompt.conversation.get_last_message_by_user(),
+        response=result.text,
+        meta_data=prompt.meta_data,
+        context=prompt.context,
+        arrival_time=result.started,
+        finished_time=result.finished,
+    )
+
+
+class DispatchingRunner(RunnerWrapper):
+    """Runner that sends the prompts through an `AsyncDispatcher` instead of one batch call."""
+
+    def __init__(self, runner: BatchInferenceRunner, dispatcher: AsyncDispatcher) -> None:
+        super().__init__(runner)
+        self.dispatcher = dispatcher
+
+    def run(
+        self,
+        prompt_collection: PromptCollection,
+        response_format: type[BaseModel] | str | None = None,
+        **kwargs: Any,
+    ) -> ResponseWrapper:
+        """Run the prompts with bounded, adaptive concurrency."""
+        prompts: list[Prompt] = prompt_collection.prompts
+        results = self.dispatcher.run(
+            [prompt_messages(prompt) for prompt in prompts], response_format
+        )
+        logger.info(
+            f"Dispatched {len(prompts)} requests, final concurrency limit "
+            f"{self.dispatcher.controller.limit:.1f}"
+        )
+        return ResponseWrapper(
+            [build_response(prompt, result) for prompt, result in zip(prompts, results)]
+        )
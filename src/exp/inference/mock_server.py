@@ -0,0 +1,292 @@
+"""Local mock of an OpenAI-compatible chat completion server.
+
+The server answers `/v1/models` and `/v1/chat/completions` with a configurable latency and can
+simulate overload with 429/503 responses. Answers are deterministic: the same messages always
+get the same answer, and requests with a JSON schema response format get a JSON object that
+matches the schema. Only the standard library is used, so throughput can be tested on any box.
+
+Usage:
+    uv run python -m exp.inference.mock_server --port 18120 --latency 0.5
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+
+
+@dataclass
+class MockServerConfig:
+    """Behaviour of the mock server."""
+
+    model_name: str = "mock-model"
+    latency_s: float = 0.1
+    latency_per_token_s: float = 0.0
+    jitter_s: float = 0.0
+    error_rate: float = 0.0
+    max_concurrency: int | None = None
+    seed: int = 0
+
+
+def _derive(digest: str, suffix: object) -> str:
+    return hashlib.sha256(f"{digest}{suffix}".encode("utf-8")).hexdigest()
+
+
+def _value_for_schema(schema: dict[str, Any], digest: str, defs: dict[str, Any]) -> Any:
+    if "$ref" in schema:
+        return _value_for_schema(defs.get(schema["$ref"].split("/")[-1], {}), digest, defs)
+    if "anyOf" in schema:
+        return _value_for_schema(schema["anyOf"][0], digest, defs)
+    schema_type = schema.get("type", "string")
+    if schema_type == "object":
+        return {
+            key: _value_for_schema(value, _derive(digest, key), defs)
+            for key, value in schema.get("properties", {}).items()
+        }
+    if schema_type == "array":
+        items = schema.get("items", {})
+        return [_value_for_schema(items, _derive(digest, i), defs) for i in range(2)]
+    if schema_type in ("integer", "number"):
+        return int(digest[:6], 16) % 1000
+    if schema_type == "boolean":
+        return int(digest[:2], 16) % 2 == 0
+    return str(int(digest[:6], 16) % 1000)
+
+
+def mock_completion_text(messages: list[dict[str, Any]], response_format: Any = None) -> str:
+    """Create the deterministic answer of the mock server for a request."""
+    digest = hashlib.sha256(json.dumps(messages, sort_keys=True).encode("utf-8")).hexdigest()
+    if isinstance(response_format, dict) and response_format.get("type") == "json_schema":
+        schema = response_format.get("json_schema", {}).get("schema", {})
+        return json.dumps(_value_for_schema(schema, digest, schema.get("$defs", {})))
+    return f"Mock answer {digest[:12]}"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "_MockHTTPServer"
+
+    def log_message(self, format: str, *args: Any) -> None:  # noqa: A002
+        pass
+
+    def _send_json(self, status: int, payload: dict[str, Any]) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:  # noqa: N802
+        if self.path.rstrip("/").endswith("/v1/models"):
+            self._send_json(
+                200,
+                {
+                    "object": "list",
+                    "data": [{"id": self.server.config.model_name, "object": "model"}],
+                },
+            )
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def do_POST(self) -> None:  # noqa: N802
+        if not self.path.rstrip("/").endswith("/v1/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        server = self.server
+        config = server.config
+
+        with server.lock:
+            server.requests += 1
+            overloaded = (
+                config.max_concurrency is not None and server.in_flight >= config.max_concurrency
+            )
+            failed = server.random.random() < config.error_rate
+            if not overloaded and not failed:
+                server.in_flight += 1
+            jitter = server.random.uniform(0, config.jitter_s)
+        if overloaded:
+            self._send_json(503, {"error": {"message": "Server overloaded"}})
+            return
+        if failed:
+            self._send_json(429, {"error": {"message": "Too many requests"}})
+            return
+
+        try:
+            messages = request.get("messages", [])
+            text = mock_completion_text(messages, request.get("response_format"))
+            prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in messages)
+            completion_tokens = len(text.split())
+            usage = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            }
+            if request.get("stream"):
+                time.sleep(config.latency_s + jitter)
+                include_usage = (request.get("stream_options") or {}).get("include_usage", False)
+                self._send_stream(request, text, usage if include_usage else None)
+                return
+            time.sleep(config.latency_s + jitter + config.latency_per_token_s * completion_tokens)
+            self._send_json(
+                200,
+                {
+                    "id": f"chatcmpl-{server.requests}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request.get("model", config.model_name),
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": text},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": usage,
+                },
+            )
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def _send_stream(
+        self, request: dict[str, Any], text: str, usage: dict[str, int] | None
+    ) -> None:
+        """Stream the answer word by word as server-sent events."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        chunk = {
+            "id": f"chatcmpl-{self.server.requests}",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": request.get("model", self.server.config.model_name),
+        }
+        words = text.split(" ")
+        for i, word in enumerate(words):
+            if i:
+                time.sleep(self.server.config.latency_per_token_s)
+            content = word if i == 0 else f" {word}"
+            finish_reason = "stop" if i == len(words) - 1 else None
+            self._send_event(
+                {
+                    **chunk,
+                    "choices": [
+                        {"index": 0, "delta": {"content": content}, "finish_reason": finish_reason}
+                    ],
+                }
+            )
+        if usage is not None:
+            self._send_event({**chunk, "choices": [], "usage": usage})
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def _send_event(self, payload: dict[str, Any]) -> None:
+        self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+
+class _MockHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], config: MockServerConfig) -> None:
+        super().__init__(address, _Handler)
+        self.config = config
+        self.lock = threading.Lock()
+        self.random = random.Random(config.seed)
+        self.in_flight = 0
+        self.requests = 0
+
+
+class MockServer:
+    """Mock server that runs in a background thread, usable as a context manager."""
+
+    def __init__(
+        self, config: MockServerConfig | None = None, host: str = "127.0.0.1", port: int = 0
+    ) -> None:
+        """Create the server, port 0 picks a free port."""
+        self.config = config or MockServerConfig()
+        self._server = _MockHTTPServer((host, port), self.config)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def port(self) -> int:
+        """The port the server listens on."""
+        return self._server.server_address[1]
+
+    @property
+    def base_url(self) -> str:
+        """The OpenAI-compatible base URL of the server."""
+        return f"http://{self._server.server_address[0]}:{self.port}/v1/"
+
+    @property
+    def requests(self) -> int:
+        """The number of chat completion requests received so far."""
+        return self._server.requests
+
+    def start(self) -> "MockServer":
+        """Start serving in the background."""
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop the server."""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "MockServer":
+        return self.start()
+
+    def __exit__(self, *args: object) -> None:
+        self.stop()
+
+
+def mock_overrides(base_url: str, model_name: str = "mock-model") -> list[str]:
+    """Get the Hydra overrides that send the requests of a run to a mock server.
+
+    The model has no tokenizer, and cached responses or waiting for vLLM would hide the server.
+    """
+    return [
+        f"base_url={base_url}",
+        f"model.model_name={model_name}",
+        "dispatcher.enabled=True",
+        "response_cache.enabled=False",
+        "serving.wait_for_ready=False",
+        "preflight.enabled=False",
+    ]
+
+
+def main() -> None:
+    """Run the mock server in the foreground."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18120)
+    parser.add_argument("--model-name", default="mock-model")
+    parser.add_argument("--latency", type=float, default=0.1, help="Seconds per request")
+    parser.add_argument("--latency-per-token", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of 429 responses")
+    parser.add_argument("--max-concurrency", type=int, default=None, help="503 above this")
+    args = parser.parse_args()
+
+    config = MockServerConfig(
+        model_name=args.model_name,
+        latency_s=args.latency,
+        latency_per_token_s=args.latency_per_token,
+        jitter_s=args.jitter,
+        error_rate=args.error_rate,
+        max_concurrency=args.max_concurrency,
+    )
+    server = _MockHTTPServer((args.host, args.port), config)
+    print(f"Mock server for {config.model_name} on http://{args.host}:{args.port}/v1/")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Ordering of requests so that prompts with a shared prefix are sent together.
+
+vLLM caches the KV blocks of prompt prefixes, but only as long as they are not evicted. Prompts
+that share the system prompt and the context hit the cache if they are sent close to each other,
+in dataset order they are usually too far apart. The schedule groups the requests by context ID,
+places groups with the same rendered prefix next to each other and restores the original order
+of the responses afterwards. Optionally, requests are first grouped into length buckets, so
+that a batch does not mix very long and very short prompts.
+"""
+
+import hashlib
+from dataclasses import dataclass
+from typing import Callable, Hashable, Sequence, TypeVar
+
+T = TypeVar("T")
+
+
+def prefix_hash(prefix: str) -> str:
+    """Get a short hash of a rendered prompt prefix."""
+    return hashlib.blake2b(prefix.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def length_bucket(n_tokens: int) -> int:
+    """Get the power-of-two length bucket of a prompt, bucket b holds up to 2**b - 1 tokens."""
+    return max(int(n_tokens), 1).bit_length()
+
+
+def expected_prefix_reuse(
+    hashes: Sequence[str], lengths: Sequence[int], batch_size: int | None = None
+) -> float:
+    """Estimate the share of prefix characters that are served from the prefix cache.
+
+    The estimate assumes that the cache holds the prefixes of the running batch: the first
+    request of a prefix in a batch computes it, every further request of the batch reuses it.
+
+    Args:
+        hashes (Sequence[str]): The prefix hash of every request, in sending order.
+        lengths (Sequence[int]): The prefix length of every request.
+        batch_size (int | None): The number of requests that are sent together, None for all.
+
+    Returns:
+        float: The reused share of all prefix characters, between 0 and 1.
+
+    """
+    total = sum(lengths)
+    if not total:
+        return 0.0
+    batch_size = batch_size or len(hashes)
+    reused = 0
+    for start in range(0, len(hashes), batch_size):
+        seen: set[str] = set()
+        for i in range(start, min(start + batch_size, len(hashes))):
+            if hashes[i] in seen:
+                reused += lengths[i]
+            else:
+                seen.add(hashes[i])
+    return reused / total
+
+
+@dataclass
+class PrefixSchedule:
+    """Sending order of a list of requests and the expected prefix reuse."""
+
+    order: list[int]
+    groups: int
+    reuse_ratio: float
+    reuse_ratio_unordered: float
+
+    def restore(self, items: Sequence[T]) -> list[T]:
+        """Put items that are in sending order back into the original order."""
+        restored: list[T] = [None] * len(items)  # type: ignore
+        for position, item in zip(self.order, items):
+            restored[position] = item
+        return restored
+
+    def metrics(self) -> dict[str, float]:
+        """Get the schedule as MLflow metrics."""
+        return {
+            "prefix_cache/groups": self.groups,
+            "prefix_cache/expected_reuse_ratio": self.reuse_ratio,
+            "prefix_cache/expected_reuse_ratio_unordered": self.reuse_ratio_unordered,
+        }
+
+
+def schedule_by_prefix(
+    context_ids: Sequence[Hashable],
+    render_prefix: Callable[[Hashable], str],
+    batch_size: int | None = None,
+    buckets: Sequence[int] | None = None,
+) -> PrefixSchedule:
+    """Order requests by their context ID and the hash of their rendered prompt prefix.
+
+    Context IDs keep the order of their first request, except that context IDs with the same
+    rendered prefix are placed next to each other. Requests of one context ID keep their order.
+    With `buckets`, requests are ordered by bucket first and grouped by prefix within a bucket.
+
+    Args:
+        context_ids (Sequence[Hashable]): The context ID of every request.
+        render_prefix (Callable[[Hashable], str]): Renders the shared prompt prefix of a context
+            ID, called once per unique context ID.
+        batch_size (int | None): The number of requests that are sent together, for the
+            expected reuse.
+        buckets (Sequence[int] | None): A sort key of every request that takes precedence over
+            the prefix, e.g. the negative length bucket to send the longest prompts first.
+
+    Returns:
+        PrefixSchedule: The positions of the requests in sending order and the expected reuse
+            in this and in the original order.
+
+    """
+    prefixes: dict[Hashable, tuple[str, int]] = {}
+    hash_rank: dict[str, int] = {}
+    for context_id in context_ids:
+        if context_id not in prefixes:
+            prefix = render_prefix(context_id)
+            prefixes[context_id] = (prefix_hash(prefix), len(prefix))
+            hash_rank.setdefault(prefixes[context_id][0], len(hash_rank))
+    context_rank = {context_id: rank for rank, context_id in enumerate(prefixes)}
+
+    order = sorted(
+        range(len(context_ids)),
+        key=lambda i: (
+            buckets[i] if buckets is not None else 0,
+            hash_rank[prefixes[context_ids[i]][0]],
+            context_rank[context_ids[i]],
+        ),
+    )
+    hashes = [prefixes[context_id][0] for context_id in context_ids]
+    lengths = [prefixes[context_id][1] for context_id in context_ids]
+    return PrefixSchedule(
+        order=order,
+        groups=len(prefixes),
+        reuse_ratio=expected_prefix_reuse(
+            [hashes[i] for i in order], [lengths[i] for i in order], batch_size
+        ),
+        reuse_ratio_unordered=expected_prefix_reuse(hashes, lengths, batch_size),
+    )
@@ -0,0 +1,201 @@
+"""Token-length preflight of the prompts before they are sent to the server.
+
+The prompts are counted locally with the tokenizer of the model. A prompt is the system prompt,
+the known context of the sample, the rendered template and the question, plus the tokens the
+chat template adds. Every unique context is tokenized once. Prompts that do not fit into
+`max_model_len - max_tokens` are rejected, get their context truncated, or are only reported,
+depending on the policy. For RAG methods that retrieve their documents, the prompts are
+bounded by the longest contexts and only reported.
+"""
+
+import logging
+from collections import Counter
+from dataclasses import dataclass, field
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Literal
+
+import numpy as np
+
+from exp.data.finqa_qa import FinQADatasetCollection
+from exp.inference.prefix_ordering import length_bucket
+from exp.utils.profiler import percentile
+
+logger = logging.getLogger(__name__)
+
+PreflightPolicy = Literal["reject", "truncate", "warn"]
+PREFLIGHT_POLICIES = ("reject", "truncate", "warn")
+
+
+@lru_cache(maxsize=4)
+def load_tokenizer(model_name: str) -> Any:
+    """Load the tokenizer of a model once per process, its files come from the HF cache."""
+    from transformers import AutoTokenizer
+
+    return AutoTokenizer.from_pretrained(model_name)
+
+
+def count_tokens(tokenizer: Any, texts: list[str], batch_size: int = 256) -> list[int]:
+    """Count the tokens of texts, tokenized in batches and without special tokens."""
+    counts = []
+    for start in range(0, len(texts), batch_size):
+        encoded = tokenizer(texts[start : start + batch_size], add_special_tokens=False)
+        counts.extend(len(ids) for ids in encoded["input_ids"])
+    return counts
+
+
+def chat_template_overhead(tokenizer: Any) -> int:
+    """Count the tokens that the chat template adds around a system and a user message."""
+    conversations = [
+        [{"role": "system", "content": ""}, {"role": "user", "content": ""}],
+        # Some templates do not accept a system message
+        [{"role": "user", "content": ""}],
+    ]
+    for messages in conversations:
+        try:
+            return len(
+                tokenizer.apply_chat_template(messages, tokenize=True, add_generation_prompt=True)
+            )
+        except Exception:
+            continue
+    return 0
+
+
+def render_template(template_name: str) -> str:
+    """Render the prompt template without a question, for the tokens it adds to every prompt."""
+    if not template_name or not Path(template_name).exists():
+        return ""
+    import jinja2
+
+    return jinja2.Template(Path(template_name).read_text(encoding="utf-8")).render(user_prompt="")
+
+
+@dataclass
+class PreflightReport:
+    """Token lengths of the prompts and what the policy did with the ones that did not fit."""
+
+    budget: int
+    policy: str
+    prompt_tokens: list[int] = field(default_factory=list)
+    over_budget: int = 0
+    rejected_ids: list[str] = field(default_factory=list)
+    truncated_contexts: int = 0
+    truncated_samples: int = 0
+
+    def metrics(self) -> dict[str, float]:
+        """Get the report and the token-length distribution as MLflow metrics."""
+        metrics: dict[str, float] = {
+            "preflight/budget": self.budget,
+            "preflight/over_budget": self.over_budget,
+            "preflight/rejected": len(self.rejected_ids),
+            "preflight/truncated_contexts": self.truncated_contexts,
+            "preflight/truncated_samples": self.truncated_samples,
+        }
+        if self.prompt_tokens:
+            metrics["preflight/prompt_tokens_mean"] = float(np.mean(self.prompt_tokens))
+            metrics["preflight/prompt_tokens_max"] = max(self.prompt_tokens)
+            for q in (50, 95, 99):
+                metrics[f"preflight/prompt_tokens_p{q}"] = percentile(self.prompt_tokens, q)
+            buckets = Counter(length_bucket(n_tokens) for n_tokens in self.prompt_tokens)
+            for bucket, count in sorted(buckets.items()):
+                metrics[f"preflight/bucket/lt_{2**bucket}"] = count
+        return metrics
+
+
+def preflight(
+    dataset_obj: FinQADatasetCollection,
+    tokenizer: Any,
+    sys_prompt: str,
+    template_name: str,
+    budget: int,
+    policy: PreflightPolicy = "warn",
+    top_k: int | None = None,
+) -> PreflightReport:
+    """Count the prompt tokens of every sample and apply the policy to prompts over budget.
+
+    With "truncate", every context that is too long for one of its samples is cut to the
+    tokens that fit next to the longest question of that context, in the prompts only. Samples
+    that do not fit even without context are rejected. The token lengths of the kept samples
+    are stored in `dataset_obj.prompt_tokens` for length-bucketed batching.
+
+    With `top_k`, the prompts hold `top_k` retrieved documents instead of the context of the
+    sample. Which ones is only known during the run, so they are counted as the `top_k`
+    longest contexts and prompts over budget are only reported, whatever the policy.
+
+    Args:
+        dataset_obj (FinQADatasetCollection): The dataset, samples are removed from it and
+            the prompt contexts are truncated in place.
+        tokenizer (Any): A Hugging Face tokenizer of the model.
+        sys_prompt (str): The system prompt.
+        template_name (str): The path of the prompt template.
+        budget (int): The maximal number of prompt tokens.
+        policy (PreflightPolicy): "reject", "truncate" or "warn".
+        top_k (int | None): The number of retrieved documents per prompt, None for the known
+            context of every sample.
+
+    Returns:
+        PreflightReport: The token lengths and the samples the policy changed.
+
+    """
+    if policy not in PREFLIGHT_POLICIES:
+        raise ValueError(f"Unknown preflight policy {policy!r}, use one of {PREFLIGHT_POLICIES}")
+    report = PreflightReport(budget, policy)
+    fixed_tokens = sum(count_tokens(tokenizer, [sys_prompt, render_template(template_name)]))
+    fixed_tokens += chat_template_overhead(tokenizer)
+
+    context_ids = dataset_obj.columns["context_id"]
+    unique_ids = list(dict.fromkeys(context_ids.tolist()))
+    context_tokens = dict(
+        zip(
+            unique_ids,
+            count_tokens(tokenizer, [dataset_obj.context_store.content(cid) for cid in unique_ids]),
+        )
+    )
+    question_tokens = np.array(
+        count_tokens(tokenizer, [str(question or "") for question in dataset_obj.user_prompts]),
+        dtype=np.int64,
+    )
+    if top_k is None:
+        sample_context_tokens = np.fromiter(
+            (context_tokens[cid] for cid in context_ids), dtype=np.int64, count=len(context_ids)
+        )
+    else:
+        sample_context_tokens = sum(sorted(context_tokens.values(), reverse=True)[:top_k])
+        policy = "warn"
+    prompt_tokens = fixed_tokens + question_tokens + sample_context_tokens
+    over = prompt_tokens > budget
+    report.over_budget = int(over.sum())
+
+    if report.over_budget and policy == "truncate":
+        truncated: dict[str, str] = {}
+        for cid in dict.fromkeys(context_ids[over].tolist()):
+            longest_question = int(question_tokens[context_ids == cid].max())
+            allowed = budget - fixed_tokens - longest_question
+            if allowed <= 0:
+                continue
+            ids = tokenizer(dataset_obj.context_store.content(cid), add_special_tokens=False)
+            truncated[cid] = tokenizer.decode(ids["input_ids"][:allowed], skip_special_tokens=True)
+        # Decoding and encoding again can shift the count slightly, so the truncated contexts
+        # are counted again and samples that are still over budget are rejected
+        for cid, n_tokens in zip(truncated, count_tokens(tokenizer, list(truncated.values()))):
+            dataset_obj.truncate_prompt_context(cid, truncated[cid])
+            mask = context_ids == cid
+            prompt_tokens[mask] += n_tokens - context_tokens[cid]
+            report.truncated_samples += int(mask.sum())
+        report.truncated_contexts = len(truncated)
+        over = prompt_tokens > budget
+
+    if over.any() and policy in ("reject", "truncate"):
+        report.rejected_ids = [str(sample_id) for sample_id in dataset_obj.columns["id"][over]]
+        dataset_obj.filter(~over)
+        prompt_tokens = prompt_tokens[~over]
+        logger.warning(
+            f"Rejected {len(report.rejected_ids)} samples over {budget} prompt tokens, "
+            f"e.g. {report.rejected_ids[:5]}"
+        )
+    elif over.any():
+        logger.warning(f"{int(over.sum())} samples are over {budget} prompt tokens")
+
+    dataset_obj.prompt_tokens = prompt_tokens
+    report.prompt_tokens = prompt_tokens.tolist()
+    return report
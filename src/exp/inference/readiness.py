@@ -0,0 +1,151 @@
+"""Readiness probing and warm-up of OpenAI-compatible servers."""
+
+import json
+import statistics
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from subprocess import Popen
+from typing import Any, Union
+
+from exp.utils.file_manager import FileManager
+
+
+def _request(
+    url: str, api_key: str | None, payload: dict[str, Any] | None = None, timeout: float = 10.0
+) -> dict[str, Any]:
+    headers = {"Content-Type": "application/json"}
+    if api_key:
+        headers["Authorization"] = f"Bearer {api_key}"
+    data = json.dumps(payload).encode("utf-8") if payload is not None else None
+    request = urllib.request.Request(url, data=data, headers=headers)
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def is_ready(base_url: str, api_key: str | None = None, timeout: float = 5.0) -> bool:
+    """Check whether the server lists its models under `/v1/models`."""
+    try:
+        return bool(_request(base_url.rstrip("/") + "/models", api_key, timeout=timeout)["data"])
+    except (urllib.error.URLError, ConnectionError, TimeoutError, KeyError, ValueError):
+        return False
+
+
+def wait_until_ready(
+    base_url: str,
+    api_key: str | None = None,
+    timeout_s: float = 1800.0,
+    poll_interval_s: float = 5.0,
+    process: Popen | None = None,
+) -> float:
+    """Poll the server until it is ready.
+
+    Args:
+        base_url (str): The OpenAI-compatible base URL.
+        api_key (str | None): The API key of the server.
+        timeout_s (float): Seconds to wait before giving up.
+        poll_interval_s (float): Seconds between two probes.
+        process (Popen | None): The server process, waiting stops early if it exits.
+
+    Returns:
+        float: The seconds it took until the server was ready.
+
+    """
+    start = time.perf_counter()
+    while not is_ready(base_url, api_key):
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Server for {base_url} exited with code {process.returncode}")
+        if time.perf_counter() - start > timeout_s:
+            raise TimeoutError(f"Server for {base_url} not ready after {timeout_s}s")
+        time.sleep(poll_interval_s)
+    return time.perf_counter() - start
+
+
+def warm_up(
+    base_url: str,
+    model_name: str,
+    api_key: str | None = None,
+    n_requests: int = 8,
+    max_tokens: int = 16,
+) -> list[float]:
+    """Send a concurrent batch of short requests so that caches and kernels are ready.
+
+    Returns:
+        list[float]: The latency of every warm-up request in seconds.
+
+    """
+
+    def _send(i: int) -> float:
+        start = time.perf_counter()
+        _request(
+            base_url.rstrip("/") + "/chat/completions",
+            api_key,
+            {
+                "model": model_name,
+                "messages": [{"role": "user", "content": f"Warm-up request {i}. Say hello."}],
+                "max_tokens": max_tokens,
+            },
+            timeout=600.0,
+        )
+        return time.perf_counter() - start
+
+    if n_requests <= 0:
+        return []
+    with ThreadPoolExecutor(n_requests) as pool:
+        return list(pool.map(_send, range(n_requests)))
+
+
+class ReadinessFile:
+    """JSON file through which the launcher tells other processes that the servers are ready."""
+
+    def __init__(self, filepath: Union[str, Path]) -> None:
+        self.file_manager = FileManager(filepath)
+
+    def reset(self) -> None:
+        """Remove the file of an earlier launch."""
+        self.file_manager.delete()
+
+    def write(self, status: str, **info: Any) -> None:
+        """Write the status atomically, so readers never see a partial file."""
+        tmp = FileManager(self.file_manager.filepath.with_suffix(".tmp"))
+        tmp.dump_json({"status": status, "updated": time.time(), **info})
+        tmp.filepath.replace(self.file_manager.filepath)
+
+    def read(self) -> dict[str, Any] | None:
+        """Read the status, or None if there is no file yet."""
+        if not self.file_manager.file_exists():
+            return None
+        return self.file_manager.load_json()
+
+    def wait(self, timeout_s: float = 1800.0, poll_interval_s: float = 2.0) -> dict[str, Any]:
+        """Wait until the launcher reports that the servers are ready.
+
+        Raises:
+            RuntimeError: If the launcher reports a failure or stopped before it was ready.
+            TimeoutError: If the servers are not ready within `timeout_s`.
+
+        """
+        start = time.perf_counter()
+        while True:
+            info = self.read()
+            if info is not None and info["status"] == "ready":
+                return info
+            if info is not None and info["status"] == "failed":
+                raise RuntimeError(f"Server launch failed: {info.get('error')}")
+            if info is not None and info["status"] == "stopped":
+                raise RuntimeError("Servers stopped before they were ready")
+            if time.perf_counter() - start > timeout_s:
+                raise TimeoutError(f"Servers not ready after {timeout_s}s")
+            time.sleep(poll_interval_s)
+
+
+def startup_metrics(info: dict[str, Any]) -> dict[str, float]:
+    """Get the startup metrics of a readiness file for MLflow."""
+    metrics = {"server_time_to_ready_s": float(info.get("time_to_ready_s", 0.0))}
+    latencies = info.get("warmup_latencies_s") or []
+    if latencies:
+        metrics["server_warmup_latency_mean_s"] = statistics.fmean(latencies)
+        metrics["server_warmup_latency_max_s"] = max(latencies)
+    return metrics
@@ -0,0 +1,117 @@
+"""Client-side load balancing over several vLLM replicas."""
+
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from urllib.parse import urlsplit, urlunsplit
+
+logger = logging.getLogger(__name__)
+
+
+def replica_base_urls(base_url: str, replicas: int) -> list[str]:
+    """Get the base URLs of replicas that listen on consecutive ports.
+
+    Args:
+        base_url (str): The base URL of the first replica, e.g. `http://localhost:18120/v1/`.
+        replicas (int): The number of replicas.
+
+    Returns:
+        list[str]: One base URL per replica.
+
+    """
+    parts = urlsplit(base_url)
+    if parts.port is None:
+        raise ValueError(f"Base URL needs an explicit port for replicas: {base_url}")
+    return [
+        urlunsplit(parts._replace(netloc=f"{parts.hostname}:{parts.port + i}"))
+        for i in range(replicas)
+    ]
+
+
+@dataclass
+class Replica:
+    """State of one replica as seen by the client."""
+
+    base_url: str
+    outstanding: int = 0
+    consecutive_failures: int = 0
+    retry_at: float = 0.0
+    completed: int = 0
+
+    def available(self, now: float) -> bool:
+        """Whether the replica is in rotation."""
+        return self.retry_at <= now
+
+
+class ReplicaPool:
+    """Routes each request to the replica with the fewest outstanding requests.
+
+    A replica that fails `max_failures` times in a row is taken out of rotation for
+    `cooldown_s` seconds and then tried again.
+    """
+
+    def __init__(self, base_urls: list[str], max_failures: int = 3, cooldown_s: float = 30.0):
+        """Initialize the pool.
+
+        Args:
+            base_urls (list[str]): The base URLs of the replicas.
+            max_failures (int): Consecutive failures after which a replica is taken out.
+            cooldown_s (float): Seconds until a failed replica is tried again.
+
+        """
+        if not base_urls:
+            raise ValueError("ReplicaPool needs at least one base URL")
+        self.replicas = [Replica(base_url) for base_url in base_urls]
+        self.max_failures = max_failures
+        self.cooldown_s = cooldown_s
+        self._lock = threading.Lock()
+
+    @property
+    def base_urls(self) -> list[str]:
+        """The base URLs of all replicas."""
+        return [replica.base_url for replica in self.replicas]
+
+    def acquire(self) -> Replica:
+        """Pick a replica for the next request and count it as outstanding."""
+        with self._lock:
+            now = time.monotonic()
+            candidates = [replica for replica in self.replicas if replica.available(now)]
+            if candidates:
+                replica = min(candidates, key=lambda r: r.outstanding)
+            else:
+                # All replicas are out of rotation, try the one that comes back first
+                replica = min(self.replicas, key=lambda r: r.retry_at)
+            replica.outstanding += 1
+            return replica
+
+    def release(self, replica: Replica, ok: bool) -> None:
+        """Mark a request of a replica as finished.
+
+        Args:
+            replica (Replica): The replica returned by `acquire`.
+            ok (bool): Whether the replica answered the request.
+
+        """
+        with self._lock:
+            replica.outstanding -= 1
+            if ok:
+                replica.consecutive_failures = 0
+                replica.completed += 1
+                return
+            replica.consecutive_failures += 1
+            if replica.consecutive_failures >= self.max_failures:
+                replica.retry_at = time.monotonic() + self.cooldown_s
+                logger.warning(
+                    f"Taking replica {replica.base_url} out of rotation for {self.cooldown_s}s"
+                )
+
+    def reset_counters(self) -> None:
+        """Reset the completed requests per replica, e.g. at the start of a run."""
+        with self._lock:
+            for replica in self.replicas:
+                replica.completed = 0
+
+    def stats(self) -> dict[str, int]:
+        """Get the number of completed requests per replica."""
+        return {f"replica_{i}_completed": r.completed for i, r in enumerate(self.replicas)}
@@ -0,0 +1,256 @@
+"""Persistent content-addressed cache for LLM responses."""
+
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Union
+
+from encourage.llm import BatchInferenceRunner, Response, ResponseWrapper
+from encourage.prompts import Prompt, PromptCollection
+from pydantic import BaseModel
+
+from exp.inference.runner import (
+    RunnerWrapper,
+    prompt_messages,
+    response_format_schema,
+    sub_collection,
+)
+from exp.inference.structured_output import validation_error
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(
+    model_name: str,
+    sampling_params: Any,
+    messages: list[dict[str, Any]],
+    response_format: type[BaseModel] | str | None = None,
+) -> str:
+    """Create the cache key of a request.
+
+    Args:
+        model_name (str): The name of the served model.
+        sampling_params (Any): The sampling parameters, hashed through their `repr`.
+        messages (list[dict[str, Any]]): The rendered chat messages.
+        response_format (type[BaseModel] | str | None): The structured output format.
+
+    Returns:
+        str: The SHA-256 hex digest of the request.
+
+    """
+    payload = json.dumps(
+        {
+            "model": model_name,
+            "sampling_params": repr(sampling_params),
+            "messages": messages,
+            "response_format": response_format_schema(response_format),
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """SQLite-backed cache that maps request hashes to serialized responses.
+
+    Entries older than `max_age_days` are dropped, and the least recently used entries are
+    dropped once the stored responses exceed `max_size_mb`.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        max_size_mb: float | None = None,
+        max_age_days: float | None = None,
+    ) -> None:
+        """Open or create the cache.
+
+        Args:
+            path (Union[str, Path]): The path to the SQLite database.
+            max_size_mb (float | None): The maximum size of the stored responses in megabytes.
+            max_age_days (float | None): The maximum age of an entry in days.
+
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_size_mb = max_size_mb
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)"
+        )
+        self._connection.commit()
+        self.evict()
+
+    def get(self, key: str) -> dict[str, Any] | None:
+        """Get a cached response record, or None if the key is not cached."""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._connection.execute(
+                "UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key)
+            )
+            self._connection.commit()
+        return json.loads(row[0])
+
+    def put(self, key: str, record: dict[str, Any]) -> None:
+        """Store a response record under the given key."""
+        value = json.dumps(record, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value.encode("utf-8")), now, now),
+            )
+            self._connection.commit()
+
+    def evict(self) -> int:
+        """Drop expired entries and the least recently used entries above the size limit.
+
+        Returns:
+            int: The number of dropped entries.
+
+        """
+        dropped = 0
+        with self._lock:
+            if self.max_age_days is not None:
+                cutoff = time.time() - self.max_age_days * 86400
+                dropped += self._connection.execute(
+                    "DELETE FROM responses WHERE created < ?", (cutoff,)
+                ).rowcount
+            if self.max_size_mb is not None:
+                max_size = int(self.max_size_mb * 1024 * 1024)
+                total_size = self._connection.execute(
+                    "SELECT COALESCE(SUM(size), 0) FROM responses"
+                ).fetchone()[0]
+                rows = self._connection.execute(
+                    "SELECT key, size FROM responses ORDER BY accessed ASC"
+                ).fetchall()
+                stale_keys = []
+                for key, size in rows:
+                    if total_size <= max_size:
+                        break
+                    stale_keys.append((key,))
+                    total_size -= size
+                self._connection.executemany("DELETE FROM responses WHERE key = ?", stale_keys)
+                dropped += len(stale_keys)
+            self._connection.commit()
+        if dropped:
+            logger.info(f"Evicted {dropped} entries from the response cache {self.path}")
+        return dropped
+
+    def reset_counters(self) -> None:
+        """Reset the hit/miss counters, e.g. at the start of a run."""
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict[str, float]:
+        """Get the hit/miss counters and the size of the cache."""
+        with self._lock:
+            entries, size = self._connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        requests = self.hits + self.misses
+        return {
+            "response_cache_hits": self.hits,
+            "response_cache_misses": self.misses,
+            "response_cache_hit_rate": self.hits / requests if requests else 0.0,
+            "response_cache_entries": entries,
+            "response_cache_size_mb": size / (1024 * 1024),
+        }
+
+    def close(self) -> None:
+        """Close the database connection."""
+        self._connection.close()
+
+
+class CachedRunner(RunnerWrapper):
+    """Runner that answers repeated requests from a `ResponseCache`.
+
+    Only the prompts without a cached response are sent to the wrapped runner. With a Pydantic
+    response format, responses that do not validate are neither stored nor read, so that the
+    response of a successful retry can take their place.
+    """
+
+    def __init__(
+        self,
+        runner: BatchInferenceRunner,
+        cache: ResponseCache,
+        model_name: str,
+        sampling_params: Any,
+    ) -> None:
+        super().__init__(runner)
+        self.cache = cache
+        self.cache_model_name = model_name
+        self.cache_sampling_params = sampling_params
+
+    def run(
+        self,
+        prompt_collection: PromptCollection,
+        response_format: type[BaseModel] | str | None = None,
+        **kwargs: Any,
+    ) -> ResponseWrapper:
+        """Run the prompts, using cached responses where possible."""
+        prompts: list[Prompt] = prompt_collection.prompts
+        keys = [
+            cache_key(
+                self.cache_model_name,
+                self.cache_sampling_params,
+                prompt_messages(prompt),
+                response_format,
+            )
+            for prompt in prompts
+        ]
+        results: list[Response | None] = []
+        for key, prompt in zip(keys, prompts):
+            record = self.cache.get(key)
+            response = None if record is None else self._from_record(record, prompt)
+            results.append(response if self._valid(response, response_format) else None)
+
+        missing = [i for i, response in enumerate(results) if response is None]
+        if missing:
+            fresh = self.runner.run(
+                sub_collection([prompts[i] for i in missing]),
+                response_format=response_format,
+                **kwargs,
+            )
+            for i, response in zip(missing, fresh.response_data):
+                if self._valid(response, response_format):
+                    self.cache.put(keys[i], response.to_dict())
+                results[i] = response
+        return ResponseWrapper(results)
+
+    @staticmethod
+    def _valid(response: Response | None, response_format: type[BaseModel] | str | None) -> bool:
+        if response is None:
+            return False
+        if isinstance(response_format, type) and issubclass(response_format, BaseModel):
+            return validation_error(response, response_format) is None
+        return True
+
+    @staticmethod
+    def _from_record(record: dict[str, Any], prompt: Prompt) -> Response:
+        # The generated text is shared, the references belong to the current prompt
+        response = Response.from_dict(record)
+        response.prompt_id = prompt.id
+        response.meta_data = prompt.meta_data
+        response.context = prompt.context
+        return response
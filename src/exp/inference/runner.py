@@ -0,0 +1,91 @@
+"""Wrappers that add behaviour around a `BatchInferenceRunner`."""
+
+from typing import Any
+
+from encourage.llm import BatchInferenceRunner, ResponseWrapper
+from encourage.prompts import Prompt, PromptCollection
+from pydantic import BaseModel
+
+from exp.utils.profiler import active_profiler, stage
+
+
+class RunnerWrapper(BatchInferenceRunner):
+    """Base class for wrappers around a `BatchInferenceRunner`.
+
+    A wrapper is a `BatchInferenceRunner` itself, so it passes the validation of the RAG configs
+    and metrics wherever a runner is expected, and wrappers can be stacked. It has no client of
+    its own, attribute access is delegated to the wrapped runner.
+    """
+
+    def __init__(self, runner: BatchInferenceRunner) -> None:
+        # The wrapped runner holds the client, the model name and the sampling parameters
+        self.runner = runner
+
+    def __getattr__(self, name: str) -> Any:
+        # Only called for attributes that are not set on the wrapper itself
+        if name == "runner":
+            raise AttributeError(name)
+        return getattr(self.runner, name)
+
+    def run(
+        self,
+        prompt_collection: PromptCollection,
+        response_format: type[BaseModel] | str | None = None,
+        **kwargs: Any,
+    ) -> ResponseWrapper:
+        """Run the prompts through the wrapped runner."""
+        return self.runner.run(prompt_collection, response_format=response_format, **kwargs)
+
+
+class ProfilingRunner(RunnerWrapper):
+    """Runner that reports to the active profiler.
+
+    As the outermost wrapper it times the `generation` stage. Directly around the
+    `BatchInferenceRunner` it records the latency of every request sent to the server.
+    """
+
+    def __init__(
+        self,
+        runner: BatchInferenceRunner,
+        stage_name: str | None = "generation",
+        record_requests: bool = False,
+    ) -> None:
+        super().__init__(runner)
+        self.stage_name = stage_name
+        self.record_requests = record_requests
+
+    def run(
+        self,
+        prompt_collection: PromptCollection,
+        response_format: type[BaseModel] | str | None = None,
+        **kwargs: Any,
+    ) -> ResponseWrapper:
+        """Run the prompts and report the timings."""
+        if self.stage_name is None:
+            responses = super().run(prompt_collection, response_format, **kwargs)
+        else:
+            with stage(self.stage_name):
+                responses = super().run(prompt_collection, response_format, **kwargs)
+        profiler = active_profiler()
+        if self.record_requests and profiler is not None:
+            for response in responses.response_data:
+                if response.processing_time is not None:
+                    profiler.record_request(response.processing_time)
+        return responses
+
+
+def prompt_messages(prompt: Prompt) -> list[dict[str, Any]]:
+    """Get the chat messages that are sent to the server for a rendered prompt."""
+    return [dict(message) for message in prompt.conversation.dialog]
+
+
+def response_format_schema(response_format: type[BaseModel] | str | None) -> dict | str | None:
+    """Get a JSON serializable representation of the response format."""
+    if isinstance(response_format, type) and issubclass(response_format, BaseModel):
+        return response_format.model_json_schema()
+    return response_format
+
+
+def sub_collection(prompts: list[Prompt]) -> PromptCollection:
+    """Create a prompt collection from a subset of the prompts of another collection."""
+    return PromptCollection(prompts=prompts)
@@ -0,0 +1,110 @@
+"""Validation and targeted re-generation of structured outputs."""
+
+import logging
+import re
+from collections import Counter
+from typing import Callable
+
+from encourage.llm import Response, ResponseWrapper
+from pydantic import BaseModel, ValidationError
+
+logger = logging.getLogger(__name__)
+
+
+def validation_error(response: Response, response_format: type[BaseModel]) -> str | None:
+    """Validate a response against the response format.
+
+    Returns:
+        str | None: None if the response is valid, otherwise a short reason like
+            `json_invalid` or `missing:final_formula`.
+
+    """
+    try:
+        response_format.model_validate_json(response.response or "")
+    except ValidationError as e:
+        error = e.errors()[0]
+        location = ".".join(str(part) for part in error.get("loc", ()))
+        return f"{error['type']}:{location}" if location else error["type"]
+    return None
+
+
+class StructuredOutputStage:
+    """Validates responses and re-submits only the samples whose output did not parse.
+
+    Failed samples are sent again up to `max_retries` times, typically with stricter decoding
+    settings, and the new responses replace the failed ones in place. Samples that still fail
+    keep the reason in `meta_data["parse_error"]`.
+    """
+
+    def __init__(self, response_format: type[BaseModel], max_retries: int = 2) -> None:
+        """Initialize the stage.
+
+        Args:
+            response_format (type[BaseModel]): The Pydantic model of the structured output.
+            max_retries (int): How often failed samples are re-submitted.
+
+        """
+        self.response_format = response_format
+        self.max_retries = max_retries
+        self.parse_failures = 0
+        self.retried_requests = 0
+        self.recovered = 0
+        self.failure_reasons: Counter[str] = Counter()
+
+    def process(
+        self,
+        responses: ResponseWrapper,
+        resubmit: Callable[[list[int]], ResponseWrapper],
+    ) -> ResponseWrapper:
+        """Validate the responses and re-generate the failed ones.
+
+        Args:
+            responses (ResponseWrapper): The responses of a batch.
+            resubmit (Callable[[list[int]], ResponseWrapper]): Generates new responses for the
+                given positions in the batch, in the same order.
+
+        Returns:
+            ResponseWrapper: The responses with the re-generated ones merged back.
+
+        """
+        response_data = list(responses.response_data)
+        failed = self._failures(response_data, range(len(response_data)))
+        self.parse_failures += len(failed)
+
+        for attempt in range(1, self.max_retries + 1):
+            if not failed:
+                break
+            positions = sorted(failed)
+            logger.info(f"Re-submitting {len(positions)} unparsable responses (attempt {attempt})")
+            self.retried_requests += len(positions)
+            for position, response in zip(positions, resubmit(positions).response_data):
+                response_data[position] = response
+            still_failed = self._failures(response_data, positions)
+            self.recovered += len(failed) - len(still_failed)
+            failed = still_failed
+
+        for position, reason in failed.items():
+            response_data[position].meta_data["parse_error"] = reason
+            self.failure_reasons[reason.split(":")[0]] += 1
+        return ResponseWrapper(response_data)
+
+    def _failures(self, response_data: list[Response], positions: range | list[int]) -> dict:
+        failures = {}
+        for position in positions:
+            reason = validation_error(response_data[position], self.response_format)
+            if reason is not None:
+                failures[position] = reason
+        return failures
+
+    def stats(self) -> dict[str, float]:
+        """Get the parse failure and retry counters for MLflow."""
+        metrics: dict[str, float] = {
+            "structured_output_parse_failures": self.parse_failures,
+            "structured_output_retried_requests": self.retried_requests,
+            "structured_output_recovered": self.recovered,
+            "structured_output_final_failures": sum(self.failure_reasons.values()),
+        }
+        for reason, count in self.failure_reasons.items():
+            name = re.sub(r"[^\w\-.]", "_", reason)
+            metrics[f"structured_output_failures/{name}"] = count
+        return metrics
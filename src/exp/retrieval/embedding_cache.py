@@ -0,0 +1,195 @@
+"""Persistent embedding index that is reused across runs."""
+
+import hashlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Union
+
+import numpy as np
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+
+if TYPE_CHECKING:
+    from encourage.rag import RAGMethodInterface
+
+
+def content_hash(text: str) -> str:
+    """Get the SHA-256 hex digest of a text."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """SQLite store of embeddings keyed by the embedding model and the content hash of the text.
+
+    Next to every vector the time it took to compute it is stored, so the time saved by a cache
+    hit can be reported.
+    """
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        """Open or create the embedding cache.
+
+        Args:
+            path (Union[str, Path]): The path to the SQLite database.
+
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, content_hash TEXT NOT NULL, vector BLOB NOT NULL, "
+            "seconds REAL NOT NULL, PRIMARY KEY (model, content_hash))"
+        )
+        self._connection.commit()
+
+    def get_many(self, model: str, hashes: list[str]) -> dict[str, tuple[np.ndarray, float]]:
+        """Get the cached vectors and compute times of the given content hashes."""
+        found: dict[str, tuple[np.ndarray, float]] = {}
+        unique_hashes = list(dict.fromkeys(hashes))
+        # Stay below the SQLite limit of host parameters per statement
+        with self._lock:
+            for start in range(0, len(unique_hashes), 500):
+                chunk = unique_hashes[start : start + 500]
+                rows = self._connection.execute(
+                    "SELECT content_hash, vector, seconds FROM embeddings "
+                    f"WHERE model = ? AND content_hash IN ({','.join('?' * len(chunk))})",
+                    (model, *chunk),
+                ).fetchall()
+                for digest, vector, seconds in rows:
+                    found[digest] = (np.frombuffer(vector, dtype=np.float32), seconds)
+        return found
+
+    def put_many(self, model: str, entries: list[tuple[str, np.ndarray, float]]) -> None:
+        """Store `(content_hash, vector, seconds)` entries for a model."""
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)",
+                [
+                    (model, digest, np.asarray(vector, dtype=np.float32).tobytes(), seconds)
+                    for digest, vector, seconds in entries
+                ],
+            )
+            self._connection.commit()
+
+    def size_mb(self) -> float:
+        """Get the size of the database file in megabytes."""
+        return self.path.stat().st_size / (1024 * 1024) if self.path.exists() else 0.0
+
+
+class CachedEmbeddingFunction(EmbeddingFunction[Documents]):
+    """Chroma embedding function that only embeds texts that are not in the `EmbeddingCache`.
+
+    The sentence-transformers model is loaded on the first cache miss, so a run with an
+    unchanged corpus does not load it at all.
+    """
+
+    def __init__(self, model_name: str, cache: EmbeddingCache, **model_kwargs: Any) -> None:
+        self.model_name = model_name
+        self.cache = cache
+        self.model_kwargs = model_kwargs
+        self._embedding_function: EmbeddingFunction | None = None
+        self.hits = 0
+        self.misses = 0
+        self.embedding_seconds = 0.0
+        self.saved_seconds = 0.0
+
+    def __call__(self, input: Documents) -> Embeddings:  # noqa: A002
+        """Embed the texts, reading known texts from the cache."""
+        texts = list(input)
+        hashes = [content_hash(text) for text in texts]
+        cached = self.cache.get_many(self.model_name, hashes)
+
+        missing = list(dict.fromkeys(h for h in hashes if h not in cached))
+        if missing:
+            first_text = dict(zip(hashes, texts))
+            start = time.perf_counter()
+            vectors = self._model()([first_text[digest] for digest in missing])
+            elapsed = time.perf_counter() - start
+            self.embedding_seconds += elapsed
+            per_text = elapsed / len(missing)
+            entries = [(digest, np.asarray(v), per_text) for digest, v in zip(missing, vectors)]
+            self.cache.put_many(self.model_name, entries)
+            cached.update({digest: (vector, seconds) for digest, vector, seconds in entries})
+
+        embedded = set(missing)
+        self.misses += len(missing)
+        self.hits += len(texts) - len(missing)
+        self.saved_seconds += sum(cached[digest][1] for digest in hashes if digest not in embedded)
+        return [cached[digest][0] for digest in hashes]
+
+    def embed_documents(self, input: Documents) -> Embeddings:  # noqa: A002
+        """Embed documents."""
+        return self(input)
+
+    def embed_query(self, input: Documents) -> Embeddings:  # noqa: A002
+        """Embed queries."""
+        return self(input)
+
+    @staticmethod
+    def name() -> str:
+        """Name of the embedding function."""
+        return "cached_sentence_transformer"
+
+    def reset_counters(self) -> None:
+        """Reset the hit/miss counters and timings, e.g. at the start of a run."""
+        self.hits = 0
+        self.misses = 0
+        self.embedding_seconds = 0.0
+        self.saved_seconds = 0.0
+
+    def stats(self) -> dict[str, float]:
+        """Get the cache counters, the embedding time and the size of the index."""
+        return {
+            "embedding_cache_hits": self.hits,
+            "embedding_cache_misses": self.misses,
+            "embedding_seconds": self.embedding_seconds,
+            "embedding_time_saved_s": self.saved_seconds,
+            "embedding_index_size_mb": self.cache.size_mb(),
+        }
+
+    def _model(self) -> EmbeddingFunction:
+        if self._embedding_function is None:
+            from chromadb.utils.embedding_functions import SentenceTransformerEmbeddingFunction
+
+            self._embedding_function = SentenceTransformerEmbeddingFunction(
+                model_name=self.model_name, **self.model_kwargs
+            )
+        return self._embedding_function
+
+
+def create_rag(rag_config: dict[str, Any]) -> "RAGMethodInterface":
+    """Create the RAG method of a config, with a `CachedEmbeddingFunction` as embedding model.
+
+    The RAG methods of encourage create their embedding function from its model name in
+    `get_embedding_model`, so a cached function in `rag_config["embedding_function"]` is passed
+    in through a subclass of the registered method that returns it instead.
+
+    Args:
+        rag_config (dict[str, Any]): The config for `RAGFactory.create`.
+
+    Returns:
+        RAGMethodInterface: The RAG method.
+
+    """
+    from encourage.rag import BaseRAG, RAGFactory, RAGMethod
+
+    embedding_function = rag_config["embedding_function"]
+    if not isinstance(embedding_function, CachedEmbeddingFunction):
+        return RAGFactory.create(rag_config)
+
+    config_cls, rag_cls = RAGFactory.registry[RAGMethod[rag_config["method"]]]
+    if not issubclass(rag_cls, BaseRAG):
+        return RAGFactory.create(
+            {**rag_config, "embedding_function": embedding_function.model_name}
+        )
+
+    def get_embedding_model(self: BaseRAG, name: str, device: str = "cuda") -> Any:
+        embedding_function.model_kwargs.setdefault("device", device)
+        return embedding_function
+
+    cached_cls = type(
+        f"Cached{rag_cls.__name__}", (rag_cls,), {"get_embedding_model": get_embedding_model}
+    )
+    return cached_cls(config_cls(**rag_config))
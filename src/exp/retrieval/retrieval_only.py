@@ -0,0 +1,117 @@
+"""Retrieval-only runs that skip generation and only compute retrieval metrics."""
+
+import logging
+import uuid
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Iterator
+
+from encourage.llm import Response
+from encourage.prompts.context import Context, Document
+from encourage.prompts.meta_data import MetaData
+
+from exp.utils.file_manager import FileManager
+
+if TYPE_CHECKING:
+    import numpy as np
+    from encourage.rag import RAGMethodInterface
+
+    from exp.data.finqa_qa import FinQADatasetCollection
+
+logger = logging.getLogger(__name__)
+
+RETRIEVAL_LOG_NAME = "retrieval_log.jsonl.gz"
+# Metrics that only need the retrieved documents and the reference document
+RETRIEVAL_METRICS = {"meanreciprocalrank", "meanaverageprecision", "recallatk"}
+
+
+def retrieval_metrics(metrics: list[str | dict[str, Any]]) -> list[str | dict[str, Any]]:
+    """Keep only the retrieval metrics of a metrics config."""
+    return [
+        metric
+        for metric in metrics
+        if (metric if isinstance(metric, str) else next(iter(metric))).lower() in RETRIEVAL_METRICS
+    ]
+
+
+def run_retrieval(
+    rag_method_instance: "RAGMethodInterface",
+    dataset_obj: "FinQADatasetCollection",
+    log_path: Path,
+    batch_size: int | None = None,
+    sample_mask: "np.ndarray | None" = None,
+) -> int:
+    """Retrieve the contexts of all samples in batches and write the ranked document IDs.
+
+    Every line of the log holds the sample ID, the reference document IDs and the ranked IDs
+    and scores of the retrieved documents, without their content. With a `sample_mask`, only
+    the samples where it is true are retrieved.
+
+    Returns:
+        int: The number of samples.
+
+    """
+    queries = dataset_obj._generate_retrieval_queries()
+    indices = [i for i in range(len(queries)) if sample_mask is None or sample_mask[i]]
+    batch_size = batch_size or max(len(indices), 1)
+
+    def _records() -> Iterator[dict[str, Any]]:
+        for start in range(0, len(indices), batch_size):
+            batch = indices[start : start + batch_size]
+            retrieved = rag_method_instance.retrieve_contexts([queries[i] for i in batch])
+            for i, documents in zip(batch, retrieved):
+                meta_data = dataset_obj.prompt_meta_data[i]
+                yield {
+                    "id": meta_data["id"],
+                    "reference_ids": [str(meta_data["reference_document"].id)],
+                    "doc_ids": [str(document.id) for document in documents],
+                    "scores": [getattr(document, "score", None) for document in documents],
+                }
+            logger.info(f"Retrieved contexts for {start + len(batch)}/{len(indices)}")
+
+    return FileManager(log_path).write_jsonlines(_records())
+
+
+def _document(document_id: str, score: float | None = None) -> Document:
+    # The log holds no content, the metrics only need a non-empty one
+    content = f"Document {document_id}"
+    score = 0.0 if score is None else score
+    try:
+        return Document(id=uuid.UUID(document_id), content=content, score=score)
+    except ValueError:
+        return Document(id=document_id, content=content, score=score)  # ty: ignore
+
+
+def load_retrieval_responses(results_path: Path) -> list[Response]:
+    """Load a retrieval log as responses without answers, as input for retrieval metrics."""
+    log = FileManager(results_path / RETRIEVAL_LOG_NAME)
+    if not log.file_exists():
+        raise ValueError(f"No retrieval log found in: {results_path}")
+    responses = []
+    for record in log.iter_jsonlines():
+        references = [_document(ref_id) for ref_id in record["reference_ids"]]
+        responses.append(
+            Response(
+                request_id=str(record["id"]),
+                prompt_id=str(record["id"]),
+                sys_prompt="",
+                user_prompt="",
+                response="",
+                conversation_id=0,
+                meta_data=MetaData(
+                    {
+                        "id": record["id"],
+                        "reference_answer": "",
+                        "reference_document": references[0] if len(references) == 1 else references,
+                    }
+                ),
+                context=Context.from_documents(
+                    [
+                        _document(doc_id, score)
+                        for doc_id, score in zip(record["doc_ids"], record["scores"])
+                    ]
+                ),
+                arrival_time=0.0,
+                finished_time=0.0,
+            )
+        )
+    return responses
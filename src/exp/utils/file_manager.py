@@ -1,12 +1,27 @@
 """A module to manage file operations."""
 
+import gzip
+import io
 import json
+import logging
+import os
 from pathlib import Path
-from typing import Any, Union
+from typing import IO, Any, Iterable, Iterator, Union
 
+import numpy as np
 import yaml
 from pydantic import BaseModel
 
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+GZIP_SUFFIXES = {".gz", ".gzip"}
+ZSTD_SUFFIXES = {".zst", ".zstd"}
+
 
 class PydanticEncoder(json.JSONEncoder):
     """Some metrics return pydantic objects in their outputs (e.g., Verdicts).
@@ -21,23 +36,81 @@ class PydanticEncoder(json.JSONEncoder):
         return super().default(obj)
 
 
+def _open_zstd(filepath: Path, mode: str, encoding: str | None) -> IO:
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ImportError(f"Reading or writing {filepath} needs `zstandard`") from e
+    if "r" not in mode:
+        return zstandard.open(filepath, mode, encoding=encoding)
+    # Appending adds a new frame, so reading has to continue across frames. The reader owns
+    # the raw file and closes it with closefd, so it must outlive this function.
+    raw = open(filepath, "rb")  # noqa: SIM115
+    reader = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True, closefd=True)
+    buffered = io.BufferedReader(reader)  # ty: ignore
+    return buffered if encoding is None else io.TextIOWrapper(buffered, encoding=encoding)
+
+
+def _numpy_default(obj: Any) -> Any:
+    """Fallback of the orjson backend for the NumPy scalars that it does not serialize itself."""
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Object of type {obj.__class__.__name__} is not JSON serializable")
+
+
+def _pydantic_default(obj: Any) -> Any:
+    """Fallback of the orjson backend with the semantics of `PydanticEncoder`."""
+    if isinstance(obj, BaseModel):
+        return obj.model_dump()
+    return _numpy_default(obj)
+
+
 class FileManager:
-    """A class to manage file operations."""
+    """A class to manage file operations.
 
-    def __init__(self, filepath: Union[str, Path]) -> None:
+    Files ending in `.gz` or `.zst` are compressed and decompressed transparently, zstd needs the
+    optional `zstandard` package. JSON is serialized with `orjson` if it is installed, unless
+    `json_backend="json"` is given.
+    """
+
+    def __init__(self, filepath: Union[str, Path], json_backend: str = "auto") -> None:
         """Initialize FileManager with a given file path.
 
         Args:
             filepath (Union[str, Path]): The path to the file to manage.
+            json_backend (str): `json`, `orjson` or `auto` to use orjson when it is installed.
 
         """
         self.filepath = Path(filepath)
+        if json_backend == "orjson" and orjson is None:
+            raise ImportError("The orjson backend needs the `orjson` package")
+        self.use_orjson = orjson is not None and json_backend in ("auto", "orjson")
         self._ensure_directory_exists()
 
     def _ensure_directory_exists(self) -> None:
         """Ensure that the directory for the file exists."""
         self.filepath.parent.mkdir(parents=True, exist_ok=True)
 
+    def open(self, mode: str = "rt", filepath: Path | None = None) -> IO:
+        """Open the file, decompressing or compressing it based on its extension.
+
+        Args:
+            mode (str): The mode in which to open the file, e.g. 'rt', 'wb' or 'at'.
+            filepath (Path | None): Another path with the same compression, e.g. a temp file.
+
+        Returns:
+            IO: The file object.
+
+        """
+        filepath = filepath or self.filepath
+        suffix = self.filepath.suffix.lower()
+        encoding = None if "b" in mode else "utf-8"
+        if suffix in GZIP_SUFFIXES:
+            return gzip.open(filepath, mode, encoding=encoding)
+        if suffix in ZSTD_SUFFIXES:
+            return _open_zstd(filepath, mode, encoding)
+        return open(filepath, mode, encoding=encoding)
+
     def read(self, mode: str = "rt") -> Any:
         """Read the entire content of the file.
 
@@ -48,18 +121,21 @@ class FileManager:
             str: The content of the file.
 
         """
-        with open(self.filepath, mode, encoding="utf-8") as file:
+        with self.open(mode) as file:
             return file.read()
 
     def write(self, data: str, mode: str = "wt") -> None:
         """Write the provided content to the file, overwriting any existing content.
 
+        The content is written to a temporary file that replaces the file at the end, so
+        readers never see a partially written file.
+
         Args:
             data (str): The content to write to the file.
             mode (str): The mode in which to open the file (default is 'wt').
 
         """
-        with open(self.filepath, mode, encoding="utf-8") as file:
+        with self._atomic_open(mode) as file:
             file.write(data)
 
     def append(self, data: str) -> None:
@@ -69,9 +145,12 @@ class FileManager:
             data (str): The data to append to the file.
 
         """
-        with open(self.filepath, "at", encoding="utf-8") as file:
+        with self.open("at") as file:
             file.write(data)
 
+    def _atomic_open(self, mode: str = "wt") -> "_AtomicFile":
+        return _AtomicFile(self, mode)
+
     def delete(self) -> None:
         """Delete the file if it exists."""
         if self.file_exists():
@@ -86,6 +165,57 @@ class FileManager:
         """
         return self.filepath.exists()
 
+    def iter_jsonlines(self, skip_invalid: bool = False) -> Iterator[Any]:
+        """Iterate over the records of a JSON lines file, one line at a time.
+
+        Args:
+            skip_invalid (bool): Whether to skip lines that can not be decoded, e.g. the
+                truncated last line of a crashed writer, instead of raising.
+
+        Yields:
+            Any: The decoded record of every non-empty line.
+
+        """
+        loads = orjson.loads if self.use_orjson else json.loads
+        errors = (json.JSONDecodeError, orjson.JSONDecodeError) if orjson else json.JSONDecodeError
+        with self.open("rb") as file:
+            for line_number, line in enumerate(file, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield loads(line)
+                except errors:
+                    if not skip_invalid:
+                        raise
+                    logger.warning(f"Skipping corrupt line {line_number} in {self.filepath}")
+
+    def write_jsonlines(
+        self,
+        data: Iterable[Any],
+        ensure_ascii: bool = False,
+        pydantic_encoder: bool = False,
+    ) -> int:
+        """Write records to a JSON lines file, one line at a time.
+
+        The records are not collected in memory, so `data` can be a generator. The file is
+        replaced atomically once all records are written.
+
+        Args:
+            data (Iterable[Any]): The records to write.
+            ensure_ascii (bool): Whether to escape non-ASCII characters in the output.
+            pydantic_encoder (bool): Whether to serialize Pydantic models as dicts.
+
+        Returns:
+            int: The number of written records.
+
+        """
+        count = 0
+        with self._atomic_open("wb") as file:
+            for item in data:
+                file.write(self._dumps(item, ensure_ascii, pydantic_encoder) + b"\n")
+                count += 1
+        return count
+
     def load_jsonlines(self) -> list[dict[str, Any]]:
         """Load data from a JSON lines file.
 
@@ -93,8 +223,7 @@ class FileManager:
             list[dict[str, Any]]: A list of dictionaries with the data from the JSON lines file.
 
         """
-        lines = self.read().strip().splitlines()
-        return [json.loads(line) for line in lines]
+        return list(self.iter_jsonlines())
 
     def dump_jsonlines(self, data: list[dict[str, Any]], ensure_ascii: bool = False) -> None:
         """Dump data to a JSON lines file.
@@ -105,8 +234,7 @@ class FileManager:
             kwargs: Additional keyword arguments to pass to json.dumps.
 
         """
-        lines = "\n".join(json.dumps(item, ensure_ascii=ensure_ascii) for item in data)
-        self.write(f"{lines}\n")
+        self.write_jsonlines(data, ensure_ascii=ensure_ascii)
 
     def load_json(self) -> Any:
         """Load data from a JSON file.
@@ -115,7 +243,10 @@ class FileManager:
             Any: The data loaded from the JSON file.
 
         """
-        return json.loads(self.read())
+        if self.use_orjson:
+            return orjson.loads(self.read("rb"))
+        with self.open("rt") as file:
+            return json.load(file)
 
     def dump_json(
         self, data: Any, ensure_ascii: bool = False, pydantic_encoder: bool = False
@@ -129,10 +260,29 @@ class FileManager:
             kwargs: Additional keyword arguments to pass to json.dumps.
 
         """
+        if self.use_orjson and not ensure_ascii:
+            with self._atomic_open("wb") as file:
+                file.write(self._dumps(data, ensure_ascii, pydantic_encoder))
+            return
         encoder = None
         if pydantic_encoder:
             encoder = PydanticEncoder
-        self.write(json.dumps(data, ensure_ascii=ensure_ascii, cls=encoder))
+        # json.dump writes chunk by chunk instead of building the whole string first
+        with self._atomic_open("wt") as file:
+            json.dump(data, file, ensure_ascii=ensure_ascii, cls=encoder)
+
+    def _dumps(self, data: Any, ensure_ascii: bool, pydantic_encoder: bool) -> bytes:
+        """Serialize a value to UTF-8 JSON with the configured backend."""
+        # orjson never escapes non-ASCII characters
+        if self.use_orjson and not ensure_ascii:
+            # Samples and metrics often hold NumPy values, which orjson rejects by default
+            return orjson.dumps(
+                data,
+                default=_pydantic_default if pydantic_encoder else _numpy_default,
+                option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY,
+            )
+        encoder = PydanticEncoder if pydantic_encoder else None
+        return json.dumps(data, ensure_ascii=ensure_ascii, cls=encoder).encode("utf-8")
 
     def load_yaml(self) -> Any:
         """Load data from a YAML file.
@@ -152,3 +302,26 @@ class FileManager:
 
         """
         self.write(yaml.safe_dump(data))
+
+
+class _AtomicFile:
+    """Context manager that writes to a temporary file and renames it on success."""
+
+    def __init__(self, file_manager: FileManager, mode: str) -> None:
+        self.file_manager = file_manager
+        self.mode = mode
+        target = file_manager.filepath
+        self.tmp_path = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+        self.file: IO | None = None
+
+    def __enter__(self) -> IO:
+        self.file = self.file_manager.open(self.mode, self.tmp_path)
+        return self.file
+
+    def __exit__(self, exc_type: Any, exc: Any, traceback: Any) -> None:
+        assert self.file is not None
+        self.file.close()
+        if exc_type is None:
+            self.tmp_path.replace(self.file_manager.filepath)
+        else:
+            self.tmp_path.unlink(missing_ok=True)
@@ -0,0 +1,115 @@
+"""Append-only inference log that is streamed to disk while responses arrive."""
+
+import json
+from pathlib import Path
+from typing import Any, Iterator, Union
+
+from encourage.llm import Response
+
+from exp.utils.file_manager import FileManager
+
+INFERENCE_LOG_NAME = "inference_log.jsonl"
+LEGACY_INFERENCE_LOG_NAME = "inference_log.json"
+
+
+class InferenceLog:
+    """JSON lines log of responses, appended batch by batch.
+
+    Each line holds one `Response.to_dict()`. A run that dies half way leaves every completed
+    batch on disk, and a truncated last line is skipped on reading, so the log can be used to
+    resume the run.
+    """
+
+    def __init__(self, filepath: Union[str, Path]) -> None:
+        """Initialize the log for the given file path.
+
+        Args:
+            filepath (Union[str, Path]): The path to the JSON lines file.
+
+        """
+        self.file_manager = FileManager(filepath)
+
+    @property
+    def filepath(self) -> Path:
+        """The path to the log file."""
+        return self.file_manager.filepath
+
+    def reset(self) -> None:
+        """Delete the log so that a new run starts from scratch."""
+        self.file_manager.delete()
+
+    def append(self, responses: list[Response]) -> None:
+        """Append a batch of responses to the log.
+
+        Args:
+            responses (list[Response]): The responses to append.
+
+        """
+        if not responses:
+            return
+        lines = "".join(
+            json.dumps(response.to_dict(), ensure_ascii=False) + "\n" for response in responses
+        )
+        # A crash in the middle of a write leaves a partial line without a newline
+        if self.file_manager.file_exists() and not self._ends_with_newline():
+            lines = "\n" + lines
+        self.file_manager.append(lines)
+
+    def iter_records(self) -> Iterator[dict[str, Any]]:
+        """Iterate over the records in the log, skipping lines that can not be decoded."""
+        if not self.file_manager.file_exists():
+            return
+        yield from self.file_manager.iter_jsonlines(skip_invalid=True)
+
+    def completed_ids(self) -> set[str]:
+        """Get the sample IDs that already have a response in the log."""
+        sample_ids = (record_sample_id(record) for record in self.iter_records())
+        return {sample_id for sample_id in sample_ids if sample_id is not None}
+
+    def latest_records(self) -> list[dict[str, Any]]:
+        """Get the records, keeping only the latest record per sample ID."""
+        records: dict[Any, dict[str, Any]] = {}
+        for i, record in enumerate(self.iter_records()):
+            records[record_sample_id(record) or i] = record
+        return list(records.values())
+
+    def load(self) -> list[Response]:
+        """Load all responses, keeping only the latest response per sample ID."""
+        return [Response.from_dict(record) for record in self.latest_records()]
+
+    def _ends_with_newline(self) -> bool:
+        with open(self.filepath, "rb") as file:
+            file.seek(0, 2)
+            if file.tell() == 0:
+                return True
+            file.seek(-1, 2)
+            return file.read(1) == b"\n"
+
+
+def record_sample_id(record: dict[str, Any]) -> str | None:
+    """Get the sample ID of a log record, None if it has none."""
+    meta_data = record.get("meta_data") or {}
+    return meta_data.get("id") if isinstance(meta_data, dict) else None
+
+
+def load_responses(results_path: Path) -> list[Response]:
+    """Load responses from a results folder.
+
+    The streamed `inference_log.jsonl` is preferred, the old `inference_log.json` is used as a
+    fallback for runs that were created before the log was streamed.
+
+    Args:
+        results_path (Path): The folder with the results of the execution.
+
+    Returns:
+        list[Response]: The loaded responses.
+
+    """
+    streamed_log = InferenceLog(results_path / INFERENCE_LOG_NAME)
+    if streamed_log.file_manager.file_exists():
+        return streamed_log.load()
+
+    legacy_log = results_path / LEGACY_INFERENCE_LOG_NAME
+    if not legacy_log.exists():
+        raise ValueError(f"No inference log found in: {results_path}")
+    return [Response.from_dict(item) for item in FileManager(legacy_log).load_json()]
@@ -0,0 +1,324 @@
+"""Background MLflow logging with batching and a local spool for unreachable servers.
+
+Params and metrics are put on a queue and sent by a worker thread as `log_batch` calls, so the
+run does not wait for the tracking server. If the server can not be reached, everything that is
+logged from then on is appended to a JSON lines spool file instead. Spooled runs are replayed
+when a later run reaches the server, or manually:
+
+Usage:
+    uv run python -m exp.utils.mlflow_logger --tracking-uri <uri>
+"""
+
+import argparse
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator, Mapping, Union
+
+import mlflow
+from mlflow.entities import Dataset, DatasetInput, InputTag, Metric, Param
+from mlflow.tracking import MlflowClient
+
+from exp.utils.file_manager import FileManager
+
+logger = logging.getLogger(__name__)
+
+# Limits of a single `log_batch` call
+MAX_PARAMS_PER_BATCH = 100
+MAX_METRICS_PER_BATCH = 1000
+
+_CLOSE = object()
+
+
+class MlflowLogger:
+    """Logs params, metrics, inputs and artifacts of one run from a background thread."""
+
+    def __init__(
+        self,
+        tracking_uri: str,
+        run_id: str | None,
+        experiment_name: str,
+        spool_dir: Union[str, Path],
+        replay: bool = True,
+    ) -> None:
+        """Start the worker thread.
+
+        Args:
+            tracking_uri (str): The MLflow tracking URI, e.g. an HTTP server or `file:./mlruns`.
+            run_id (str | None): The run to log to, None if the run could not be created and
+                everything has to be spooled.
+            experiment_name (str): The experiment, used to create the run when replaying.
+            spool_dir (Union[str, Path]): The folder for spool files.
+            replay (bool): Whether to replay closed spool files of earlier runs once the server
+                is reachable.
+
+        """
+        self.client = MlflowClient(tracking_uri)
+        self.tracking_uri = tracking_uri
+        self.run_id = run_id
+        self.experiment_name = experiment_name
+        self.spool_dir = Path(spool_dir)
+        self.spool = FileManager(self.spool_dir / f"{run_id or uuid.uuid4().hex}.jsonl")
+        self.offline = run_id is None
+        self._spool_started = False
+        self._replay = replay
+        self._queue: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(target=self._work, name="mlflow-logger", daemon=True)
+        self._thread.start()
+
+    def log_params(self, params: Mapping[str, Any]) -> None:
+        """Queue params, values are logged as strings."""
+        self._queue.put(("params", {str(key): str(value) for key, value in params.items()}))
+
+    def log_metrics(self, metrics: Mapping[str, float], step: int | None = None) -> None:
+        """Queue metrics with the current timestamp."""
+        timestamp = int(time.time() * 1000)
+        self._queue.put(
+            (
+                "metrics",
+                [
+                    {"key": key, "value": float(value), "timestamp": timestamp, "step": step or 0}
+                    for key, value in metrics.items()
+                ],
+            )
+        )
+
+    def log_input(self, dataset: Any, context: str | None = None) -> None:
+        """Queue an `mlflow.data` dataset as input of the run."""
+        entity = dataset._to_mlflow_entity()
+        self._queue.put(
+            (
+                "input",
+                {
+                    "dataset": {
+                        "name": entity.name,
+                        "digest": entity.digest,
+                        "source_type": entity.source_type,
+                        "source": entity.source,
+                        "schema": entity.schema,
+                        "profile": entity.profile,
+                    },
+                    "context": context,
+                },
+            )
+        )
+
+    def log_artifact(self, path: Union[str, Path]) -> None:
+        """Queue a local file as artifact, the file must exist until it is uploaded."""
+        self._queue.put(("artifact", str(Path(path).resolve())))
+
+    def flush(self) -> None:
+        """Wait until everything logged so far is sent or spooled."""
+        self._queue.join()
+
+    def close(self, status: str | None = "FINISHED") -> None:
+        """Send or spool the remaining entries and stop the worker.
+
+        Args:
+            status (str | None): The final status of the run, None leaves the run open, e.g.
+                because it belongs to the caller. The status is also recorded in the spool, so
+                that a replay can terminate the run.
+
+        """
+        if status is not None:
+            self._queue.put(("end", status))
+        self._queue.put(_CLOSE)
+        self._thread.join()
+
+    def _work(self) -> None:
+        if self._replay and not self.offline:
+            try:
+                replay_spool(self.spool_dir, self.tracking_uri, exclude={self.spool.filepath})
+            except Exception as e:
+                logger.warning(f"Could not replay the MLflow spool: {e}")
+        closing = False
+        while not closing:
+            items = [self._queue.get()]
+            while True:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            closing = _CLOSE in items
+            entries = [item for item in items if item is not _CLOSE]
+            try:
+                self._handle(entries)
+            except Exception as e:
+                logger.error(f"Dropped {len(entries)} MLflow entries: {e}")
+            for _ in items:
+                self._queue.task_done()
+
+    def _handle(self, entries: list[tuple[str, Any]]) -> None:
+        if not self.offline:
+            try:
+                _send(self.client, self.run_id, entries)  # ty: ignore
+                return
+            except Exception as e:
+                logger.warning(f"MLflow server unreachable, spooling to {self.spool.filepath}: {e}")
+                self.offline = True
+        if any(kind != "end" for kind, _ in entries) or self._spool_started:
+            self._write_spool(entries)
+
+    def _write_spool(self, entries: list[tuple[str, Any]]) -> None:
+        lines = []
+        if not self._spool_started:
+            header = {
+                "run_id": self.run_id,
+                "experiment_name": self.experiment_name,
+                "start_time": int(time.time() * 1000),
+            }
+            lines.append({"header": header})
+            self._spool_started = True
+        lines.extend({"kind": kind, "payload": payload} for kind, payload in entries)
+        self.spool.append("".join(json.dumps(line, ensure_ascii=False) + "\n" for line in lines))
+
+
+def _send(client: MlflowClient, run_id: str, entries: list[tuple[str, Any]]) -> None:
+    """Send queued entries to the tracking server, batching params and metrics."""
+    params: dict[str, str] = {}
+    metrics: list[dict[str, Any]] = []
+    status = None
+    for kind, payload in entries:
+        if kind == "params":
+            params.update(payload)
+        elif kind == "metrics":
+            metrics.extend(payload)
+
+    items = list(params.items())
+    for start in range(0, len(items), MAX_PARAMS_PER_BATCH):
+        chunk = items[start : start + MAX_PARAMS_PER_BATCH]
+        client.log_batch(run_id, params=[Param(key, value) for key, value in chunk])
+    for start in range(0, len(metrics), MAX_METRICS_PER_BATCH):
+        chunk = metrics[start : start + MAX_METRICS_PER_BATCH]
+        client.log_batch(run_id, metrics=[Metric(**metric) for metric in chunk])
+
+    for kind, payload in entries:
+        if kind == "input":
+            context = payload["context"]
+            tags = [InputTag("mlflow.data.context", context)] if context else []
+            client.log_inputs(run_id, [DatasetInput(Dataset(**payload["dataset"]), tags)])
+        elif kind == "artifact":
+            client.log_artifact(run_id, payload)
+        elif kind == "end":
+            status = payload
+    if status is not None:
+        client.set_terminated(run_id, status)
+
+
+def replay_spool(
+    spool_dir: Union[str, Path],
+    tracking_uri: str,
+    include_open: bool = False,
+    exclude: set[Path] = set(),
+) -> int:
+    """Send spooled runs to the tracking server and delete their spool files.
+
+    Args:
+        spool_dir (Union[str, Path]): The folder with the spool files.
+        tracking_uri (str): The MLflow tracking URI.
+        include_open (bool): Whether to replay spools without a final status, e.g. of crashed
+            runs. By default they are skipped, because the run might still be writing.
+        exclude (set[Path]): Spool files to skip.
+
+    Returns:
+        int: The number of replayed runs.
+
+    """
+    spool_dir = Path(spool_dir)
+    if not spool_dir.exists():
+        return 0
+    client = MlflowClient(tracking_uri)
+    replayed = 0
+    for filepath in sorted(spool_dir.glob("*.jsonl")):
+        if filepath in exclude:
+            continue
+        records = list(FileManager(filepath).iter_jsonlines(skip_invalid=True))
+        if not records or "header" not in records[0]:
+            continue
+        entries = [(record["kind"], record["payload"]) for record in records[1:]]
+        if not include_open and not any(kind == "end" for kind, _ in entries):
+            continue
+        # Claim the file, so that concurrent replays do not log the run twice
+        claimed = filepath.with_suffix(f".replaying-{os.getpid()}")
+        try:
+            filepath.rename(claimed)
+        except FileNotFoundError:
+            continue
+        header = records[0]["header"]
+        run_id = header["run_id"]
+        if run_id is None:
+            experiment = client.get_experiment_by_name(header["experiment_name"])
+            experiment_id = (
+                experiment.experiment_id
+                if experiment is not None
+                else client.create_experiment(header["experiment_name"])
+            )
+            run_id = client.create_run(experiment_id, start_time=header["start_time"]).info.run_id
+        try:
+            _send(client, run_id, entries)
+        except Exception:
+            claimed.rename(filepath)
+            raise
+        claimed.unlink()
+        replayed += 1
+        logger.info(f"Replayed spooled MLflow run {run_id} from {filepath}")
+    return replayed
+
+
+@contextmanager
+def tracked_run(
+    tracking_uri: str,
+    experiment_name: str,
+    spool_dir: Union[str, Path],
+) -> Iterator[MlflowLogger]:
+    """Start an MLflow run, or reuse the active one, and log to it in the background.
+
+    If the server can not be reached, the run is spooled and created later on replay. Spans and
+    autologging still use the fluent MLflow API and the active run, if there is one.
+    """
+    active_run = mlflow.active_run()
+    run = active_run
+    if run is None:
+        try:
+            mlflow.set_tracking_uri(tracking_uri)
+            mlflow.set_experiment(experiment_name=experiment_name)
+            run = mlflow.start_run()
+        except Exception as e:
+            logger.warning(f"Could not start an MLflow run, spooling to {spool_dir}: {e}")
+    run_id = run.info.run_id if run is not None else None
+    tracker = MlflowLogger(tracking_uri, run_id, experiment_name, spool_dir)
+    status = "FAILED"
+    try:
+        yield tracker
+        status = "FINISHED"
+    finally:
+        if active_run is None:
+            tracker.close(status)
+            if run is not None:
+                try:
+                    mlflow.end_run(status)
+                except Exception as e:
+                    logger.warning(f"Could not end the MLflow run: {e}")
+        else:
+            tracker.close(None)
+
+
+def main() -> None:
+    """Replay the spooled runs."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tracking-uri", required=True)
+    parser.add_argument("--spool-dir", default="./.cache/mlflow_spool")
+    parser.add_argument("--include-open", action="store_true", help="Also replay crashed runs")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    print(f"Replayed {replay_spool(args.spool_dir, args.tracking_uri, args.include_open)} runs")
+
+
+if __name__ == "__main__":
+    main()
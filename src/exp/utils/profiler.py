@@ -0,0 +1,171 @@
+"""Per-stage timers and request-level latency statistics of a run."""
+
+import cProfile
+import math
+import os
+import statistics
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Any, ContextManager, Iterator, Union
+
+from exp.utils.file_manager import FileManager
+
+PROFILE_NAME = "profile.json"
+PERCENTILES = (50, 95, 99)
+
+_active: "Profiler | None" = None
+
+
+class Profiler:
+    """Collects stage timings and per-request statistics.
+
+    Stages can be nested, every stage reports its inclusive wall time. Repeated stages, e.g. the
+    generation of every batch, are summed up.
+    """
+
+    def __init__(self) -> None:
+        self.stages: dict[str, float] = {}
+        self.stage_calls: dict[str, int] = {}
+        self.latencies: list[float] = []
+        self.time_to_first_token: list[float] = []
+        self.prompt_tokens: list[int] = []
+        self.completion_tokens: list[int] = []
+        self.tokens_per_second: list[float] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Time a stage of the run."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - start)
+
+    def add_stage(self, name: str, seconds: float) -> None:
+        """Add the time of a stage that was measured elsewhere."""
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+            self.stage_calls[name] = self.stage_calls.get(name, 0) + 1
+
+    def record_request(
+        self,
+        latency_s: float,
+        time_to_first_token_s: float | None = None,
+        prompt_tokens: int | None = None,
+        completion_tokens: int | None = None,
+    ) -> None:
+        """Record one request to the server."""
+        with self._lock:
+            self.latencies.append(latency_s)
+            if time_to_first_token_s is not None:
+                self.time_to_first_token.append(time_to_first_token_s)
+            if prompt_tokens is not None:
+                self.prompt_tokens.append(prompt_tokens)
+            if completion_tokens is not None:
+                self.completion_tokens.append(completion_tokens)
+                if latency_s > 0:
+                    self.tokens_per_second.append(completion_tokens / latency_s)
+
+    def summary(self) -> dict[str, Any]:
+        """Get the stage timings and the request statistics."""
+        requests: dict[str, Any] = {"count": len(self.latencies)}
+        requests.update(_distribution("latency_s", self.latencies))
+        requests.update(_distribution("time_to_first_token_s", self.time_to_first_token))
+        requests.update(_distribution("tokens_per_second", self.tokens_per_second))
+        requests["prompt_tokens"] = int(sum(self.prompt_tokens))
+        requests["completion_tokens"] = int(sum(self.completion_tokens))
+        generation_s = self.stages.get("generation")
+        if generation_s:
+            requests["completion_tokens_per_second"] = requests["completion_tokens"] / generation_s
+        stages = {
+            name: {"seconds": seconds, "calls": self.stage_calls[name]}
+            for name, seconds in self.stages.items()
+        }
+        # Retrieval and prompt building are what the RAG method spends around the generation
+        if "rag" in self.stages and "generation" in self.stages:
+            stages["retrieval"] = {
+                "seconds": max(self.stages["rag"] - self.stages["generation"], 0.0),
+                "calls": self.stage_calls["rag"],
+            }
+        return {"pid": os.getpid(), "stages": stages, "requests": requests}
+
+    def metrics(self) -> dict[str, float]:
+        """Get the summary as flat MLflow metrics."""
+        summary = self.summary()
+        metrics = {
+            f"profile/stage/{name}_s": timing["seconds"]
+            for name, timing in summary["stages"].items()
+        }
+        metrics.update(
+            {f"profile/requests/{name}": value for name, value in summary["requests"].items()}
+        )
+        return metrics
+
+    def write(self, filepath: Union[str, Path]) -> Path:
+        """Write the summary as JSON."""
+        FileManager(filepath).dump_json(self.summary())
+        return Path(filepath)
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Get the q-th percentile with linear interpolation, like `numpy.percentile`."""
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower, upper = math.floor(position), math.ceil(position)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def _distribution(name: str, values: list[float]) -> dict[str, float]:
+    if not values:
+        return {}
+    stats = {f"{name}_mean": statistics.fmean(values)}
+    for q in PERCENTILES:
+        stats[f"{name}_p{q}"] = percentile(values, q)
+    return stats
+
+
+def active_profiler() -> Profiler | None:
+    """Get the profiler of the current run, if there is one."""
+    return _active
+
+
+def stage(name: str) -> ContextManager:
+    """Time a stage with the active profiler, or do nothing without one."""
+    return _active.stage(name) if _active is not None else nullcontext()
+
+
+@contextmanager
+def profiling(cprofile_path: Union[str, Path, None] = None) -> Iterator[Profiler]:
+    """Activate a profiler for the duration of a run.
+
+    Nested calls reuse the active profiler, so that the evaluation inside a run reports into the
+    profiler of the run.
+
+    Args:
+        cprofile_path (Union[str, Path, None]): If given, the Python side of the run is profiled
+            with cProfile and the stats are dumped to this path, e.g. for `snakeviz`. Sampling
+            profilers like py-spy can attach to the `pid` from the summary instead.
+
+    Yields:
+        Profiler: The active profiler.
+
+    """
+    global _active
+    if _active is not None:
+        yield _active
+        return
+    _active = Profiler()
+    python_profile = cProfile.Profile() if cprofile_path else None
+    if python_profile is not None:
+        python_profile.enable()
+    try:
+        yield _active
+    finally:
+        if python_profile is not None:
+            python_profile.disable()
+            Path(cprofile_path).parent.mkdir(parents=True, exist_ok=True)  # ty: ignore
+            python_profile.dump_stats(str(cprofile_path))
+        _active = None
@@ -0,0 +1,97 @@
+"""Columnar table of responses, written as Parquet."""
+
+from pathlib import Path
+from typing import Any, Iterable, Iterator, Union
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+RESPONSE_TABLE_NAME = "responses.parquet"
+
+_ARROW_TYPES: dict[type, pa.DataType] = {
+    bool: pa.bool_(),
+    int: pa.int64(),
+    float: pa.float64(),
+    str: pa.string(),
+}
+
+
+def _flatten(value: Any, name: str) -> Iterator[tuple[str, Any]]:
+    """Yield the scalar leaves of a record with the column names of `flatten_dict`."""
+    if isinstance(value, dict):
+        for key, child in value.items():
+            yield from _flatten(child, f"{name}_{key}" if name else str(key))
+    elif isinstance(value, (list, tuple)):
+        for i, child in enumerate(value):
+            yield from _flatten(child, f"{name}{i}")
+    else:
+        yield name, value
+
+
+class ResponseTableBuilder:
+    """Builds typed columns from response records in a single pass.
+
+    Column names follow `flatten_dict`, e.g. `meta_data_id` or `context_documents0_content`.
+    The type of a column is fixed by its first non-null value. Integers that meet floats become
+    floats, every other conflict turns the column into strings. Missing values are nulls.
+    """
+
+    def __init__(self) -> None:
+        self.columns: dict[str, list[Any]] = {}
+        self.types: dict[str, pa.DataType] = {}
+        self.num_rows = 0
+
+    @classmethod
+    def from_records(cls, records: Iterable[dict[str, Any]]) -> "ResponseTableBuilder":
+        """Create a builder and add all records."""
+        builder = cls()
+        for record in records:
+            builder.add(record)
+        return builder
+
+    def add(self, record: dict[str, Any]) -> None:
+        """Add one record, e.g. a `Response.to_dict()`."""
+        for name, value in _flatten(record, ""):
+            column = self.columns.get(name)
+            if column is None:
+                column = self.columns[name] = [None] * self.num_rows
+            if len(column) > self.num_rows:
+                # Two keys of the record flatten to the same name, the last one wins
+                column[-1] = value
+            else:
+                column.append(value)
+            if value is not None:
+                self._update_type(name, value)
+        self.num_rows += 1
+        for column in self.columns.values():
+            if len(column) < self.num_rows:
+                column.append(None)
+
+    def _update_type(self, name: str, value: Any) -> None:
+        value_type = _ARROW_TYPES.get(type(value), pa.string())
+        column_type = self.types.get(name)
+        if column_type is None or column_type == value_type:
+            self.types[name] = value_type
+        elif {column_type, value_type} == {pa.int64(), pa.float64()}:
+            self.types[name] = pa.float64()
+        else:
+            self.types[name] = pa.string()
+
+    def to_table(self) -> pa.Table:
+        """Convert the columns to an Arrow table."""
+        arrays = {}
+        for name, values in self.columns.items():
+            column_type = self.types.get(name, pa.string())
+            if column_type == pa.string():
+                values = [value if value is None else str(value) for value in values]
+            arrays[name] = pa.array(values, type=column_type)
+        return pa.table(arrays)
+
+    def write(self, filepath: Union[str, Path]) -> Path:
+        """Write the table as a Parquet file, replacing an existing file atomically."""
+        filepath = Path(filepath)
+        filepath.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = filepath.with_name(f".{filepath.name}.tmp")
+        pq.write_table(self.to_table(), tmp_path, compression="zstd")
+        tmp_path.replace(filepath)
+        return filepath
@@ -1,12 +1,24 @@
-"""Main script for starting the VLLM server."""
+"""Main script for starting the VLLM server.
 
+The launcher polls `/v1/models` until every replica serves, sends a warm-up batch and then
+writes `serving.readiness_file`, which `execution.py` waits on with `serving.wait_for_ready`.
+It exits with a non-zero code if a replica does not become ready.
+"""
+
+import json
 import os
+import shlex
 import subprocess
+import sys
+import time
 
 import hydra
 from dotenv import load_dotenv
 
 from exp.evaluation.config import Config
+from exp.inference.readiness import ReadinessFile, startup_metrics, wait_until_ready, warm_up
+from exp.inference.replicas import replica_base_urls
+from exp.utils.file_manager import FileManager
 
 # Load environment variables from .env file
 load_dotenv(".env")
@@ -23,19 +35,11 @@ if not API_KEY:
     )
 
 
-@hydra.main(version_base=None, config_path="conf", config_name="defaults")
-def main(cfg: Config) -> None:
-    """Main function for starting the VLLM server."""
-    # Ensure the Hugging Face cache directory exists
-    if not os.path.exists(HUGGINGFACE_CACHE_DIR):
-        os.makedirs(HUGGINGFACE_CACHE_DIR, exist_ok=True)
-
-    # Ensure permissions for the cache directory
-    os.chmod(HUGGINGFACE_CACHE_DIR, 0o777)
-
-    # Construct the Docker command
+def build_vllm_command(cfg: Config, port: int) -> list[str]:
+    """Build the vllm serve command for one replica."""
     vllm_command = [
-        "vllm serve",
+        "vllm",
+        "serve",
         cfg.model.model_name,
         "--dtype",
         "auto",
@@ -44,7 +48,7 @@ def main(cfg: Config) -> None:
         "--gpu-memory-utilization",
         str(cfg.model.gpu_memory_utilization),
         "--port",
-        str(cfg.vllm_port),
+        str(port),
         "--max-model-len",
         str(cfg.model.max_model_len),
         "--tensor-parallel-size",
@@ -60,13 +64,117 @@ def main(cfg: Config) -> None:
 
     if getattr(cfg.model, "quantization", None):
         vllm_command.extend(["--quantization", str(cfg.model.quantization)])
+    return vllm_command  # ty: ignore
+
+
+def device_groups(replicas: int, gpus_per_replica: int) -> list[str | None]:
+    """Split the visible GPUs into one CUDA_VISIBLE_DEVICES group per replica."""
+    if replicas == 1:
+        return [CUDA_VISIBLE_DEVICES]
+    devices = (
+        CUDA_VISIBLE_DEVICES.split(",")
+        if CUDA_VISIBLE_DEVICES
+        else [str(i) for i in range(replicas * gpus_per_replica)]
+    )
+    if len(devices) < replicas * gpus_per_replica:
+        raise ValueError(
+            f"{replicas} replicas with {gpus_per_replica} GPUs each need "
+            f"{replicas * gpus_per_replica} devices, got CUDA_VISIBLE_DEVICES={devices}"
+        )
+    return [
+        ",".join(devices[i * gpus_per_replica : (i + 1) * gpus_per_replica])
+        for i in range(replicas)
+    ]
 
-    # Execute the serve command
+
+@hydra.main(version_base=None, config_path="conf", config_name="defaults")
+def main(cfg: Config) -> None:
+    """Main function for starting the VLLM server replicas on consecutive ports."""
+    # Ensure the Hugging Face cache directory exists
+    if not os.path.exists(HUGGINGFACE_CACHE_DIR):
+        os.makedirs(HUGGINGFACE_CACHE_DIR, exist_ok=True)
+
+    # Ensure permissions for the cache directory
+    os.chmod(HUGGINGFACE_CACHE_DIR, 0o777)
+
+    readiness_file = ReadinessFile(cfg.serving.readiness_file)
+    readiness_file.reset()
+
+    replicas = cfg.serving.replicas
+    groups = device_groups(replicas, cfg.model.tensor_parallel_size)
+    base_urls = replica_base_urls(f"http://localhost:{cfg.vllm_port}/v1/", replicas)
+    launch_start = time.perf_counter()
+    processes = []
+    for i, devices in enumerate(groups):
+        vllm_command = build_vllm_command(cfg, cfg.vllm_port + i)
+        env = dict(os.environ)
+        if devices is not None:
+            env["CUDA_VISIBLE_DEVICES"] = devices
+        print(f"Running vllm command on devices {devices}: {shlex.join(vllm_command)}")
+        # Without a shell, terminating the process stops vLLM itself and not a wrapper
+        processes.append(subprocess.Popen(vllm_command, env=env))
+
+    exit_code = 0
     try:
-        print(f"Running vllm command: {' '.join(vllm_command)}")
-        subprocess.run(" ".join(vllm_command), shell=True, check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"Command failed with error: {e}")
+        # Wait until every replica serves and warm it up
+        ready_times = []
+        for base_url, process in zip(base_urls, processes):
+            wait_until_ready(
+                base_url,
+                API_KEY,
+                cfg.serving.ready_timeout_s,
+                cfg.serving.poll_interval_s,
+                process,
+            )
+            ready_times.append(time.perf_counter() - launch_start)
+        warmup_latencies = [
+            latency
+            for base_url in base_urls
+            for latency in warm_up(
+                base_url,
+                cfg.model.model_name,
+                API_KEY,
+                cfg.serving.warmup_requests,
+                cfg.serving.warmup_max_tokens,
+            )
+        ]
+        info = {
+            "model_name": cfg.model.model_name,
+            "model_name_short": cfg.model.model_name_short,
+            "base_urls": base_urls,
+            "time_to_ready_s": max(ready_times),
+            "replica_time_to_ready_s": ready_times,
+            "warmup_latencies_s": warmup_latencies,
+        }
+        readiness_file.write("ready", **info)
+        FileManager(cfg.serving.startup_log).append(json.dumps(info) + "\n")
+        print(f"Ready after {max(ready_times):.1f}s, startup metrics: {startup_metrics(info)}")
+
+        # Serve until one of the replicas exits
+        while all(process.poll() is None for process in processes):
+            time.sleep(1)
+        failed = [p.returncode for p in processes if p.returncode not in (None, 0)]
+        if failed:
+            print(f"Command failed with exit code {failed[0]}")
+            exit_code = failed[0]
+    # Failed probes and warm-up requests raise a URLError, which is an OSError
+    except (RuntimeError, TimeoutError, OSError) as e:
+        print(f"Server did not become ready: {e}")
+        readiness_file.write("failed", error=str(e))
+        exit_code = 1
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+        for process in processes:
+            process.wait()
+        if exit_code == 0:
+            readiness_file.write("stopped")
+
+    if exit_code:
+        sys.exit(exit_code)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,103 @@
+"""Shared fixtures of the test suite."""
+
+from pathlib import Path
+from typing import Callable, Iterator
+
+import pandas as pd
+import pytest
+from encourage.llm import ResponseWrapper
+from encourage.prompts import PromptCollection
+from encourage.utils.llm_mock import create_mock_response_wrapper
+from hydra import compose, initialize_config_dir
+
+from exp.data.finqa_qa import FinQADatasetCollection
+from exp.evaluation.config import Config
+from exp.inference.mock_server import MockServer, MockServerConfig, mock_overrides
+
+REPO_ROOT = Path(__file__).parents[1]
+# Metrics that need neither a GPU nor a download of a model, a dataset or NLTK data
+OFFLINE_METRICS = "[NumberMatch,MeanReciprocalRank,{RecallAtK:{k:1}},{RecallAtK:{k:3}}]"
+
+
+class RecordingRunner:
+    """Runner that answers every prompt with a mock response and records the batches."""
+
+    def __init__(self) -> None:
+        self.batches: list[PromptCollection] = []
+
+    def run(self, prompt_collection: PromptCollection, **kwargs: object) -> ResponseWrapper:
+        self.batches.append(prompt_collection)
+        return create_mock_response_wrapper(prompt_collection)
+
+
+def finqa_frame(num_samples: int = 6, num_contexts: int = 3) -> pd.DataFrame:
+    """Build a raw FinQA frame in which samples `i` and `i + num_contexts` share a context."""
+    return pd.DataFrame(
+        {
+            "id": [f"sample-{i}" for i in range(num_samples)],
+            "question": [f"What is the value of item {i}?" for i in range(num_samples)],
+            "answer": [str(i) for i in range(num_samples)],
+            "program_answer": [str(i) for i in range(num_samples)],
+            "program_solution": ["" for _ in range(num_samples)],
+            "context": [f"Report {i % num_contexts}: item values" for i in range(num_samples)],
+        }
+    )
+
+
+@pytest.fixture
+def dataset() -> FinQADatasetCollection:
+    """A small FinQA collection with six samples over three shared contexts."""
+    return FinQADatasetCollection(finqa_frame())
+
+
+@pytest.fixture
+def runner() -> RecordingRunner:
+    """A runner that records the prompts it gets."""
+    return RecordingRunner()
+
+
+@pytest.fixture
+def mock_server(monkeypatch) -> Iterator[MockServer]:
+    """A mock of the OpenAI-compatible server with a short latency."""
+    monkeypatch.setenv("VLLM_API_KEY", "EMPTY")
+    with MockServer(MockServerConfig(latency_s=0.01)) as server:
+        yield server
+
+
+@pytest.fixture
+def offline_overrides(tmp_path, monkeypatch) -> list[str]:
+    """Hydra overrides that keep a run offline and its caches and MLflow store in `tmp_path`.
+
+    The config paths are relative to the repository root, so the test runs from there.
+    """
+    monkeypatch.chdir(REPO_ROOT)
+    # Traces go to the global tracking URI, not to the one of the run. Newer MLflow versions
+    # than the locked one only accept the file store with the opt-in.
+    monkeypatch.setenv("MLFLOW_TRACKING_URI", f"file:{tmp_path / 'mlruns'}")
+    monkeypatch.setenv("MLFLOW_ALLOW_FILE_STORE", "true")
+    return [
+        f"mlflow.uri=file:{tmp_path / 'mlruns'}",
+        f"mlflow.spool_dir={tmp_path / 'spool'}",
+        f"metrics={OFFLINE_METRICS}",
+        "metric_worker.enabled=False",
+        f"response_cache.path={tmp_path / 'responses.sqlite'}",
+        f"vector_db.embedding_cache_path={tmp_path / 'embeddings.sqlite'}",
+    ]
+
+
+@pytest.fixture
+def mock_config(mock_server, offline_overrides) -> Callable[..., Config]:
+    """Compose the config of an offline run against the mock server, with extra overrides."""
+
+    def _compose(*overrides: str) -> Config:
+        with initialize_config_dir(config_dir=str(REPO_ROOT / "conf"), version_base=None):
+            return compose(
+                "defaults",
+                overrides=[
+                    *mock_overrides(mock_server.base_url, mock_server.config.model_name),
+                    *offline_overrides,
+                    *overrides,
+                ],
+            )  # ty: ignore
+
+    return _compose
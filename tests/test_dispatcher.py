@@ -0,0 +1,67 @@
+"""Tests of the asyncio dispatcher against the mock server."""
+
+import json
+
+from encourage.llm import BatchInferenceRunner, SamplingParams
+from encourage.prompts import PromptCollection
+from pydantic import BaseModel
+
+from exp.inference.dispatcher import AdaptiveConcurrency, AsyncDispatcher, DispatchingRunner
+from exp.inference.mock_server import MockServer
+from exp.inference.replicas import ReplicaPool
+
+
+class Answer(BaseModel):
+    """Structured answer that the mock server fills from the JSON schema."""
+
+    computed_formula: str
+    reasoning_steps: list[str]
+
+
+def test_dispatching_runner_answers_every_prompt_in_order(mock_server):
+    sampling_params = SamplingParams(temperature=0.0, max_tokens=64)
+    runner = DispatchingRunner(
+        BatchInferenceRunner(sampling_params, "mock-model", base_url=mock_server.base_url),
+        AsyncDispatcher(
+            mock_server.base_url,
+            "mock-model",
+            sampling_params,
+            AdaptiveConcurrency(max_in_flight=4, initial_in_flight=2),
+        ),
+    )
+    questions = [f"Question {i}?" for i in range(10)]
+    prompts = PromptCollection.create_prompts("Answer.", questions, template_name="default.j2")
+
+    responses = runner.run(prompts, response_format=Answer)
+
+    assert mock_server.requests == len(questions)
+    assert [response.user_prompt for response in responses] == questions
+    for prompt, response in zip(prompts.prompts, responses):
+        assert response.prompt_id == str(prompt.id)
+        assert response.sys_prompt == "Answer."
+        assert response.processing_time >= 0
+        Answer.model_validate(json.loads(response.response))
+
+
+def test_replica_pool_counts_the_requests_of_every_replica(mock_server):
+    with MockServer(mock_server.config) as second_server:
+        pool = ReplicaPool([mock_server.base_url, second_server.base_url])
+        dispatcher = AsyncDispatcher(
+            mock_server.base_url,
+            "mock-model",
+            SamplingParams(),
+            AdaptiveConcurrency(max_in_flight=4, initial_in_flight=4),
+            replica_pool=pool,
+        )
+        results = dispatcher.run([[{"role": "user", "content": f"{i}?"}] for i in range(12)])
+
+        stats = pool.stats()
+        assert all(result.error is None for result in results)
+        assert stats == {
+            "replica_0_completed": mock_server.requests,
+            "replica_1_completed": second_server.requests,
+        }
+        assert sum(stats.values()) == 12 and min(stats.values()) > 0
+
+        pool.reset_counters()
+        assert set(pool.stats().values()) == {0}
@@ -0,0 +1,65 @@
+"""Tests of the persistent embedding cache."""
+
+import numpy as np
+from encourage.prompts.context import Document
+
+from exp.retrieval.embedding_cache import CachedEmbeddingFunction, EmbeddingCache, create_rag
+
+
+class CountingModel:
+    """Embedding model that maps a text to a vector of its character counts."""
+
+    def __init__(self) -> None:
+        self.texts: list[str] = []
+
+    def __call__(self, input: list[str]) -> list[np.ndarray]:  # noqa: A002
+        self.texts.extend(input)
+        return [
+            np.array([text.count(char) + 1 for char in "aeiou"], dtype=np.float32) for text in input
+        ]
+
+
+def cached_function(tmp_path, model: CountingModel) -> CachedEmbeddingFunction:
+    function = CachedEmbeddingFunction("counting-model", EmbeddingCache(tmp_path / "emb.sqlite"))
+    function._embedding_function = model  # ty: ignore
+    return function
+
+
+def test_only_unknown_texts_are_embedded(tmp_path):
+    model = CountingModel()
+    function = cached_function(tmp_path, model)
+
+    first = function(["alpha", "beta", "alpha"])
+    second = function(["beta", "gamma"])
+
+    assert model.texts == ["alpha", "beta", "gamma"]
+    assert (function.hits, function.misses) == (2, 3)
+    np.testing.assert_array_equal(first[1], second[0])
+
+    # A new run reads the vectors from the database on disk
+    restarted = cached_function(tmp_path, CountingModel())
+    restarted(["alpha", "gamma"])
+    assert (restarted.hits, restarted.misses) == (2, 0)
+
+
+def test_rag_methods_embed_through_the_cache(tmp_path):
+    model = CountingModel()
+    function = cached_function(tmp_path, model)
+    documents = [Document(content=text) for text in ("aaa report", "eee report", "ooo report")]
+
+    rag = create_rag(
+        {
+            "method": "Base",
+            "context_collection": documents,
+            "collection_name": "test",
+            "embedding_function": function,
+            "top_k": 1,
+            "device": "cpu",
+        }
+    )
+    retrieved = rag.retrieve_contexts(["eee"])
+
+    assert rag.embedding_function is function
+    assert function.model_kwargs["device"] == "cpu"
+    assert model.texts == ["aaa report", "eee report", "ooo report", "eee"]
+    assert [document.id for document in retrieved[0]] == [documents[1].id]
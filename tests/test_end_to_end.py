@@ -0,0 +1,16 @@
+"""Smoke test of the end-to-end benchmark."""
+
+from exp.benchmark.end_to_end import _run_case
+
+
+def test_small_case_runs_end_to_end(tmp_path, monkeypatch, offline_overrides):
+    monkeypatch.setenv("VLLM_API_KEY", "EMPTY")
+
+    result = _run_case(
+        (20, 0.75, 200, 0.0, [*offline_overrides, "inference.batch_size=8"], str(tmp_path))
+    )
+
+    assert result["rows"] == 20
+    assert result["requests"]["count"] == 20
+    assert {"rag", "generation", "load_results", "metric/mrr"} <= set(result["stages"])
+    assert (tmp_path / "rows_20" / "inference_log.jsonl").exists()
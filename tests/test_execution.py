@@ -0,0 +1,35 @@
+"""Tests of the runner setup of the execution."""
+
+from encourage.llm import SamplingParams
+
+from exp.evaluation.execution import build_runner
+from exp.inference.runner import ProfilingRunner
+from exp.retrieval.embedding_cache import create_rag
+from exp.utils.profiler import profiling
+
+
+def test_built_runner_is_accepted_by_the_rag_methods(mock_config, mock_server, dataset):
+    cfg = mock_config("response_cache.enabled=True")
+    runner, response_cache = build_runner(cfg, SamplingParams(temperature=0.0, max_tokens=64))
+    rag = create_rag(
+        {
+            **cfg.rag,
+            "context_collection": dataset.get_context_collection(per_sample=True),
+            "collection_name": cfg.vector_db.collection_name,
+            "embedding_function": cfg.vector_db.embedding_function,
+            "top_k": cfg.vector_db.top_k,
+            "runner": runner,
+            "template_name": cfg.dataset.template_name,
+        }
+    )
+
+    assert isinstance(runner, ProfilingRunner)
+    with profiling() as profiler:
+        responses = dataset.run(rag, runner, "Answer.", batch_size=4)
+        dataset.run(rag, runner, "Answer.", batch_size=4)
+
+    assert len(responses) == mock_server.requests == len(dataset)
+    assert response_cache is not None and response_cache.hits == len(dataset)
+    # Two batches per run, the dispatcher records every request it sends
+    assert profiler.stage_calls["generation"] == 4
+    assert len(profiler.latencies) == len(dataset)
@@ -0,0 +1,28 @@
+"""Tests of the JSON backends of the file manager."""
+
+import numpy as np
+import pytest
+
+from exp.utils.file_manager import FileManager
+
+
+@pytest.mark.parametrize("json_backend", ["auto", "json"])
+def test_numpy_values_are_written_as_plain_json(tmp_path, json_backend):
+    lines = FileManager(tmp_path / "metrics.jsonl", json_backend=json_backend)
+    document = FileManager(tmp_path / "metrics.json", json_backend=json_backend)
+    record = {"score": np.float64(0.5), "raw": [np.float64(0.25), np.float64(1.0)]}
+
+    lines.write_jsonlines([record])
+    document.dump_json(record, pydantic_encoder=True)
+
+    assert lines.load_jsonlines() == [{"score": 0.5, "raw": [0.25, 1.0]}]
+    assert document.load_json() == {"score": 0.5, "raw": [0.25, 1.0]}
+
+
+def test_orjson_serializes_numpy_arrays_and_integers(tmp_path):
+    pytest.importorskip("orjson")
+    file_manager = FileManager(tmp_path / "sample.json", json_backend="orjson")
+
+    file_manager.dump_json({"count": np.int64(3), "flags": np.array([True, False])})
+
+    assert file_manager.load_json() == {"count": 3, "flags": [True, False]}
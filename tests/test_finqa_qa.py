@@ -0,0 +1,91 @@
+"""Tests of `FinQADatasetCollection.run`."""
+
+import numpy as np
+from encourage.llm import ResponseWrapper
+from encourage.rag import KnownContext
+from encourage.rag.base.config import KnownContextConfig
+
+from exp.data.finqa_qa import FinQADatasetCollection
+from exp.utils.inference_log import InferenceLog
+
+
+def known_context(dataset: FinQADatasetCollection, per_sample: bool = False) -> KnownContext:
+    return KnownContext(
+        KnownContextConfig(
+            context_collection=dataset.get_context_collection(per_sample),
+            collection_name="test",
+            embedding_function=None,
+            top_k=1,
+            template_name="default.j2",
+        )
+    )
+
+
+def assert_paired(responses: ResponseWrapper) -> None:
+    """Check that every response was sent with the context of its own sample."""
+    for response in responses:
+        reference = response.meta_data["reference_document"]
+        assert [document.id for document in response.context.documents] == [reference.id]
+
+
+def test_run_in_batches_pairs_contexts(dataset, runner):
+    responses = dataset.run(known_context(dataset), runner, "Answer.", batch_size=4)
+
+    assert [len(batch) for batch in runner.batches] == [4, 2]
+    assert [response.meta_data["id"] for response in responses] == dataset.columns["id"].tolist()
+    assert_paired(responses)
+
+
+def test_resume_sends_remaining_samples_with_their_contexts(dataset, runner, tmp_path):
+    inference_log = InferenceLog(tmp_path / "inference_log.jsonl")
+    done = dataset.run(known_context(dataset), runner, "Answer.", batch_size=2)
+    inference_log.append([response for response in done if response.meta_data["id"] != "sample-4"])
+
+    runner.batches.clear()
+    responses = dataset.run(
+        known_context(dataset), runner, "Answer.", inference_log=inference_log, batch_size=2
+    )
+
+    assert [response.meta_data["id"] for response in responses] == ["sample-4"]
+    assert_paired(responses)
+
+
+def test_shared_contexts_are_ingested_once_and_known_per_sample(dataset, runner):
+    documents = dataset.get_context_collection()
+    contexts = dataset.get_context_collection(per_sample=True)
+
+    assert len(documents) == 3
+    assert len(contexts) == len(dataset) == 6
+    assert {context.documents[0].id for context in contexts} == {doc.id for doc in documents}
+
+    responses = known_context(dataset, per_sample=True).run(
+        runner, "Answer.", dataset.user_prompts, list(dataset.prompt_meta_data)
+    )
+    assert_paired(responses)
+
+
+def test_prefix_ordering_sends_every_prompt_with_its_own_context(dataset, runner):
+    responses = dataset.run(
+        known_context(dataset), runner, "Answer.", batch_size=4, prefix_ordering=True
+    )
+
+    sent = [prompt.meta_data["id"] for batch in runner.batches for prompt in batch.prompts]
+    ids = dataset.columns["id"].tolist()
+    assert dataset.prefix_schedule is not None
+    assert sent == [ids[i] for i in dataset.prefix_schedule.order] != ids
+    assert [response.meta_data["id"] for response in responses] == ids
+    assert_paired(responses)
+
+
+def test_length_buckets_apply_without_prefix_ordering(dataset, runner):
+    dataset.prompt_tokens = np.array([10, 100, 10, 1000, 100, 10])
+
+    responses = dataset.run(
+        known_context(dataset), runner, "Answer.", batch_size=4, length_buckets=True
+    )
+
+    sent = [prompt.meta_data["id"] for batch in runner.batches for prompt in batch.prompts]
+    ids = dataset.columns["id"].tolist()
+    assert sent == [ids[i] for i in (3, 1, 4, 0, 2, 5)]
+    assert [response.meta_data["id"] for response in responses] == ids
+    assert_paired(responses)
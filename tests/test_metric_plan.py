@@ -0,0 +1,64 @@
+"""Tests of the metric families of the metric plan."""
+
+import uuid
+
+import pytest
+from encourage.llm import Response, ResponseWrapper
+from encourage.metrics import RecallAtK
+from encourage.prompts.context import Context, Document
+from encourage.prompts.meta_data import MetaData
+
+from exp.evaluation.metric_plan import PlannedMetric, recall_at_k_family
+
+
+def doc(number: int, score: float = 0.0) -> Document:
+    return Document(content=f"document {number}", score=score, id=uuid.UUID(int=number))
+
+
+def response(request_id: str, references: list[Document], retrieved: list[Document]) -> Response:
+    return Response(
+        request_id=request_id,
+        prompt_id=request_id,
+        sys_prompt="",
+        user_prompt="",
+        response="",
+        meta_data=MetaData(
+            {"reference_document": references[0] if len(references) == 1 else references}
+        ),
+        context=Context.from_documents(retrieved),
+    )
+
+
+@pytest.fixture
+def responses() -> ResponseWrapper:
+    return ResponseWrapper(
+        [
+            # The retrieved documents are not in score order
+            response("a", [doc(1)], [doc(2, 0.9), doc(3, 0.1), doc(1, 0.5)]),
+            response("b", [doc(1)], [doc(1, 0.2), doc(2, 0.8), doc(3, 0.6)]),
+            response("c", [doc(4), doc(5)], [doc(5, 0.3), doc(6, 0.7), doc(4, 0.1), doc(7, 0.2)]),
+            # Ties are broken by the document ID
+            response("d", [doc(8)], [doc(8, 0.5), doc(9, 0.5)]),
+            response("e", [doc(10)], [doc(11, 0.4), doc(12, 0.3)]),
+        ]
+    )
+
+
+def test_recall_at_k_matches_encourage(responses):
+    ks = [1, 2, 3]
+    members = [PlannedMetric("RecallAtK", {"k": k}, RecallAtK(k)) for k in ks]
+
+    outputs = dict(recall_at_k_family(members, responses))
+
+    for k in ks:
+        expected = RecallAtK(k)(responses)
+        assert outputs[f"recall{k}"].score == pytest.approx(expected.score)
+        assert sorted(outputs[f"recall{k}"].raw) == pytest.approx(sorted(expected.raw))
+
+
+def test_recall_at_k_validates_the_responses(responses):
+    responses.response_data[0].context = Context()
+    members = [PlannedMetric("RecallAtK", {"k": 1}, RecallAtK(1))]
+
+    with pytest.raises(ValueError, match="documents"):
+        recall_at_k_family(members, responses)
@@ -0,0 +1,27 @@
+"""Tests of the resident metric worker."""
+
+import stat
+import threading
+
+from exp.evaluation.metric_worker import MetricWorker, serve, wait_for_metric_worker
+
+
+def test_worker_is_only_reachable_with_its_key(tmp_path):
+    socket_path = tmp_path / "worker.sock"
+    key_path = tmp_path / "worker.sock.key"
+    server = threading.Thread(
+        target=serve, args=(socket_path, MetricWorker(None)), kwargs={"exit_after_idle_s": 2.0}
+    )
+    server.start()
+
+    worker = wait_for_metric_worker(socket_path, timeout_s=10.0)
+
+    assert worker.stats()["requests"] == 0
+    # Neither the group nor others can access the socket
+    assert stat.S_IMODE(socket_path.stat().st_mode) & 0o077 == 0
+    assert stat.S_IMODE(key_path.stat().st_mode) == 0o600
+    assert len(key_path.read_bytes()) == 32
+
+    server.join(timeout=10.0)
+    assert not server.is_alive()
+    assert not socket_path.exists() and not key_path.exists()
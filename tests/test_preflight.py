@@ -0,0 +1,46 @@
+"""Tests of the token-length preflight."""
+
+from exp.inference.preflight import preflight
+
+
+class WordTokenizer:
+    """Tokenizer with one token per word and without a chat template."""
+
+    def __call__(self, texts: str | list[str], add_special_tokens: bool = False) -> dict:
+        if isinstance(texts, str):
+            return {"input_ids": texts.split()}
+        return {"input_ids": [text.split() for text in texts]}
+
+    def decode(self, ids: list[str], skip_special_tokens: bool = True) -> str:
+        return " ".join(ids)
+
+    def apply_chat_template(self, *args: object, **kwargs: object) -> list[int]:
+        raise ValueError("No chat template")
+
+
+def test_truncation_only_shortens_the_known_contexts_of_the_prompts(dataset):
+    documents = {document.id: document.content for document in dataset.get_context_collection()}
+
+    # One token of system prompt, seven of question and four of context
+    report = preflight(dataset, WordTokenizer(), "Answer.", "", budget=10, policy="truncate")
+
+    assert (report.over_budget, report.truncated_contexts, report.rejected_ids) == (6, 3, [])
+    assert report.prompt_tokens == [10] * 6
+    assert {doc.id: doc.content for doc in dataset.get_context_collection()} == documents
+    for context, meta_data in zip(
+        dataset.get_context_collection(per_sample=True), dataset.prompt_meta_data
+    ):
+        [document] = context.documents
+        assert document.id == meta_data["reference_document"].id
+        assert document.content == " ".join(meta_data["reference_document"].content.split()[:2])
+
+
+def test_retrieved_documents_are_only_reported(dataset):
+    report = preflight(
+        dataset, WordTokenizer(), "Answer.", "", budget=10, policy="truncate", top_k=2
+    )
+
+    assert report.prompt_tokens == [16] * 6
+    assert (report.over_budget, report.truncated_contexts, report.rejected_ids) == (6, 0, [])
+    assert len(dataset) == 6
+    assert dataset.prompt_contexts == {}
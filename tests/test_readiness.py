@@ -0,0 +1,21 @@
+"""Tests of the readiness file of the launcher."""
+
+import pytest
+
+from exp.inference.readiness import ReadinessFile
+
+
+@pytest.mark.parametrize("status", ["failed", "stopped"])
+def test_wait_stops_when_the_launcher_ends_without_servers(tmp_path, status):
+    readiness_file = ReadinessFile(tmp_path / "ready.json")
+    readiness_file.write(status, error="warm-up request failed")
+
+    with pytest.raises(RuntimeError):
+        readiness_file.wait(timeout_s=60.0, poll_interval_s=0.01)
+
+
+def test_wait_returns_the_info_of_ready_servers(tmp_path):
+    readiness_file = ReadinessFile(tmp_path / "ready.json")
+    readiness_file.write("ready", base_urls=["http://localhost:18123/v1/"])
+
+    assert readiness_file.wait(timeout_s=1.0)["base_urls"] == ["http://localhost:18123/v1/"]
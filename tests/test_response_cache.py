@@ -0,0 +1,90 @@
+"""Tests of the response cache."""
+
+from encourage.llm import ResponseWrapper, SamplingParams
+from encourage.prompts import PromptCollection
+from encourage.rag.base.config import KnownContextConfig
+from encourage.utils.llm_mock import create_mock_response_wrapper
+from pydantic import BaseModel
+
+from exp.inference.response_cache import CachedRunner, ResponseCache
+from exp.inference.runner import sub_collection
+from exp.inference.structured_output import StructuredOutputStage
+
+
+def prompts(*questions: str) -> PromptCollection:
+    return PromptCollection.create_prompts("Answer.", list(questions), template_name="default.j2")
+
+
+def test_repeated_prompts_are_answered_from_the_cache(runner, tmp_path):
+    cache = ResponseCache(tmp_path / "responses.sqlite")
+    cached_runner = CachedRunner(runner, cache, "mock-model", SamplingParams())
+
+    cached_runner.run(prompts("a?", "b?"))
+    responses = cached_runner.run(prompts("b?", "c?"))
+
+    assert [len(batch) for batch in runner.batches] == [2, 1]
+    assert runner.batches[1].prompts[0].conversation.get_last_message_by_user() == "c?"
+    assert [response.user_prompt for response in responses] == ["b?", "c?"]
+    assert (cache.hits, cache.misses) == (1, 3)
+
+
+def test_cached_runner_is_accepted_as_rag_runner(runner, tmp_path):
+    cache = ResponseCache(tmp_path / "responses.sqlite")
+    cached_runner = CachedRunner(runner, cache, "mock-model", SamplingParams())
+
+    config = KnownContextConfig(
+        context_collection=[],
+        collection_name="test",
+        embedding_function=None,
+        top_k=1,
+        runner=cached_runner,
+    )
+
+    assert config.runner is cached_runner
+
+
+class Answer(BaseModel):
+    """Structured output with a single field."""
+
+    value: str
+
+
+class ScriptedRunner:
+    """Runner that answers every prompt with the same text and records the batches."""
+
+    def __init__(self, text: str) -> None:
+        self.text = text
+        self.batches: list[PromptCollection] = []
+
+    def run(self, prompt_collection: PromptCollection, **kwargs: object) -> ResponseWrapper:
+        self.batches.append(prompt_collection)
+        responses = create_mock_response_wrapper(prompt_collection)
+        for response in responses:
+            response.response = self.text
+        return responses
+
+
+def test_recovered_retries_replace_invalid_responses_in_the_cache(tmp_path):
+    cache = ResponseCache(tmp_path / "responses.sqlite")
+    params = SamplingParams(temperature=0.0, max_tokens=64)
+    collection = prompts("a?", "b?")
+    stage = StructuredOutputStage(Answer, max_retries=1)
+    retry_runner = CachedRunner(ScriptedRunner('{"value": "1"}'), cache, "mock-model", params)
+
+    responses = stage.process(
+        CachedRunner(ScriptedRunner("truncated {"), cache, "mock-model", params).run(
+            collection, response_format=Answer
+        ),
+        lambda positions: retry_runner.run(
+            sub_collection([collection.prompts[i] for i in positions]), response_format=Answer
+        ),
+    )
+    assert stage.recovered == 2
+
+    # A rerun gets the recovered responses from the cache and sends nothing
+    rerun_runner = ScriptedRunner("truncated {")
+    rerun = CachedRunner(rerun_runner, cache, "mock-model", params).run(
+        prompts("a?", "b?"), response_format=Answer
+    )
+    assert rerun_runner.batches == []
+    assert [response.response for response in rerun] == [r.response for r in responses]
@@ -0,0 +1,47 @@
+"""Tests of the retrieval-only runs."""
+
+from encourage.llm import ResponseWrapper
+from encourage.metrics import MeanReciprocalRank
+from encourage.prompts.context import Document
+
+from exp.retrieval.retrieval_only import RETRIEVAL_LOG_NAME, load_retrieval_responses, run_retrieval
+
+
+class RankingRetriever:
+    """Retriever that ranks the report of the item in the query first."""
+
+    def __init__(self, documents: list[Document]) -> None:
+        self.documents = documents
+
+    def retrieve_contexts(self, queries: list[str]) -> list[list[Document]]:
+        results = []
+        for query in queries:
+            report = f"Report {int(query.rstrip('?').split()[-1]) % len(self.documents)}:"
+            ranked = sorted(
+                self.documents, key=lambda document: not document.content.startswith(report)
+            )
+            results.append(
+                [
+                    Document(content=document.content, score=1.0 - rank / 10, id=document.id)
+                    for rank, document in enumerate(ranked)
+                ]
+            )
+        return results
+
+
+def test_retrieval_log_round_trips_into_responses(dataset, tmp_path):
+    documents = dataset.get_context_collection()
+    retriever = RankingRetriever(documents)
+
+    count = run_retrieval(retriever, dataset, tmp_path / RETRIEVAL_LOG_NAME, batch_size=4)
+    responses = load_retrieval_responses(tmp_path)
+
+    assert count == len(responses) == len(dataset)
+    expected = retriever.retrieve_contexts(dataset._generate_retrieval_queries())
+    for response, meta_data, retrieved in zip(responses, dataset.prompt_meta_data, expected):
+        assert response.meta_data["id"] == meta_data["id"]
+        assert response.meta_data["reference_document"].id == meta_data["reference_document"].id
+        assert [(document.id, document.score) for document in response.context.documents] == [
+            (document.id, document.score) for document in retrieved
+        ]
+    assert MeanReciprocalRank()(ResponseWrapper(responses)).score == 1.0
@@ -0,0 +1,28 @@
+"""Tests of the sharded execution and the merge of the shards."""
+
+from exp.benchmark.synthetic import synthetic_finqa_frame
+from exp.data.finqa_qa import normalize_finqa_frame
+from exp.evaluation.execution import execute, prepare_resources
+from exp.evaluation.sharding import merge
+from exp.utils.inference_log import load_responses
+
+
+def test_two_mock_shards_are_merged_with_paired_contexts(mock_config, mock_server, tmp_path):
+    output_dir = tmp_path / "sharded"
+    df = synthetic_finqa_frame(16, questions_per_context=2, context_length=200)
+
+    for shard_index in range(2):
+        cfg = mock_config(
+            "sharding.num_shards=2", f"sharding.shard_index={shard_index}", "inference.batch_size=3"
+        )
+        qa_dataset = normalize_finqa_frame(df, list(cfg.dataset.meta_data_keys))
+        execute(cfg, output_dir, prepare_resources(cfg, qa_dataset))  # ty: ignore
+    report = merge(mock_config("sharding.num_shards=2"), output_dir)
+
+    assert report.complete and report.duplicate_ids == report.unexpected_ids == 0
+    assert report.samples == mock_server.requests == len(df)
+    responses = load_responses(output_dir)
+    assert sorted(response.meta_data["id"] for response in responses) == sorted(df["id"])
+    for response in responses:
+        reference = response.meta_data["reference_document"]
+        assert [document.id for document in response.context.documents] == [reference.id]